@@ -0,0 +1,324 @@
+"""
+Archive of every received line, written by a thread off the event loop.
+
+Protocols hand over the bytes of the complete lines of each read with a
+timestamp (a deque append), the writer thread splits, indexes and writes
+them in blocks, once per `flush_interval`:
+
+    segment: MAGIC, then blocks
+    block:   BLOCK header (flags, table length, payload length, first and
+             last timestamp), channel table, payload
+    table:   '<H' count, then '<B' length + name for each channel in the block
+    payload: records, zlib compressed as a whole if flags & COMPRESSED
+    record:  RECORD (timestamp, channel number in the table, length) + line
+
+Channel number 0 is for lines without a channel. Segments are closed once
+over `segment_size` bytes, and get an index file listing their blocks with
+offset, time range and channels, so reading one channel over a time range
+only decompresses the blocks it appears in. The segment being written has
+no index yet, its block headers and tables are read instead.
+
+ArchiveReader reads segments through mmap, its lines can be replayed
+(see tests/benchmarks/fake_twitch.py).
+"""
+
+from collections import deque
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from . import parser
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PTWARC1\n'
+COMPRESSED = 1
+
+BLOCK = struct.Struct('<BIIdd')
+RECORD = struct.Struct('<dHI')
+COUNT = struct.Struct('<H')
+NAME_LENGTH = struct.Struct('<B')
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+
+def _channel(line: bytes) -> str:
+    # Only lines with a #channel first parameter are worth parsing
+    if b' #' not in line:
+        return ''
+    return parser.parse(line.decode('utf8', 'ignore')).channel or ''
+
+
+def _segment_number(name: str, prefix: str):
+    if not (name.startswith(prefix + '-') and name.endswith(SEGMENT_SUFFIX)):
+        return None
+    try:
+        return int(name[len(prefix) + 1:-len(SEGMENT_SUFFIX)])
+    except ValueError:
+        return None
+
+
+def segments(directory: str, prefix: str = 'archive'):
+    """
+    Paths of the segments in directory, oldest first.
+    """
+    numbered = []
+    for name in os.listdir(directory):
+        number = _segment_number(name, prefix)
+        if number is not None:
+            numbered.append((number, os.path.join(directory, name)))
+    return [path for _, path in sorted(numbered)]
+
+
+class ArchiveWriter:
+    def __init__(self, directory: str, prefix: str = 'archive', segment_size: int = 64 * 2 ** 20,
+                 compress: bool = True, flush_interval: float = 1.0, clock=time.time):
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        # (timestamp, bytes of complete lines), appended from the loop,
+        # consumed by the thread
+        self.pending = deque()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._thread = None
+        # Serializes writes between the thread and flush()
+        self._lock = threading.Lock()
+
+        self._file = None
+        self._path = None
+        self._number = 0
+        # [offset, first, last, channels] of the blocks of the open segment
+        self._blocks = []
+        # Totals, for logs and tests
+        self.lines = 0
+        self.blocks = 0
+
+    def feed(self, data, timestamp: float = None):
+        """
+        Archive the complete lines in data, called from the loop.
+        """
+        self.pending.append((self.clock() if timestamp is None else timestamp, data))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        existing = segments(self.directory, self.prefix)
+        if existing:
+            self._number = _segment_number(os.path.basename(existing[-1]), self.prefix)
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='pytwitcher-archive', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Write what is pending, index the open segment and stop the thread.
+        """
+        if self._thread is not None:
+            self._closing = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            self._close_segment()
+
+    def _run(self):
+        while not self._closing:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write the archive')
+
+    def flush(self):
+        """
+        Write the pending lines as one block, in the calling thread.
+        """
+        with self._lock:
+            pending = self.pending
+            batch = []
+            while pending:
+                batch.append(pending.popleft())
+            if batch:
+                self._write_block(batch)
+
+    def _write_block(self, batch):
+        channels = {'': 0}
+        names = ['']
+        records = []
+        first = last = None
+        for timestamp, data in batch:
+            for line in bytes(data).split(b'\n'):
+                if line.endswith(b'\r'):
+                    line = line[:-1]
+                if not line:
+                    continue
+                channel = _channel(line)
+                number = channels.get(channel)
+                if number is None:
+                    number = channels[channel] = len(names)
+                    names.append(channel)
+                records.append(RECORD.pack(timestamp, number, len(line)))
+                records.append(line)
+            if first is None:
+                first = timestamp
+            last = timestamp
+        if not records:
+            return
+
+        table = [COUNT.pack(len(names))]
+        for name in names:
+            encoded = name.encode('utf8')
+            table.append(NAME_LENGTH.pack(len(encoded)))
+            table.append(encoded)
+        table = b''.join(table)
+        payload = b''.join(records)
+        flags = 0
+        if self.compress:
+            payload = zlib.compress(payload)
+            flags |= COMPRESSED
+
+        if self._file is None:
+            self._open_segment()
+        offset = self._file.tell()
+        self._file.write(BLOCK.pack(flags, len(table), len(payload), first, last))
+        self._file.write(table)
+        self._file.write(payload)
+        self._file.flush()
+        self._blocks.append([offset, first, last, names[1:]])
+        self.lines += len(records) // 2
+        self.blocks += 1
+
+        if self._file.tell() >= self.segment_size:
+            self._close_segment()
+
+    def _open_segment(self):
+        self._number += 1
+        self._path = os.path.join(self.directory, '{}-{:08d}{}'.format(self.prefix, self._number, SEGMENT_SUFFIX))
+        logger.debug('Opening archive segment %s', self._path)
+        self._file = open(self._path, 'wb')
+        self._file.write(MAGIC)
+        self._blocks = []
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        index_path = self._path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+        with open(index_path + '.tmp', 'w', encoding='utf8') as f:
+            json.dump({'blocks': self._blocks}, f)
+        os.replace(index_path + '.tmp', index_path)
+        logger.debug('Closed archive segment %s, %d blocks', self._path, len(self._blocks))
+        self._blocks = []
+
+
+def _read_index(path: str, view):
+    """
+    [offset, first, last, channels] of the blocks of a segment, from its
+    index file or from its block headers if there is none (yet).
+    """
+    index_path = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+    try:
+        with open(index_path, encoding='utf8') as f:
+            return json.load(f)['blocks']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    blocks = []
+    offset = len(MAGIC)
+    size = len(view)
+    while offset + BLOCK.size <= size:
+        _, table_length, payload_length, first, last = BLOCK.unpack_from(view, offset)
+        end = offset + BLOCK.size + table_length + payload_length
+        if end > size:
+            # Being written
+            break
+        names = _read_table(view, offset + BLOCK.size)
+        blocks.append([offset, first, last, names[1:]])
+        offset = end
+    return blocks
+
+
+def _read_table(view, offset: int):
+    count, = COUNT.unpack_from(view, offset)
+    offset += COUNT.size
+    names = []
+    for _ in range(count):
+        length, = NAME_LENGTH.unpack_from(view, offset)
+        offset += NAME_LENGTH.size
+        names.append(str(view[offset:offset + length], 'utf8'))
+        offset += length
+    return names
+
+
+class ArchiveReader:
+    def __init__(self, directory: str, prefix: str = 'archive'):
+        self.directory = directory
+        self.prefix = prefix
+
+    def read(self, channel: str = None, start: float = None, end: float = None):
+        """
+        Yield (timestamp, line) of the archived lines, oldest first, only
+        those of channel and between the start and end timestamps if given.
+        """
+        for path in segments(self.directory, self.prefix):
+            yield from self._read_segment(path, channel, start, end)
+
+    def lines(self, channel: str = None, start: float = None, end: float = None):
+        for _, line in self.read(channel, start, end):
+            yield line
+
+    def _read_segment(self, path, channel, start, end):
+        with open(path, 'rb') as f:
+            try:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return
+        with view:
+            if view[:len(MAGIC)] != MAGIC:
+                logger.warning('%s is not an archive segment', path)
+                return
+            for offset, first, last, names in _read_index(path, view):
+                if (start is not None and last < start) or (end is not None and first > end):
+                    continue
+                if channel is not None and channel not in names:
+                    continue
+                yield from self._read_block(view, offset, channel, start, end)
+
+    def _read_block(self, view, offset, channel, start, end):
+        flags, table_length, payload_length, _, _ = BLOCK.unpack_from(view, offset)
+        names = _read_table(view, offset + BLOCK.size)
+        number = None if channel is None else names.index(channel)
+        offset += BLOCK.size + table_length
+        payload = view[offset:offset + payload_length]
+        if flags & COMPRESSED:
+            payload = zlib.decompress(payload)
+
+        position = 0
+        size = len(payload)
+        while position < size:
+            timestamp, line_channel, length = RECORD.unpack_from(payload, position)
+            position += RECORD.size
+            if (
+                (number is None or line_channel == number)
+                and (start is None or timestamp >= start)
+                and (end is None or timestamp <= end)
+            ):
+                yield timestamp, str(payload[position:position + length], 'utf8', 'ignore')
+            position += length
@@ -1,7 +1,9 @@
 import asyncio
+import collections
+import functools
 import importlib
 import logging
-import random
+import os
 import signal
 import ssl
 import sys
@@ -9,27 +11,79 @@ import traceback
 
 import certifi
 
+from . import archive
+from . import commands
+from . import connection
+from . import dispatcher
+from . import metrics
+from . import outbound
+from . import parser
 from . import protocol
+from . import ratelimit
 from . import registry
+from . import spam
+from . import state
 from . import utils
 
 
 logger = logging.getLogger(__name__)
 
 
+def _mtime(module):
+    try:
+        return os.path.getmtime(module.__file__)
+    except (AttributeError, TypeError, OSError):
+        return None
+
+
 class IrcObject:
 
     HOST = 'irc.chat.twitch.tv'
     CAPABILITIES = ('membership', 'commands', 'tags')
 
     DEFAULTS = {
+        'archive_compress': True,
+        'archive_dir': None,
+        'archive_flush_interval': 1,
+        'archive_segment_size': 64 * 2 ** 20,
+        'buffered_protocol': False,
+        'channels_per_shard': 0,
+        'command_prefix': '!',
+        'dispatch_drop_pending': 0,
+        'dispatch_max_pending': 0,
+        'dispatch_max_per_event': 0,
+        'dispatch_max_tasks': 0,
+        'dispatch_serial_channels': False,
+        'eager_listeners': False,
         'encoding': 'utf8',
         'flood_delay': 30,
+        'flood_delay_join': 10,
+        'flood_delay_whisper': 1,
         'flood_rate_elevated': 100,
+        'flood_rate_join': 20,
         'flood_rate_normal': 20,
+        'flood_rate_whisper': 3,
+        'keepalive_interval': 60,
+        'keepalive_timeout': 20,
+        'metrics': False,
+        'metrics_host': '127.0.0.1',
+        'metrics_port': 0,
         'nick': None,
         'password': None,
+        'reconnect_delay': 1,
+        'reconnect_max_delay': 60,
+        'send_queue_policy': outbound.ERROR,
+        'send_queue_size': 0,
+        'skip_rejected': True,
+        'spam_distance': 6,
+        'spam_filter': None,
+        'spam_similarity': None,
+        'spam_threshold': 3,
+        'spam_window': 10,
+        'spam_window_size': 256,
         'ssl': True,
+        'write_batch_window': 0,
+        'write_batching': True,
     }
 
     def __init__(self, loop: asyncio.BaseEventLoop = None, **config):
@@ -47,17 +101,70 @@ class IrcObject:
 
         self.encoding = self.config['encoding']
         self.registry = registry.Registry(self.config)
-        self.queue = asyncio.Queue(loop=self.loop)
+        # metrics.Metrics if enabled, None otherwise (hot paths check for None)
+        self.metrics = metrics.Metrics() if self.config['metrics'] else None
+        self.registry.metrics = self.metrics
+        self.registry.commands.cooldowns.clock = self.loop.time
+        self.rate_limiter = ratelimit.RateLimiter(self.config, self.loop.time)
+        # Chat modes and our badges per channel
+        self.state = state.StateCache(self.loop.time)
+        # archive.ArchiveWriter protocols feed every received line to, if any
+        self.archive = None
+        if self.config['archive_dir']:
+            self.archive = archive.ArchiveWriter(
+                self.config['archive_dir'],
+                segment_size=self.config['archive_segment_size'],
+                compress=self.config['archive_compress'],
+                flush_interval=self.config['archive_flush_interval'],
+            )
+        # spam.SpamFilter run on PRIVMSGs before dispatch, if enabled
+        # (spam_filter being spam.DROP or spam.COLLAPSE)
+        self.spam_filter = None
+        if self.config['spam_filter']:
+            self.spam_filter = spam.SpamFilter(
+                self.loop,
+                mode=self.config['spam_filter'],
+                window=self.config['spam_window'],
+                threshold=self.config['spam_threshold'],
+                size=self.config['spam_window_size'],
+                similarity=self.config['spam_similarity'],
+                distance=self.config['spam_distance'],
+                on_collapse=self._spam_collapsed,
+                metrics=self.metrics,
+            )
+        self.dispatcher = dispatcher.Dispatcher(
+            self.loop,
+            max_tasks=self.config['dispatch_max_tasks'],
+            max_per_event=self.config['dispatch_max_per_event'],
+            serial_channels=self.config['dispatch_serial_channels'],
+            max_pending=self.config['dispatch_max_pending'],
+            drop_pending=self.config['dispatch_drop_pending'],
+            on_pause=self.pause_reading,
+            on_resume=self.resume_reading,
+            metrics=self.metrics,
+        )
+
+        # With channels_per_shard, channels are spread over as many
+        # connections as needed, all feeding the same registry
+        self.connections = [connection.Connection(self, 0)]
+        # channel -> connection it was joined on
+        self.channels = {}
+        self.running = False
 
-        asyncio.ensure_future(self._process_queue(), loop=self.loop)
+        # workers.WorkerPool messages are also fanned out to, if any
+        self.workers = None
+        # plugin module name -> modification time of its file when imported
+        self.plugin_modules = {}
+
+        if self.metrics is not None:
+            self.metrics.add_collector(self._collect_metrics)
 
     def load_plugin(self, name: str):
         # NOTE: name is full path to the plugin, eg path.Plugin, not path
         logger.debug('Trying to load %s', name)
-        if name in self.registry.plugins:
-            return
-
         module_name, _, class_name = name.rpartition('.')
+        if class_name in self.registry.plugins:
+            return
 
         try:
             module = importlib.import_module(module_name)
@@ -72,8 +179,68 @@ class IrcObject:
             raise ValueError('%s has no attribute %s', module_name, class_name)
 
         self.registry.add_plugin(klass(self))
+        self.plugin_modules.setdefault(module_name, _mtime(module))
         logger.info('Loaded `%s`', name)
 
+    def reload(self, names=None) -> bool:
+        """
+        Hot reload the plugins whose module changed on disk since imported,
+        or the plugins named in names (class names) whatever their files.
+
+        Modules are re-imported and new plugin instances registered in a
+        copy of the registry, swapped in at once when everything worked:
+        on error, the loaded plugins are kept. Events already dispatched
+        finish on the old instances. A new instance having a `reloaded`
+        method gets called with the one it replaces, to carry state over.
+        """
+        modules = {}
+        for plugin in self.registry.plugins.values():
+            module_name = type(plugin).__module__
+            module = sys.modules.get(module_name)
+            if module is None:
+                continue
+            if names is not None:
+                if type(plugin).__name__ in names:
+                    modules[module_name] = module
+            elif module_name in self.plugin_modules and _mtime(module) != self.plugin_modules[module_name]:
+                modules[module_name] = module
+        if not modules:
+            logger.info('No plugin to reload')
+            return False
+
+        old_plugins = [
+            plugin for plugin in self.registry.plugins.values() if type(plugin).__module__ in modules
+        ]
+        try:
+            for module_name, module in modules.items():
+                logger.info('Re-importing %s', module_name)
+                modules[module_name] = importlib.reload(module)
+            new_plugins = []
+            for old in old_plugins:
+                klass = getattr(modules[type(old).__module__], type(old).__name__)
+                plugin = klass(self)
+                reloaded = getattr(plugin, 'reloaded', None)
+                if reloaded is not None:
+                    reloaded(old)
+                new_plugins.append(plugin)
+            new_registry = self.registry.replace_plugins(new_plugins)
+        except Exception:
+            logger.exception('Reloading %s failed, keeping the loaded plugins', ', '.join(modules))
+            return False
+
+        self.registry = new_registry
+        for module_name, module in modules.items():
+            self.plugin_modules[module_name] = _mtime(module)
+        for old in old_plugins:
+            unloader = getattr(old, 'unload', None)
+            if unloader is not None:
+                try:
+                    unloader()
+                except Exception:
+                    logger.exception('Error when unloading %s', type(old).__name__)
+        logger.info('Reloaded %s', ', '.join(type(plugin).__name__ for plugin in old_plugins))
+        return True
+
     def unload_plugin(self, name: str):
         plugin = self.registry.remove_plugin(name)
         del plugin
@@ -112,25 +279,115 @@ class IrcObject:
                 pass
 
     def notify(self, listener_name, *args, **kwargs):
+        try:
+            handles, ons = self.registry.dispatch_table[listener_name]
+        except KeyError:
+            return
         logger.debug('Received notify request %s with args %s, %s', listener_name, args, kwargs)
-        async_listener = 'on_' + listener_name
-        sync_listener = 'handle_' + listener_name
 
-        if sync_listener in self.registry.listeners:
-            for func in self.registry.listeners[sync_listener]:
-                # FIXME: doesn't handle errors
+        message = args[0] if args else kwargs.get('message')
+        metrics_ = self.metrics
+        for func, check in handles:
+            if check is not None and (message is None or not check(message)):
+                continue
+            start = metrics.clock() if metrics_ is not None else 0
+            try:
                 func(*args, **kwargs)
-
-        if async_listener in self.registry.listeners:
-            for coro in self.registry.listeners[async_listener]:
-                asyncio.ensure_future(self._run_listener(coro, listener_name, *args, **kwargs), loop=self.loop)
+            except Exception:
+                # One failing listener doesn't prevent the others
+                logger.exception('Error in %s listener %s', listener_name, func)
+            if metrics_ is not None:
+                metrics_.observe('pytwitcher_callback_seconds', metrics.clock() - start, (metrics.callback_name(func),))
+
+        if ons:
+            submit = self.dispatcher.submit_eager if self.config['eager_listeners'] else self.dispatcher.submit
+            for coro, check in ons:
+                if check is not None and (message is None or not check(message)):
+                    continue
+                submit(coro, self._run_listener, (coro, listener_name) + args, kwargs)
 
     def process_data(self, data):
         logger.debug('Processing data from IRC: %s', data)
-        for match, events in self.registry.get_event_matches(data):
-            match = match.groupdict()
+        if self.metrics is None:
+            message = parser.parse(data)
+        else:
+            start = metrics.clock()
+            message = parser.parse(data)
+            self.metrics.observe('pytwitcher_parse_seconds', metrics.clock() - start)
+        if self.spam_filter is not None and message.command == 'PRIVMSG' and not self.spam_filter.allow(message):
+            return
+        if self.workers is not None:
+            self.workers.dispatch(message)
+        self.process_message(message)
+
+    def _spam_collapsed(self, message: parser.IrcMessage, count: int):
+        # One event for the copies the spam filter held back
+        self.notify('spam', message, count)
+
+    def process_message(self, message: parser.IrcMessage):
+        submit = self.dispatcher.submit
+        channel = message.channel
+        for irc_event in self.registry.get_command_events(message.command, channel):
+            if irc_event.filter is not None and not irc_event.filter.matches(message):
+                continue
+            submit(irc_event, irc_event.callback, (message,), channel=channel)
+
+        for match, events in self.registry.get_event_matches(message.raw, message.command, channel):
+            kwargs = None
             for event in events:
-                asyncio.ensure_future(event.callback(**match), loop=self.loop)
+                if event.filter is not None and not event.filter.matches(message):
+                    continue
+                if kwargs is None:
+                    # The tags group stays a str, message.tags is the lazy
+                    # utils.Tags
+                    kwargs = match.groupdict()
+                submit(event, event.callback, kwargs=kwargs, channel=channel)
+
+        if message.command == 'PRIVMSG' and self.registry.commands.first:
+            self.process_command(message)
+
+    def process_command(self, message: parser.IrcMessage):
+        try:
+            found = self.registry.commands.dispatch(message)
+        except commands.CommandError as exc:
+            self.notify('command_error', message, exc)
+            return
+        if found is not None:
+            command, args = found
+            self.dispatcher.submit(command, command.callback, (message,) + args, channel=message.channel)
+
+    def _collect_metrics(self):
+        values = {}
+        for conn in self.connections:
+            values['pytwitcher_queue_lines', (conn.label,)] = len(conn.queue)
+        stats = self.dispatcher.stats()
+        values['pytwitcher_dispatch_pending', ()] = stats['pending']
+        values['pytwitcher_dispatch_running', ()] = stats['running']
+        values['pytwitcher_dispatch_dropped_total', ()] = stats['dropped']
+        for plugin_name, plugin in self.registry.plugins.items():
+            for cache_name, cache in getattr(plugin, 'caches', {}).items():
+                labels = (plugin_name, cache_name)
+                values['pytwitcher_cache_entries', labels] = len(cache)
+                values['pytwitcher_cache_bytes', labels] = cache.bytes
+                values['pytwitcher_cache_hits_total', labels] = cache.hits
+                values['pytwitcher_cache_misses_total', labels] = cache.misses
+                values['pytwitcher_cache_evictions_total', labels] = cache.evictions + cache.expirations
+        return values
+
+    @property
+    def reading_paused(self) -> bool:
+        # Reading stops while the dispatcher or a worker is behind
+        return self.dispatcher.paused or (self.workers is not None and self.workers.paused)
+
+    def pause_reading(self):
+        for conn in self.connections:
+            conn.pause_reading()
+
+    def resume_reading(self):
+        if self.reading_paused:
+            return
+        for conn in self.connections:
+            conn.resume_reading()
 
     def _get_connection_data(self):
         if self.config['ssl']:
@@ -147,64 +404,127 @@ class IrcObject:
                 'port': 6667,
             }
 
-    def create_connection(self):
-        logger.debug('Scheduling new connection')
-        task = asyncio.ensure_future(
-            self.loop.create_connection(lambda: protocol.IrcProtocol(self), **self._get_connection_data()),
-            loop=self.loop,
-        )
-        task.add_done_callback(self._connection_made)
+    def _get_protocol_factory(self):
+        if self.config['buffered_protocol']:
+            if protocol.IrcBufferedProtocol is not None:
+                return protocol.IrcBufferedProtocol
+            logger.warning('BufferedProtocol is not available, using the default protocol')
+        return protocol.IrcProtocol
 
-    def _connection_made(self, future: asyncio.Future):
-        logger.info('Received connection to Twitch')
-        # Close the old one (in case of reconnections)
-        if hasattr(self, 'protocol'):
-            logger.debug('Closing old protocol')
-            self.protocol.close()  # pylint: disable=access-member-before-definition
+    @property
+    def protocol(self):
+        # Protocol of the first connection, for single connection bots
+        return self.connections[0].protocol
 
+    def create_connection(self):
+        self.running = True
+        for conn in self.connections:
+            if not conn.connected:
+                conn.create_connection()
+
+    def _add_connection(self):
+        conn = connection.Connection(self, len(self.connections))
+        self.connections.append(conn)
+        logger.info('Adding connection %d', conn.index)
+        if self.running:
+            conn.create_connection()
+        return conn
+
+    def _assign_channel(self, channel: str):
         try:
-            _, proto = future.result()
-        except:
-            logger.warning('Could not fetch protocol, rescheduling connection', exc_info=True)
-            self.loop.call_later(3, self.create_connection)
-        else:
-            self.protocol = proto  # pylint: disable=attribute-defined-outside-init
-            self._start_handshake()
-            self.notify('connection_attempted')
-
-    def _start_handshake(self):
-        self.send('CAP REQ :{}'.format(' '.join('twitch.tv/{}'.format(cap) for cap in self.CAPABILITIES)))
-        if not self.config['nick']:
-            logger.debug('Anonymous login requested')
-            # Anonymous login
-            self.send('NICK justinfan{}'.format(random.randrange(999999)))
+            return self.channels[channel]
+        except KeyError:
+            pass
+
+        limit = self.config['channels_per_shard']
+        for conn in self.connections:
+            if limit <= 0 or len(conn.channels) < limit:
+                break
         else:
-            logger.debug('OAuth login requested')
-            self.send('PASS {}'.format(self.config['password']))
-            self.send('NICK {}'.format(self.config['nick']))
-
-    def send_line(self, data):
-        fut = self.loop.create_future()
-        self.queue.put_nowait((fut, data))
-        return fut
-
-    async def _process_queue(self):
-        flood_rate = self.config['flood_delay'] / self.config['flood_rate_normal']
-        while True:
-            future, data = await self.queue.get()
-            future.set_result(True)
-            self.send(data)
-            # TODO: flood_rate calculation according to user state
-            await asyncio.sleep(flood_rate, loop=self.loop)
+            conn = self._add_connection()
+
+        conn.channels.add(channel)
+        self.channels[channel] = conn
+        return conn
+
+    def _channel_connection(self, command: str, channel: str):
+        if command == 'JOIN':
+            return self._assign_channel(channel)
+
+        if command == 'PART':
+            conn = self.channels.pop(channel, None)
+            if conn is None:
+                return self.connections[0]
+            conn.channels.discard(channel)
+            return conn
+
+        return self.channels.get(channel, self.connections[0])
+
+    def get_connections(self, line: str, message) -> list:
+        """
+        (connection, line) pairs to send a line as, message being the parsed
+        line: JOIN assigns each channel to the least recently opened
+        connection with room, PART releases each channel, other channel
+        commands follow the channel. A JOIN or PART of channels owned by
+        several connections is split.
+        """
+        channel = message.channel
+        if channel is None:
+            return [(self.connections[0], line)]
+
+        if message.command not in ('JOIN', 'PART') or ',' not in channel:
+            return [(self._channel_connection(message.command, channel), line)]
+
+        shards = collections.OrderedDict()
+        for channel in channel.split(','):
+            conn = self._channel_connection(message.command, channel)
+            shards.setdefault(conn, []).append(channel)
+        if len(shards) == 1:
+            return [(conn, line)]
+        return [
+            (conn, '{} {}'.format(message.command, ','.join(channels)))
+            for conn, channels in shards.items()
+        ]
+
+    def send_line(self, data, priority: int = None):
+        """
+        Queue a line on the connection owning its channel, the returned future
+        resolves once it is written to the connection.
+        """
+        message = parser.parse(data)
+        connections = self.get_connections(data, message)
+        futures = []
+        for conn, line in connections:
+            if line is data:
+                future = conn.send_line(data, priority=priority, message=message)
+            else:
+                future = conn.send_line(line, priority=priority)
+            if message.command == 'PART':
+                future.add_done_callback(functools.partial(self._parted, line))
+            futures.append(future)
+        if len(futures) == 1:
+            return futures[0]
+        return outbound.all_written(self.loop, futures)
+
+    def _parted(self, line: str, future: asyncio.Future):
+        # What is known about the channels is dropped once the PART is written
+        if future.cancelled() or future.exception() is not None:
+            return
+        for channel in parser.parse(line).channel.split(','):
+            self.state.remove(channel)
+            self.rate_limiter.set_elevated(channel, False)
+            if self.spam_filter is not None:
+                self.spam_filter.remove(channel)
+
+    async def drain(self):
+        """
+        Wait for the outbound queues to have room, see OutboundQueue.drain.
+        """
+        for conn in self.connections:
+            await conn.queue.drain()
 
     def send(self, data):
-        try:
-            self.protocol.write(data)
-        except AttributeError:
-            # Not connected yet
-            logger.warning('Cannot send data without active connection')
-            # FIXME: during reconnection, everything is lost, probably have to
-            # repush into the queue at the right place
+        self.connections[0].send(data)
 
     def _add_signal_handlers(self):
         try:
@@ -220,8 +540,7 @@ class IrcObject:
             logger.debug('Could not add SIGINT signal handler, ignoring')
 
     def SIGHUP(self):
-        logger.info('Received SIGHUP signal')
-        # TODO
+        logger.info('Received SIGHUP signal, reloading plugins')
         self.reload()
 
     def SIGINT(self):
@@ -231,20 +550,35 @@ class IrcObject:
         self.loop.stop()
 
     def run(self, forever: bool = True):
+        if self.archive is not None:
+            self.archive.start()
         self.create_connection()
         self._add_signal_handlers()
 
+        if self.metrics is not None and self.config['metrics_port']:
+            asyncio.ensure_future(metrics.start_http_server(
+                self.metrics, self.loop, self.config['metrics_host'], self.config['metrics_port'],
+            ), loop=self.loop)
+
         if forever:
             self.loop.run_forever()
             self._cleanup()
 
     def _cleanup(self):
         # Cancel remaining tasks and close the loop
-        gathered = asyncio.gather(*asyncio.Task.all_tasks(loop=self.loop))
+        try:
+            all_tasks = asyncio.all_tasks  # python 3.7+
+        except AttributeError:
+            all_tasks = asyncio.Task.all_tasks
+        gathered = asyncio.gather(*all_tasks(loop=self.loop))
         gathered.cancel()
         try:
             self.loop.run_until_complete(gathered)
         except asyncio.CancelledError:
             pass
 
+        if self.archive is not None:
+            self.archive.close()
+        if self.spam_filter is not None:
+            self.spam_filter.close()
         self.loop.close()
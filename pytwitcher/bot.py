@@ -1,21 +1,29 @@
+import asyncio
+
 from . import base
+from . import data
 from . import utils
 
 
 class IrcBot(base.IrcObject):
+    def __init__(self, loop: asyncio.BaseEventLoop = None, **config):
+        super().__init__(loop=loop, **config)
+        # Users and channels seen, one object each
+        self.store = data.Store()
+
     @property
     def nick(self):
-        return self.config.nick
+        return self.config['nick']
 
     @utils.future
     def privmsg(self, target, message):
         # WHISPER event is receive-only
         # You *have* to go through any valid user/room to make sure message goes through
-        if isinstance(target, User):
+        if isinstance(target, (data.User, data.Member)):
             return self.send_line('PRIVMSG {target} :.w {target} {message}'.format(
                 target=target, message=message,
             ))
-        elif isinstance(target, Channel):
+        elif isinstance(target, data.Channel):
             return self.send_line('PRIVMSG {target} :{message}'.format(
                 target=target, message=message,
             ))
@@ -0,0 +1,250 @@
+"""
+Bounded caches for plugins (see BasePlugin.cache): least recently used
+eviction past max_size, and expiry after a time to live.
+
+Expiry is driven by a timer wheel on the event loop rather than by scans:
+each entry is filed in the slot of the tick it expires at, and one timer
+per cache empties the slots as their tick comes. Inserting, evicting and
+expiring an entry are O(1) whatever the number of keys.
+"""
+
+from collections import OrderedDict
+import math
+import sys
+
+
+# Slots of a wheel at most, entries due after the current turn of the wheel
+# wait in an overflow and are filed in their slot once their turn comes
+MAX_SLOTS = 3600
+
+_missing = object()
+
+
+def sizeof(key, value) -> int:
+    """
+    Approximate memory of an entry: shallow sizes of the key and value.
+    """
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class TimerWheel:
+    """
+    Calls on_expire(key) for keys scheduled with a delay, `resolution`
+    seconds late at most, never early. The loop timer only runs while keys
+    are scheduled.
+    A turn is as many ticks as there are slots. Keys due in a later turn are
+    kept per turn and moved to their slot when the wheel enters it, so the
+    slot of a tick only holds keys due at that tick.
+    """
+
+    def __init__(self, loop, on_expire, resolution: float = 1.0, slots: int = 64):
+        self.loop = loop
+        self.on_expire = on_expire
+        self.resolution = resolution
+        # key -> tick, per tick modulo the number of slots
+        self.slots = [{} for _ in range(max(1, min(slots, MAX_SLOTS)))]
+        # turn -> {key -> tick}, for the turns after self.turn
+        self.later = {}
+        self.count = 0
+        # Last tick processed, and its turn
+        self.tick = 0
+        self.turn = 0
+        self._handle = None
+
+    def now(self) -> int:
+        return int(self.loop.time() / self.resolution)
+
+    def schedule(self, key, delay: float) -> int:
+        """
+        Returns the tick key expires at, needed to cancel it.
+        """
+        if self._handle is None:
+            self.tick = self.now()
+            self.turn = self.tick // len(self.slots)
+            self._handle = self.loop.call_later(self.resolution, self._run)
+        tick = int((self.loop.time() + delay) / self.resolution) + 1
+        self._bucket(tick, create=True)[key] = tick
+        self.count += 1
+        return tick
+
+    def _bucket(self, tick: int, create: bool = False) -> dict:
+        # Where a key due at tick is kept
+        turn = tick // len(self.slots)
+        if turn <= self.turn:
+            return self.slots[tick % len(self.slots)]
+        if create:
+            return self.later.setdefault(turn, {})
+        return self.later.get(turn, {})
+
+    def cancel(self, key, tick: int):
+        bucket = self._bucket(tick)
+        if bucket.get(key) == tick:
+            del bucket[key]
+            self.count -= 1
+            if not bucket and tick // len(self.slots) > self.turn:
+                del self.later[tick // len(self.slots)]
+
+    def clear(self):
+        for slot in self.slots:
+            slot.clear()
+        self.later.clear()
+        self.count = 0
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _run(self):
+        self._handle = None
+        now = self.now()
+        slots = self.slots
+        # Every slot at most once, even after a long pause of the loop
+        first = max(self.tick + 1, now - len(slots) + 1)
+        for tick in range(first, now + 1):
+            turn = tick // len(slots)
+            if turn > self.turn:
+                self._enter(turn)
+            slot = slots[tick % len(slots)]
+            if not slot:
+                continue
+            expired = [key for key, when in slot.items() if when <= now]
+            for key in expired:
+                del slot[key]
+            self.count -= len(expired)
+            for key in expired:
+                self.on_expire(key)
+        self.tick = now
+        if self.count and self._handle is None:
+            self._handle = self.loop.call_later(self.resolution, self._run)
+
+    def _enter(self, turn: int):
+        # Keys due by the end of turn are filed in their slot, each key moves
+        # once
+        self.turn = turn
+        slots = self.slots
+        for due in [due for due in self.later if due <= turn]:
+            for key, tick in self.later.pop(due).items():
+                slots[tick % len(slots)][key] = tick
+
+
+class Cache:
+    """
+    Mapping of at most max_size entries (0 for no limit), the least recently
+    used one being evicted first, whose entries expire ttl seconds after
+    being set (0 for never, needs the loop). Keeps hit/miss counts and an
+    estimate of its memory use, computed with `sizeof(key, value)`.
+    """
+
+    def __init__(self, max_size: int = 0, ttl: float = 0, loop=None, resolution: float = 1.0, sizeof=sizeof):
+        if ttl and loop is None:
+            raise ValueError('Caches with a TTL need the event loop')
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        # key -> (value, size, expiry tick or None), in use order
+        self.data = OrderedDict()
+        self.wheel = None
+        if loop is not None:
+            slots = math.ceil(ttl / resolution) + 1 if ttl else 64
+            self.wheel = TimerWheel(loop, self._expire, resolution, slots)
+
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        entry = self.data.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _missing) is _missing:
+            raise KeyError(key)
+
+    def _expired(self, entry) -> bool:
+        # Due but its tick was not processed yet
+        return entry[2] is not None and entry[2] <= self.wheel.now()
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if self._expired(entry):
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        """
+        ttl overrides the cache's one for this entry.
+        """
+        if key in self.data:
+            self._remove(key)
+        if ttl is None:
+            ttl = self.ttl
+        tick = None
+        if ttl:
+            if self.wheel is None:
+                raise ValueError('Caches with a TTL need the event loop')
+            tick = self.wheel.schedule(key, ttl)
+        size = self.sizeof(key, value)
+        self.data[key] = (value, size, tick)
+        self.bytes += size
+
+        if self.max_size and len(self.data) > self.max_size:
+            oldest = next(iter(self.data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None:
+            return default
+        self._remove(key)
+        return entry[0]
+
+    def _remove(self, key):
+        _, size, tick = self.data.pop(key)
+        self.bytes -= size
+        if tick is not None:
+            self.wheel.cancel(key, tick)
+
+    def _expire(self, key):
+        _, size, _ = self.data.pop(key)
+        self.bytes -= size
+        self.expirations += 1
+
+    def clear(self):
+        self.data.clear()
+        self.bytes = 0
+        if self.wheel is not None:
+            self.wheel.clear()
+
+    close = clear
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.data),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,301 @@
+"""
+Chat commands (`!name arguments`) declared on plugins with plugin.chat_command.
+
+The registry keeps every command in one Router: a trie on prefix + name,
+so a PRIVMSG is rejected on its first character unless some command prefix
+starts with it. Arguments are split (shell-like quoting) and converted
+with the callback's annotations.
+"""
+
+from heapq import heappop, heappush
+import inspect
+import logging
+import shlex
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Lowest badge a command can require, in increasing order
+PERMISSIONS = ('everyone', 'subscriber', 'vip', 'moderator', 'broadcaster')
+BADGE_LEVELS = {
+    'subscriber': 1, 'founder': 1,
+    'vip': 2,
+    'moderator': 3, 'staff': 3, 'admin': 3, 'global_mod': 3,
+    'broadcaster': 4,
+}
+
+# Trie node key of the command ending there, chars are never ''
+END = ''
+
+
+class CommandError(ValueError):
+    """
+    The arguments of a command could not be parsed.
+    """
+
+
+def user_level(message) -> int:
+    """
+    Index in PERMISSIONS of the highest badge of the author of message.
+    """
+    level = 0
+    for badge in message.tags.badges:
+        level = max(level, BADGE_LEVELS.get(badge, 0))
+    return level
+
+
+class Cooldowns:
+    """
+    Keys with an expiry, expired ones are dropped lazily in expiry order
+    (a heap), so the structure only holds running cooldowns.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.expiries = {}
+        # (expiry, key), may hold stale entries for restarted keys
+        self.heap = []
+
+    def _purge(self, now: float):
+        heap = self.heap
+        expiries = self.expiries
+        while heap and heap[0][0] <= now:
+            expiry, key = heappop(heap)
+            if expiries.get(key) == expiry:
+                del expiries[key]
+
+    def remaining(self, key) -> float:
+        now = self.clock()
+        self._purge(now)
+        expiry = self.expiries.get(key)
+        return 0 if expiry is None else expiry - now
+
+    def start(self, key, seconds: float):
+        expiry = self.clock() + seconds
+        self.expiries[key] = expiry
+        heappush(self.heap, (expiry, key))
+
+    def __len__(self):
+        self._purge(self.clock())
+        return len(self.expiries)
+
+
+class chat_command:
+    """
+    Declare a chat command, as a method decorator on plugins:
+
+        @chat_command('dice', aliases=('roll',), user_cooldown=10)
+        async def dice(self, message, sides: int = 6):
+            ...
+
+    The callback gets the PRIVMSG (see parser.IrcMessage) and the arguments,
+    converted with the parameter annotations. prefix defaults to the
+    command_prefix setting, permission is the lowest badge required (see
+    PERMISSIONS), cooldowns are in seconds, per user in a channel and per
+    channel.
+    """
+
+    def __init__(self, name: str, callback=None, aliases=(), prefix: str = None, permission: str = 'everyone',
+                 user_cooldown: float = 0, channel_cooldown: float = 0, channels=None):
+        if permission not in PERMISSIONS:
+            raise ValueError('Unknown permission {!r}, expected one of {}'.format(permission, PERMISSIONS))
+        if prefix is not None and (not prefix or prefix != ''.join(prefix.split())):
+            raise ValueError('Command prefixes must be non empty and without spaces')
+        self.name = name.lower()
+        self.names = (self.name,) + tuple(alias.lower() for alias in aliases)
+        self.callback = callback
+        self.prefix = prefix
+        self.permission = permission
+        self.level = PERMISSIONS.index(permission)
+        self.user_cooldown = user_cooldown
+        self.channel_cooldown = channel_cooldown
+        self.channels = None if channels is None else frozenset(channel.lower() for channel in channels)
+        # (converters, variadic converter or None, required count), see parse
+        self._spec = None
+
+    def __call__(self, func):
+        self.callback = func
+        return self
+
+    def __get__(self, instance, owner):
+        # Bind the callback to the plugin instance, as event.event does
+        if instance is None or self.callback is None:
+            return self
+        bound = object.__new__(type(self))
+        bound.__dict__.update(self.__dict__)
+        bound.callback = self.callback.__get__(instance, owner)
+        bound._spec = None
+        return bound
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return (self.names, self.prefix, self.callback) == (other.names, other.prefix, other.callback)
+
+    def __hash__(self):
+        return hash((self.names, self.prefix, self.callback))
+
+    def __repr__(self):
+        return '<chat_command {}>'.format(self.name)
+
+    def _get_spec(self):
+        if self._spec is None:
+            parameters = list(inspect.signature(self.callback).parameters.values())[1:]  # message
+            converters = []
+            variadic = None
+            required = 0
+            for parameter in parameters:
+                annotation = parameter.annotation
+                converter = str if annotation is inspect.Parameter.empty else annotation
+                if parameter.kind == parameter.VAR_POSITIONAL:
+                    variadic = converter
+                elif parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD):
+                    converters.append(converter)
+                    if parameter.default is inspect.Parameter.empty:
+                        required += 1
+            self._spec = (converters, variadic, required)
+        return self._spec
+
+    def parse(self, text: str) -> tuple:
+        """
+        Arguments for the callback from the text after the command name.
+        """
+        converters, variadic, required = self._get_spec()
+        try:
+            words = shlex.split(text)
+        except ValueError:
+            # Unbalanced quotes, chat is not a shell
+            words = text.split()
+        if len(words) < required:
+            raise CommandError('{} takes at least {} arguments'.format(self.name, required))
+        if len(words) > len(converters) and variadic is None:
+            raise CommandError('{} takes at most {} arguments'.format(self.name, len(converters)))
+
+        args = []
+        for index, word in enumerate(words):
+            converter = converters[index] if index < len(converters) else variadic
+            try:
+                args.append(converter(word))
+            except (TypeError, ValueError):
+                raise CommandError('Invalid argument {!r} for {}'.format(word, self.name))
+        return tuple(args)
+
+
+class Router:
+    """
+    Finds the command a PRIVMSG calls, and checks it may run.
+    """
+
+    def __init__(self, config: dict, clock=time.monotonic):
+        self.config = config
+        # prefix + name, char by char, see END
+        self.root = {}
+        # First chars of the prefixes, the only check done on other messages
+        self.first = frozenset()
+        # (prefix, name) -> command
+        self.commands = {}
+        self.cooldowns = Cooldowns(clock)
+
+    def __bool__(self):
+        return bool(self.commands)
+
+    def copy(self):
+        """
+        Router with the same commands, sharing the running cooldowns.
+        """
+        new = Router(self.config)
+        new.commands = dict(self.commands)
+        new.cooldowns = self.cooldowns
+        new._rebuild()
+        return new
+
+    def recompile(self, config: dict):
+        """
+        Register the commands again with a new config (command_prefix).
+        """
+        registered = []
+        for cmd in self.commands.values():
+            if cmd not in registered:
+                registered.append(cmd)
+        self.config = config
+        self.commands = {}
+        for cmd in registered:
+            self.add(cmd)
+
+    def _prefix(self, cmd: chat_command) -> str:
+        return cmd.prefix or self.config.get('command_prefix', '!')
+
+    def add(self, cmd: chat_command):
+        prefix = self._prefix(cmd)
+        for name in cmd.names:
+            if (prefix, name) in self.commands:
+                raise ValueError('Command {}{} is already registered'.format(prefix, name))
+        for name in cmd.names:
+            self.commands[prefix, name] = cmd
+        self._rebuild()
+
+    def remove(self, cmd: chat_command):
+        prefix = self._prefix(cmd)
+        for name in cmd.names:
+            if self.commands.get((prefix, name)) == cmd:
+                del self.commands[prefix, name]
+        self._rebuild()
+
+    def _rebuild(self):
+        root = {}
+        for (prefix, name), cmd in self.commands.items():
+            node = root
+            for char in prefix + name:
+                node = node.setdefault(char, {})
+            node[END] = cmd
+        self.root = root
+        self.first = frozenset(root)
+
+    def find(self, text: str):
+        """
+        (command, text of its arguments) if text calls a command.
+        """
+        if not text or text[0] not in self.first:
+            return None
+        head, _, rest = text.partition(' ')
+        node = self.root
+        for char in head.lower():
+            node = node.get(char)
+            if node is None:
+                return None
+        cmd = node.get(END)
+        if cmd is None:
+            return None
+        return cmd, rest
+
+    def dispatch(self, message):
+        """
+        (command, arguments) to run for a PRIVMSG, None if it is not a
+        command or may not run (channel, permission, cooldown).
+        Raises CommandError for invalid arguments.
+        """
+        found = self.find(message.text)
+        if found is None:
+            return None
+        cmd, rest = found
+        channel = message.channel
+        if cmd.channels is not None and channel not in cmd.channels:
+            return None
+        if cmd.level and user_level(message) < cmd.level:
+            logger.debug('%s may not use %s in %s', message.nick, cmd.name, channel)
+            return None
+
+        cooldowns = self.cooldowns
+        user_key = (cmd.name, channel, message.nick)
+        if cmd.channel_cooldown and cooldowns.remaining((cmd.name, channel)) > 0:
+            return None
+        if cmd.user_cooldown and cooldowns.remaining(user_key) > 0:
+            return None
+
+        args = cmd.parse(rest)
+        if cmd.channel_cooldown:
+            cooldowns.start((cmd.name, channel), cmd.channel_cooldown)
+        if cmd.user_cooldown:
+            cooldowns.start(user_key, cmd.user_cooldown)
+        return cmd, args
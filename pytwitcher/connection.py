@@ -0,0 +1,294 @@
+"""
+A single connection to Twitch IRC, a bot has one or more (shards).
+"""
+
+import asyncio
+import functools
+import logging
+import random
+
+from . import keepalive
+from . import outbound
+from . import parser
+from . import utils
+
+
+logger = logging.getLogger(__name__)
+
+# Channels part of a JOIN line, IRC lines are at most 512 bytes with \r\n
+MAX_JOIN_LENGTH = 500
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th delay is random between 0
+    and min(max_delay, delay * 2 ** n), so shards dropped together don't
+    reconnect together.
+    """
+
+    def __init__(self, delay: float, max_delay: float, random=random.random):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.random = random
+        self.attempts = 0
+
+    def next(self) -> float:
+        ceiling = min(self.max_delay, self.delay * 2 ** min(self.attempts, 32))
+        self.attempts += 1
+        return ceiling * self.random()
+
+    def reset(self):
+        self.attempts = 0
+
+
+class Connection:
+    """
+    Owns one protocol, its outbound queue and its reconnections.
+    Received lines are fed to the bot's process_data, so every connection
+    shares the bot's registry.
+    """
+
+    def __init__(self, bot, index: int = 0):
+        self.bot = bot
+        self.index = index
+        self.loop = bot.loop
+        self.encoding = bot.encoding
+        self.config = bot.config
+        self.metrics = bot.metrics
+        self.label = str(index)
+        # Read by the protocols, see IrcProtocol.write and archive
+        self.archive = bot.archive
+        self.write_window = self.config['write_batch_window'] if self.config['write_batching'] else None
+
+        self.protocol = None
+        # Protocol replacing self.protocol, used once logged in
+        self.next_protocol = None
+        # Replaced protocol still reading until the channels are joined again
+        self.old_protocol = None
+        self.logged_in = False
+        # Channels routed to this connection, joined again on reconnection
+        self.channels = set()
+        self.was_logged_in = False
+
+        self.backoff = Backoff(self.config['reconnect_delay'], self.config['reconnect_max_delay'])
+        self._reconnect_handle = None
+        self.keepalive = keepalive.Keepalive(self, self.config['keepalive_interval'], self.config['keepalive_timeout'])
+
+        # Paused until logged in, kept across reconnections.
+        # The rate limiter is shared, Twitch limits are per account.
+        self.queue = outbound.OutboundQueue(
+            self.loop, bot.rate_limiter,
+            max_size=self.config['send_queue_size'], policy=self.config['send_queue_policy'],
+            metrics=self.metrics, label=self.label,
+            state=bot.state if self.config['skip_rejected'] else None,
+        )
+        self._queue_task = asyncio.ensure_future(self.queue.run(), loop=self.loop)
+
+    def __repr__(self):
+        return '<Connection {} ({} channels)>'.format(self.index, len(self.channels))
+
+    @property
+    def connected(self) -> bool:
+        return self.protocol is not None and not self.protocol.closed
+
+    # protocol factory interface
+
+    def process_data(self, data):
+        # Only untagged lines can be control lines, skip the chat ones quickly
+        if not data.startswith('@'):
+            command = utils.get_command(data)
+            if command == 'PING':
+                self._pong(data)
+            elif command == 'PONG':
+                self.keepalive.pong(parser.parse(data).text)
+            elif command == '376':  # RPL_ENDOFMOTD
+                self._logged_in()
+            elif command == 'RECONNECT':
+                # Make before break: this one keeps going until the new one
+                # is logged in
+                logger.info('Connection %d: server asked to reconnect', self.index)
+                self.create_connection()
+        self.bot.process_data(data)
+
+    def _pong(self, ping: str):
+        # Answered right away, not through the queue. Which socket it came
+        # from is unknown during a handover, all of them get the answer.
+        pong = 'PONG :{}'.format(parser.parse(ping).text or 'tmi.twitch.tv')
+        for proto in (self.protocol, self.next_protocol, self.old_protocol):
+            if proto is not None and not proto.closed:
+                proto.write(pong)
+
+    def notify(self, listener_name, *args, **kwargs):
+        self.bot.notify(listener_name, *args, **kwargs)
+
+    def connection_lost(self, proto, reconnect: bool):
+        if proto is self.old_protocol:
+            # Closed by the server before the channels were joined again
+            self.old_protocol = None
+        elif proto is self.next_protocol:
+            # The replacement died before taking over
+            self.next_protocol = None
+            if reconnect:
+                self.schedule_reconnect()
+        elif proto is self.protocol:
+            self.queue.pause()
+            self.logged_in = False
+            if self.next_protocol is not None:
+                # Already replaced, it takes over once logged in
+                self.protocol, self.next_protocol = self.next_protocol, None
+            elif reconnect:
+                self.schedule_reconnect()
+        self.bot.notify('connection_lost')
+
+    # connection lifecycle
+
+    def schedule_reconnect(self):
+        if self._reconnect_handle is not None:
+            return
+        delay = self.backoff.next()
+        logger.info('Connection %d: reconnecting in %.1fs', self.index, delay)
+        self._reconnect_handle = self.loop.call_later(delay, self.create_connection)
+
+    def create_connection(self):
+        if self._reconnect_handle is not None:
+            self._reconnect_handle.cancel()
+            self._reconnect_handle = None
+        logger.debug('Connection %d: scheduling new connection', self.index)
+        protocol_factory = self.bot._get_protocol_factory()
+        task = asyncio.ensure_future(
+            self.loop.create_connection(lambda: protocol_factory(self), **self.bot._get_connection_data()),
+            loop=self.loop,
+        )
+        task.add_done_callback(self._connection_made)
+
+    def _connection_made(self, future: asyncio.Future):
+        try:
+            _, proto = future.result()
+        except Exception:
+            logger.warning('Connection %d: could not connect', self.index, exc_info=True)
+            self.schedule_reconnect()
+            return
+
+        logger.info('Connection %d: connected to Twitch', self.index)
+        if self.logged_in and self.connected:
+            # Handover, the current one is closed once this one is logged in
+            if self.next_protocol is not None:
+                self.next_protocol.close()
+            self.next_protocol = proto
+        else:
+            old_protocol = self._replace_protocol(proto)
+            if old_protocol is not None:
+                self._close_old_protocol(old_protocol)
+            self.queue.pause()
+            self.logged_in = False
+
+        if self.bot.reading_paused:
+            proto.transport.pause_reading()
+        self._start_handshake(proto)
+        self.bot.notify('connection_attempted')
+
+    def _replace_protocol(self, proto):
+        old_protocol, self.protocol = self.protocol, proto
+        if old_protocol is not None:
+            if self.metrics is not None:
+                self.metrics.inc('pytwitcher_reconnections_total', (self.label,))
+        return old_protocol
+
+    def _close_old_protocol(self, proto, future: asyncio.Future = None):
+        if proto is self.old_protocol:
+            self.old_protocol = None
+        logger.debug('Connection %d: closing old protocol', self.index)
+        proto.close()
+
+    def _start_handshake(self, proto):
+        # Written directly, not rate limited
+        proto.write('CAP REQ :{}'.format(' '.join('twitch.tv/{}'.format(cap) for cap in self.bot.CAPABILITIES)))
+        if not self.config['nick']:
+            logger.debug('Anonymous login requested')
+            # Anonymous login
+            proto.write('NICK justinfan{}'.format(random.randrange(999999)))
+        else:
+            logger.debug('OAuth login requested')
+            proto.write('PASS {}'.format(self.config['password']))
+            proto.write('NICK {}'.format(self.config['nick']))
+
+    def _logged_in(self):
+        logger.info('Connection %d: logged in', self.index)
+        old_protocol = None
+        if self.next_protocol is not None:
+            proto, self.next_protocol = self.next_protocol, None
+            old_protocol = self._replace_protocol(proto)
+        self.logged_in = True
+        self.backoff.reset()
+        rejoined = self.rejoin() if self.was_logged_in else None
+        self.was_logged_in = True
+        self.queue.resume(self.protocol.write)
+        self.keepalive.start()
+
+        if old_protocol is not None:
+            # Make before break: the old one keeps reading until the channels
+            # are joined again on the new one, or the server closes it
+            if self.old_protocol is not None:
+                self._close_old_protocol(self.old_protocol)
+            if rejoined is None or rejoined.done():
+                self._close_old_protocol(old_protocol)
+            else:
+                self.old_protocol = old_protocol
+                rejoined.add_done_callback(functools.partial(self._close_old_protocol, old_protocol))
+
+    def rejoin(self):
+        """
+        Queue JOINs for the channels of this connection ahead of chat lines,
+        as many channels per line as the JOIN limit allows at once. Returns
+        a future resolving once they are all written, None without channels.
+        """
+        if not self.channels:
+            return None
+        per_line = max(1, self.bot.rate_limiter.join.rate)
+        logger.info('Connection %d: joining %d channels again', self.index, len(self.channels))
+        futures = []
+        batch = []
+        length = 0
+        for channel in sorted(self.channels):
+            if batch and (len(batch) >= per_line or length + len(channel) + 1 > MAX_JOIN_LENGTH):
+                futures.append(self.queue.put('JOIN ' + ','.join(batch), priority=outbound.HIGH))
+                batch = []
+                length = 0
+            batch.append(channel)
+            length += len(channel) + 1
+        futures.append(self.queue.put('JOIN ' + ','.join(batch), priority=outbound.HIGH))
+        return outbound.all_written(self.loop, futures)
+
+    def pause_reading(self):
+        if self.connected:
+            self.protocol.transport.pause_reading()
+        if self.old_protocol is not None and not self.old_protocol.closed:
+            self.old_protocol.transport.pause_reading()
+
+    def resume_reading(self):
+        if self.connected:
+            self.protocol.transport.resume_reading()
+        if self.old_protocol is not None and not self.old_protocol.closed:
+            self.old_protocol.transport.resume_reading()
+
+    def close(self):
+        self._queue_task.cancel()
+        self.keepalive.stop()
+        if self._reconnect_handle is not None:
+            self._reconnect_handle.cancel()
+            self._reconnect_handle = None
+        for proto in (self.next_protocol, self.protocol, self.old_protocol):
+            if proto is not None:
+                proto.close()
+
+    # sending
+
+    def send_line(self, data, priority: int = None, message=None):
+        return self.queue.put(data, priority=priority, message=message)
+
+    def send(self, data):
+        if not self.connected:
+            # Not connected yet, use send_line to have it sent once connected
+            logger.warning('Cannot send data without active connection')
+            return
+        self.protocol.write(data)
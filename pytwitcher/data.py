@@ -1,14 +1,255 @@
+"""
+Users, channels and messages, kept small: hundreds of thousands of chatters
+can be tracked at once.
+
+Objects have __slots__, logins and channel names are interned, and a Store
+keeps one object per login/channel name (identity map) so a user seen in
+several channels and messages is a single User.
+"""
+
+import sys
+
+from . import parser
+from . import utils
+
+
+def normalize(name: str) -> str:
+    """
+    Lowercased, interned login or channel name.
+    """
+    return sys.intern(name.lower())
+
+
 class User:
-    pass
+    __slots__ = ('login', 'id', 'display_name')
+
+    def __init__(self, login: str, id: str = None, display_name: str = None):
+        self.login = normalize(login)
+        self.id = id
+        self.display_name = display_name
+
+    def __str__(self):
+        return self.login
+
+    def __repr__(self):
+        return '<User {}>'.format(self.login)
+
+
+class Member:
+    """
+    A User in a Channel, with its badges there. Not a User subclass so the
+    User stays a single object across channels.
+    """
+    __slots__ = ('user', 'channel', '_badges')
+
+    def __init__(self, user: User, channel: 'Channel', badges: str = ''):
+        self.user = user
+        self.channel = channel
+        self._badges = sys.intern(badges or '')
+
+    @property
+    def login(self):
+        return self.user.login
+
+    @property
+    def badges(self):
+        return utils.parse_badges(self._badges)
+
+    @badges.setter
+    def badges(self, value: str):
+        self._badges = sys.intern(value or '')
+
+    @property
+    def is_moderator(self) -> bool:
+        badges = self.badges
+        return 'moderator' in badges or 'broadcaster' in badges
+
+    def __str__(self):
+        return self.user.login
+
+    def __repr__(self):
+        return '<Member {} in {}>'.format(self.user.login, self.channel.name)
 
-class Member(User):
-    pass
 
 class Channel:
     """
     A Channel owns Members
     """
-    pass
+    __slots__ = ('name', 'id', 'members')
+
+    def __init__(self, name: str, id: str = None):
+        self.name = normalize(name)
+        self.id = id
+        # User -> Member
+        self.members = {}
+
+    def add(self, user: User, badges: str = None) -> Member:
+        member = self.members.get(user)
+        if member is None:
+            member = self.members[user] = Member(user, self, badges)
+        elif badges is not None:
+            member.badges = badges
+        return member
+
+    def remove(self, user: User) -> Member:
+        return self.members.pop(user, None)
+
+    def __contains__(self, user: User):
+        return user in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members.values())
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return '<Channel {} ({} members)>'.format(self.name, len(self.members))
+
+
+class IdentityMap:
+    """
+    One object per normalized key, created on first access.
+    """
+    __slots__ = ('factory', 'objects')
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.objects = {}
+
+    def get(self, key: str):
+        """
+        The object for key, created if missing.
+        """
+        try:
+            return self.objects[key]
+        except KeyError:
+            pass
+        key = normalize(key)
+        obj = self.objects.get(key)
+        if obj is None:
+            obj = self.objects[key] = self.factory(key)
+        return obj
+
+    def find(self, key: str):
+        """
+        The object for key, None if missing.
+        """
+        obj = self.objects.get(key)
+        if obj is None:
+            obj = self.objects.get(key.lower())
+        return obj
+
+    def remove(self, key: str):
+        return self.objects.pop(normalize(key), None)
+
+    def __contains__(self, key: str):
+        return key in self.objects or key.lower() in self.objects
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects.values())
+
+
+class Store:
+    """
+    Identity maps of the users and channels a bot knows about.
+    """
+
+    def __init__(self):
+        self.users = IdentityMap(User)
+        self.channels = IdentityMap(Channel)
+
+    def user(self, login: str, id: str = None, display_name: str = None) -> User:
+        user = self.users.get(login)
+        if id is not None:
+            user.id = id
+        if display_name is not None:
+            user.display_name = display_name
+        return user
+
+    def channel(self, name: str, id: str = None) -> Channel:
+        channel = self.channels.get(name)
+        if id is not None:
+            channel.id = id
+        return channel
+
+    def message(self, raw: str, parsed: parser.IrcMessage = None) -> 'Message':
+        return Message(raw, self, parsed)
+
 
 class Message:
-    pass
+    """
+    A received line, tokenized on first access. user and channel resolve
+    through the store, if any.
+    """
+    __slots__ = ('raw', 'store', '_parsed')
+
+    def __init__(self, raw: str, store: Store = None, parsed: parser.IrcMessage = None):
+        self.raw = raw
+        self.store = store
+        self._parsed = parsed
+
+    @property
+    def parsed(self) -> parser.IrcMessage:
+        if self._parsed is None:
+            self._parsed = parser.parse(self.raw)
+        return self._parsed
+
+    @property
+    def tags(self) -> utils.Tags:
+        return self.parsed.tags
+
+    @property
+    def command(self) -> str:
+        return self.parsed.command
+
+    @property
+    def params(self) -> list:
+        return self.parsed.params
+
+    @property
+    def nick(self) -> str:
+        return self.parsed.nick
+
+    @property
+    def text(self) -> str:
+        return self.parsed.text
+
+    @property
+    def id(self) -> str:
+        return self.parsed.tags.get('id')
+
+    @property
+    def user(self) -> User:
+        parsed = self.parsed
+        nick = parsed.nick
+        if not nick or '.' in nick:
+            # Server prefix
+            nick = parsed.tags.get('login')
+            if not nick:
+                return None
+        if self.store is None:
+            return User(nick, parsed.tags.get('user-id'), parsed.tags.get('display-name'))
+        return self.store.user(nick, parsed.tags.get('user-id'), parsed.tags.get('display-name'))
+
+    @property
+    def channel(self) -> Channel:
+        parsed = self.parsed
+        name = parsed.channel
+        if name is None:
+            return None
+        if self.store is None:
+            return Channel(name, parsed.tags.get('room-id'))
+        return self.store.channel(name, parsed.tags.get('room-id'))
+
+    def __str__(self):
+        return self.raw
+
+    def __repr__(self):
+        return '<Message {!r}>'.format(self.raw)
@@ -0,0 +1,234 @@
+"""
+Bounded execution of event callbacks.
+"""
+
+import asyncio
+from collections import defaultdict, deque
+import functools
+import logging
+
+from . import metrics as metrics_
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Started:
+    """
+    Awaitable finishing a coroutine whose first step ran outside of a task,
+    `pending` being what it yielded then.
+    """
+    __slots__ = ('coro', 'pending')
+
+    def __init__(self, coro, pending):
+        self.coro = coro
+        self.pending = pending
+
+    def __await__(self):
+        coro = self.coro
+        pending = self.pending
+        while True:
+            try:
+                value = yield pending
+            except BaseException as exc:
+                try:
+                    pending = coro.throw(exc)
+                except StopIteration as stop:
+                    return stop.value
+            else:
+                try:
+                    pending = coro.send(value)
+                except StopIteration as stop:
+                    return stop.value
+
+
+class Dispatcher:
+    """
+    Schedules callbacks as tasks, with:
+
+    - max_tasks: callbacks running at once, 0 for no limit
+    - max_per_event: callbacks of a same key (event) running at once
+    - serial_channels: callbacks of a same channel run one after the other,
+      in submission order
+    - max_pending: callbacks waiting to run before on_pause is called (the
+      bot stops reading from its connections), on_resume is called once back
+      to half of it
+    - drop_pending: callbacks waiting to run before new ones are dropped
+
+    Without any of the first three limits callbacks are scheduled right
+    away: none ever waits, so max_pending and drop_pending need one of them.
+    """
+
+    def __init__(self, loop, max_tasks: int = 0, max_per_event: int = 0, serial_channels: bool = False,
+                 max_pending: int = 0, drop_pending: int = 0, on_pause=None, on_resume=None, metrics=None):
+        self.loop = loop
+        self.max_tasks = max_tasks
+        self.max_per_event = max_per_event
+        self.serial_channels = serial_channels
+        self.max_pending = max_pending
+        self.drop_pending = drop_pending
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.metrics = metrics
+
+        self.unbounded = not (max_tasks or max_per_event or serial_channels)
+        if self.unbounded and (max_pending or drop_pending):
+            raise ValueError('max_pending and drop_pending need max_tasks, max_per_event or serial_channels')
+
+        # jobs that can run as soon as there is a free slot
+        self.ready = deque()
+        # key -> jobs waiting for a callback of the same key to finish
+        self.event_waiting = defaultdict(deque)
+        # channel -> jobs waiting for the running callback of the channel
+        self.channel_waiting = {}
+        self.busy_channels = set()
+        self.running_per_event = defaultdict(int)
+
+        self.running = 0
+        self.pending = 0
+        self.dropped = 0
+        self.paused = False
+
+    def stats(self) -> dict:
+        return {
+            'running': self.running,
+            'pending': self.pending,
+            'dropped': self.dropped,
+            'paused': self.paused,
+        }
+
+    def submit(self, key, func, args: tuple = (), kwargs: dict = None, channel: str = None) -> bool:
+        """
+        Run func(*args, **kwargs) as a task once the limits allow it.
+        key identifies the event for max_per_event.
+        Returns False if it was dropped.
+        """
+        if kwargs is None:
+            kwargs = {}
+
+        if self.metrics is not None:
+            args = (func, args, kwargs)
+            kwargs = {}
+            func = self._timed
+
+        if self.unbounded:
+            asyncio.ensure_future(func(*args, **kwargs), loop=self.loop)
+            return True
+
+        if self.drop_pending and self.pending >= self.drop_pending:
+            self.dropped += 1
+            if self.dropped == 1 or not self.dropped % 1000:
+                logger.warning('Dispatcher full, %d callbacks dropped so far', self.dropped)
+            return False
+
+        if not self.serial_channels:
+            channel = None
+        # [key, channel, func, args, kwargs, owns channel]
+        self.ready.append([key, channel, func, args, kwargs, False])
+        self.pending += 1
+        self._pump()
+        self._check_pressure()
+        return True
+
+    def submit_eager(self, key, func, args: tuple = (), kwargs: dict = None, channel: str = None) -> bool:
+        """
+        Like submit, but without limits (nor metrics) to respect, run func
+        right away up to its first suspension: coroutines finishing without
+        waiting on anything never become tasks. Only for short coroutines not
+        relying on being in a task, and exceptions raised before the first
+        suspension propagate.
+        """
+        if not self.unbounded or self.metrics is not None:
+            return self.submit(key, func, args, kwargs, channel)
+
+        coro = func(*args, **(kwargs or {}))
+        try:
+            pending = coro.send(None)
+        except StopIteration:
+            return True
+        asyncio.ensure_future(_Started(coro, pending), loop=self.loop)
+        return True
+
+    async def _timed(self, func, args, kwargs):
+        start = metrics_.clock()
+        try:
+            await func(*args, **kwargs)
+        finally:
+            # _run_listener wraps listeners, time the listener itself
+            name = metrics_.callback_name(args[0] if func.__name__ == '_run_listener' else func)
+            self.metrics.observe('pytwitcher_callback_seconds', metrics_.clock() - start, (name,))
+
+    def _pump(self):
+        ready = self.ready
+        max_tasks = self.max_tasks
+        max_per_event = self.max_per_event
+
+        while ready and (not max_tasks or self.running < max_tasks):
+            job = ready.popleft()
+            key, channel = job[0], job[1]
+
+            if channel is not None and not job[5]:
+                if channel in self.busy_channels:
+                    self.channel_waiting.setdefault(channel, deque()).append(job)
+                    continue
+                self.busy_channels.add(channel)
+                job[5] = True
+
+            if max_per_event and self.running_per_event[key] >= max_per_event:
+                self.event_waiting[key].append(job)
+                continue
+
+            self._start(job)
+
+    def _start(self, job):
+        key, _, func, args, kwargs, _ = job
+        self.pending -= 1
+        self.running += 1
+        self.running_per_event[key] += 1
+        task = asyncio.ensure_future(func(*args, **kwargs), loop=self.loop)
+        task.add_done_callback(functools.partial(self._done, job))
+
+    def _done(self, job, task):
+        key, channel = job[0], job[1]
+        self.running -= 1
+        self.running_per_event[key] -= 1
+        if not self.running_per_event[key]:
+            del self.running_per_event[key]
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Error in callback for %s', key, exc_info=task.exception())
+
+        waiting = self.event_waiting.get(key)
+        if waiting:
+            self.ready.appendleft(waiting.popleft())
+            if not waiting:
+                del self.event_waiting[key]
+
+        if channel is not None:
+            waiting = self.channel_waiting.get(channel)
+            if waiting:
+                # Hand the channel over to its next job directly
+                following = waiting.popleft()
+                following[5] = True
+                self.ready.appendleft(following)
+                if not waiting:
+                    del self.channel_waiting[channel]
+            else:
+                self.busy_channels.discard(channel)
+
+        self._pump()
+        self._check_pressure()
+
+    def _check_pressure(self):
+        if not self.max_pending:
+            return
+        if not self.paused and self.pending >= self.max_pending:
+            logger.info('Dispatcher has %d callbacks pending, pausing', self.pending)
+            self.paused = True
+            if self.on_pause is not None:
+                self.on_pause()
+        elif self.paused and self.pending <= self.max_pending // 2:
+            logger.info('Dispatcher has %d callbacks pending, resuming', self.pending)
+            self.paused = False
+            if self.on_resume is not None:
+                self.on_resume()
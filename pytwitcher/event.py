@@ -4,23 +4,117 @@ Everything else will get dropped.
 """
 
 from collections import namedtuple
+import copy
 import re
 
 from . import utils
 
 
-Raw = namedtuple('Raw', 'name, re')
+Raw = namedtuple('Raw', 'name, re, command')
+# command is the IRC command/numeric token the regex can match, None if unknown
+Raw.__new__.__defaults__ = (None,)
+
+
+class Filter:
+    """
+    Declarative conditions on a received message, all of them must hold:
+
+    - channels: channel names the message must be in
+    - users: logins the message must come from
+    - tags: {tag: value or collection of values} the message tags must have
+    - prefix: string (or tuple of strings) the text must start with, eg. '!'
+
+    The registry indexes events by their channels, the rest is checked
+    before a callback is scheduled.
+    """
+    __slots__ = ('channels', 'users', 'tags', 'prefix')
+
+    def __init__(self, channels=None, users=None, tags: dict = None, prefix=None):
+        self.channels = None if channels is None else frozenset(channel.lower() for channel in channels)
+        self.users = None if users is None else frozenset(user.lower() for user in users)
+        self.tags = None
+        if tags:
+            self.tags = tuple(
+                (key, frozenset((value,)) if isinstance(value, str) else frozenset(value))
+                for key, value in sorted(tags.items())
+            )
+        self.prefix = prefix
+
+    def matches(self, message) -> bool:
+        """
+        message is a parser.IrcMessage (or anything with channel, nick,
+        tags and text).
+        """
+        if self.channels is not None and message.channel not in self.channels:
+            return False
+        if self.users is not None:
+            nick = message.nick
+            if nick is None or nick.lower() not in self.users:
+                return False
+        if self.tags is not None:
+            tags = message.tags
+            for key, values in self.tags:
+                if tags.get(key) not in values:
+                    return False
+        if self.prefix is not None:
+            text = message.text
+            if text is None or not text.startswith(self.prefix):
+                return False
+        return True
+
+    def _key(self):
+        return (self.channels, self.users, self.tags, self.prefix)
+
+    def __eq__(self, other):
+        if not isinstance(other, Filter):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'Filter(channels={!r}, users={!r}, tags={!r}, prefix={!r})'.format(*self._key())
+
+
+def _make_filter(channels=None, users=None, tags: dict = None, prefix=None):
+    if channels is None and users is None and not tags and prefix is None:
+        return None
+    return Filter(channels, users, tags, prefix)
+
+
+def filtered(channels=None, users=None, tags: dict = None, prefix=None):
+    """
+    Decorator declaring a Filter on a listener: it is only notified when the
+    message it would get (first argument or `message` keyword) matches.
+    """
+    def decorator(func):
+        func.filter = _make_filter(channels, users, tags, prefix)
+        return func
+    return decorator
 
 
 class event:
-    def __init__(self, regexp, callback=None):
+    def __init__(self, regexp, callback=None, command: str = None,
+                 channels=None, users=None, tags: dict = None, prefix=None):
         self.regexp = regexp
         self.callback = callback
+        self._command = command
+        # Filter or None
+        self.filter = _make_filter(channels, users, tags, prefix)
 
     @property
     def key(self):
         return getattr(self.regexp, 're', self.regexp)
 
+    @property
+    def command(self):
+        """
+        IRC command the event is restricted to, used by the registry to only
+        try matchers that can match a line. None means any line.
+        """
+        return self._command or getattr(self.regexp, 'command', None)
+
     def compile(self, config: dict = None):
         if config is not None:
             regexp = self.key.format(**config)
@@ -32,48 +126,95 @@ class event:
         self.callback = func
         return self
 
+    def __get__(self, instance, owner):
+        # Used as a method decorator: bind the callback to the plugin instance
+        if instance is None or self.callback is None:
+            return self
+        bound = copy.copy(self)
+        bound.callback = self.callback.__get__(instance, owner)
+        return bound
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return (self.key, self.command, self.callback, self.filter) == (
+            other.key, other.command, other.callback, other.filter,
+        )
+
+    def __hash__(self):
+        return hash((self.key, self.command, self.callback, self.filter))
+
+
+class command(event):
+    """
+    Subscribe to every line with the given IRC command, without a regex.
+    The callback receives the tokenized line as its only argument
+    (see parser.IrcMessage).
+    """
+    def __init__(self, name: str, callback=None, **filters):
+        super().__init__(None, callback=callback, command=name, **filters)
+
+    @property
+    def key(self):
+        return self.command
+
+    def compile(self, config: dict = None):
+        raise TypeError('Command events are not compiled')
+
 
 # Numeric Replies
 
-RPL_NAMREPLY = Raw('RPL_NAMREPLY', r':(?P<srv>\S+) 353 (?P<me>\S+) (?P<m>\S+) (?P<channel>\S+) :(?P<data>.*)')
-RPL_ENDOFNAMES = Raw('RPL_ENDOFNAMES', r':(?P<srv>\S+) 366 (?P<me>\S+) (?P<channel>\S+) :(?P<data>.*)')
+RPL_NAMREPLY = Raw('RPL_NAMREPLY', r':(?P<srv>\S+) 353 (?P<me>\S+) (?P<m>\S+) (?P<channel>\S+) :(?P<data>.*)', '353')
+RPL_ENDOFNAMES = Raw('RPL_ENDOFNAMES', r':(?P<srv>\S+) 366 (?P<me>\S+) (?P<channel>\S+) :(?P<data>.*)', '366')
 
-RPL_MOTDSTART = Raw('RPL_MOTDSTART', r':(?P<srv>\S+) 375 (?P<me>\S+) :(?P<data>.*)')
-RPL_MOTD = Raw('RPL_MOTD', r':(?P<srv>\S+) 372 (?P<me>\S+) :(?P<data>.*)')
-RPL_ENDOFMOTD = Raw('RPL_ENDOFMOTD', r':(?P<srv>\S+) 376 (?P<me>\S+) :(?P<data>.*)')
+RPL_MOTDSTART = Raw('RPL_MOTDSTART', r':(?P<srv>\S+) 375 (?P<me>\S+) :(?P<data>.*)', '375')
+RPL_MOTD = Raw('RPL_MOTD', r':(?P<srv>\S+) 372 (?P<me>\S+) :(?P<data>.*)', '372')
+RPL_ENDOFMOTD = Raw('RPL_ENDOFMOTD', r':(?P<srv>\S+) 376 (?P<me>\S+) :(?P<data>.*)', '376')
 
-ERR_UNKNOWNCOMMAND = Raw('ERR_UNKNOWNCOMMAND', r':(?P<srv>\S+) 421 (?P<me>\S+) :(?P<data>.*)')
+ERR_UNKNOWNCOMMAND = Raw('ERR_UNKNOWNCOMMAND', r':(?P<srv>\S+) 421 (?P<me>\S+) :(?P<data>.*)', '421')
 
 
 # Message Replies
 
-CAP_ACK = Raw('CAP_ACK', r':(?P<srv>\S+) CAP * ACK :(?P<data>.*)')
+CAP_ACK = Raw('CAP_ACK', r':(?P<srv>\S+) CAP * ACK :(?P<data>.*)', 'CAP')
 
-PING = Raw('PING', r'PING :?(?P<data>.*)')
-PONG = Raw('PONG', r':(?P<server>\S+) PONG (?P=server)(?: :)?(?P<data>.*)')
+PING = Raw('PING', r'PING :?(?P<data>.*)', 'PING')
+PONG = Raw('PONG', r':(?P<server>\S+) PONG (?P=server)(?: :)?(?P<data>.*)', 'PONG')
 
-JOIN = Raw('JOIN', r':(?P<mask>\S+) JOIN (?P<channel>\S+)')
-PART = Raw('PART', r':(?P<mask>\S+) PART (?P<channel>\S+)')
+JOIN = Raw('JOIN', r':(?P<mask>\S+) JOIN (?P<channel>\S+)', 'JOIN')
+PART = Raw('PART', r':(?P<mask>\S+) PART (?P<channel>\S+)', 'PART')
 
-MODE = Raw('MODE', r':(?P<mask>jtv) (?P<event>MODE) (?P<target>\S+) (?P<modes>\S+)( (?P<data>\S+))?')
+MODE = Raw('MODE', r':(?P<mask>jtv) (?P<event>MODE) (?P<target>\S+) (?P<modes>\S+)( (?P<data>\S+))?', 'MODE')
 
 PRIVMSG = Raw('PRIVMSG',
-              r'(?:@(?P<tags>\S+) )?:(?P<mask>[^!]+)(?:\S+ )(?P<event>PRIVMSG) (?P<channel>\S+) :(?P<data>.+)')
-WHISPER = Raw('WHISPER', r'(?:@(?P<tags>\S+) )?:(?P<mask>[^!]+)(?:\S+ )(?P<event>WHISPER) (?P<me>\S+) :(?P<data>.+)')
+              r'(?:@(?P<tags>\S+) )?:(?P<mask>[^!]+)(?:\S+ )(?P<event>PRIVMSG) (?P<channel>\S+) :(?P<data>.+)',
+              'PRIVMSG')
+WHISPER = Raw('WHISPER',
+              r'(?:@(?P<tags>\S+) )?:(?P<mask>[^!]+)(?:\S+ )(?P<event>WHISPER) (?P<me>\S+) :(?P<data>.+)',
+              'WHISPER')
 NOTICE = Raw('NOTICE',
-             r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>NOTICE) (?P<target>\S+) :(?P<data>.+)')
+             r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>NOTICE) (?P<target>\S+) :(?P<data>.+)',
+             'NOTICE')
 USERNOTICE = Raw('USERNOTICE',
-                 r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>USERNOTICE) (?P<target>\S+) :(?P<data>.+)')
+                 r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>USERNOTICE) (?P<target>\S+) :(?P<data>.+)',
+                 'USERNOTICE')
 
 HOSTTARGET = Raw(
     'HOSTTARGET',
-    r':(?P<mask>tmi.twitch.tv) HOSTTARGET (?P<hosting_channel>\S+) :(?P<target_channel>\S+) (?P<number>\d+)'
+    r':(?P<mask>tmi.twitch.tv) HOSTTARGET (?P<hosting_channel>\S+) :(?P<target_channel>\S+) (?P<number>\d+)',
+    'HOSTTARGET',
 )
 
-CLEARCHAT = Raw('CLEARCHAT', r':(?P<mask>tmi.twitch.tv) CLEARCHAT (?P<target>\S+)( :(?P<data>\S+))?')
+CLEARCHAT = Raw('CLEARCHAT', r':(?P<mask>tmi.twitch.tv) CLEARCHAT (?P<target>\S+)( :(?P<data>\S+))?', 'CLEARCHAT')
 
-USERSTATE = Raw('USERSTATE', r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>USERSTATE) (?P<target>\S+)')
-GLOBALUSERSTATE = Raw('GLOBALUSERSTATE', r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>GLOBALUSERSTATE)')
-ROOMSTATE = Raw('ROOMSTATE', r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>ROOMSTATE) (?P<target>\S+)')
+USERSTATE = Raw('USERSTATE',
+                r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>USERSTATE) (?P<target>\S+)',
+                'USERSTATE')
+GLOBALUSERSTATE = Raw('GLOBALUSERSTATE',
+                      r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>GLOBALUSERSTATE)',
+                      'GLOBALUSERSTATE')
+ROOMSTATE = Raw('ROOMSTATE',
+                r'(?:@(?P<tags>\S+) )?:(?P<mask>tmi.twitch.tv) (?P<event>ROOMSTATE) (?P<target>\S+)',
+                'ROOMSTATE')
 
-RECONNECT = Raw('RECONNECT', r'RECONNECT')
+RECONNECT = Raw('RECONNECT', r'RECONNECT', 'RECONNECT')
@@ -0,0 +1,88 @@
+"""
+Dead connection detection: connections get a PING every interval, busy or
+not, giving the round trip time, and are aborted (so they reconnect) if
+nothing at all comes back before the timeout.
+"""
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Keepalive:
+    """
+    PINGs a connection's protocol every `interval` seconds, whatever the
+    traffic, the PONG gives the round trip time. Separately, if nothing at
+    all is received in the `timeout` seconds after a PING, the transport is
+    aborted.
+    """
+
+    def __init__(self, conn, interval: float, timeout: float):
+        self.conn = conn
+        self.loop = conn.loop
+        self.interval = interval
+        self.timeout = timeout
+
+        # Last measured round trip, in seconds
+        self.rtt = None
+        self._handle = None
+        # Idle timeout check of the last PING
+        self._deadline = None
+        self._proto = None
+        # (token, time sent) of the unanswered PING
+        self._ping = None
+
+    def start(self):
+        self.stop()
+        if not self.interval:
+            return
+        self._proto = self.conn.protocol
+        self._ping = None
+        self._handle = self.loop.call_later(self.interval, self._probe)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+
+    def _probe(self):
+        self._handle = None
+        proto = self._proto
+        if proto is not self.conn.protocol or proto.closed:
+            return
+
+        now = self.loop.time()
+        token = 'keepalive-{:.6f}'.format(now)
+        logger.debug('Connection %d: sending PING', self.conn.index)
+        proto.write('PING :{}'.format(token))
+        # The PONG of an earlier PING, if it ever comes, is ignored
+        self._ping = (token, now)
+        if self._deadline is None:
+            self._deadline = self.loop.call_later(self.timeout, self._check, proto.reads)
+        self._handle = self.loop.call_later(self.interval, self._probe)
+
+    def _check(self, reads: int):
+        self._deadline = None
+        proto = self._proto
+        if proto is not self.conn.protocol or proto.closed:
+            return
+        if proto.reads == reads:
+            logger.warning('Connection %d: nothing received for %.0fs after a PING, reconnecting',
+                           self.conn.index, self.timeout)
+            self.stop()
+            self._ping = None
+            proto.transport.abort()
+
+    def pong(self, token: str):
+        if self._ping is None or self._ping[0] != token:
+            return
+        self.rtt = self.loop.time() - self._ping[1]
+        self._ping = None
+        logger.debug('Connection %d: round trip %.3fs', self.conn.index, self.rtt)
+        metrics = self.conn.metrics
+        if metrics is not None:
+            metrics.observe('pytwitcher_rtt_seconds', self.rtt, (self.conn.label,))
@@ -0,0 +1,213 @@
+"""
+Opt-in instrumentation of the hot paths, readable from python and exported
+in the Prometheus text format.
+
+Everything recording metrics holds a `metrics` attribute that is None when
+disabled, so the cost when disabled is a single attribute check.
+"""
+
+import asyncio
+from bisect import bisect_left
+from collections import defaultdict
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# name -> (type, help, label names)
+METRICS = {
+    'pytwitcher_lines_received_total': (COUNTER, 'Lines received', ('connection',)),
+    'pytwitcher_bytes_received_total': (COUNTER, 'Bytes received', ('connection',)),
+    'pytwitcher_lines_sent_total': (COUNTER, 'Lines sent', ('connection',)),
+    'pytwitcher_bytes_sent_total': (COUNTER, 'Bytes sent', ('connection',)),
+    'pytwitcher_reconnections_total': (COUNTER, 'Reconnections', ('connection',)),
+    'pytwitcher_parse_seconds': (HISTOGRAM, 'Time to tokenize a line', ()),
+    'pytwitcher_match_seconds': (HISTOGRAM, 'Time to run an event matcher on a line', ('event',)),
+    'pytwitcher_callback_seconds': (HISTOGRAM, 'Event callback and listener run time', ('callback',)),
+    'pytwitcher_queue_wait_seconds': (HISTOGRAM, 'Time lines spend in the outbound queue', ('connection',)),
+    'pytwitcher_rtt_seconds': (HISTOGRAM, 'Round trip time of keepalive PINGs', ('connection',)),
+    'pytwitcher_flush_lines': (HISTOGRAM, 'Lines per transport write', ('connection',)),
+    'pytwitcher_flush_bytes': (HISTOGRAM, 'Bytes per transport write', ('connection',)),
+    'pytwitcher_queue_lines': (GAUGE, 'Lines in the outbound queue', ('connection',)),
+    'pytwitcher_dispatch_pending': (GAUGE, 'Callbacks waiting to run', ()),
+    'pytwitcher_dispatch_running': (GAUGE, 'Callbacks running', ()),
+    'pytwitcher_dispatch_dropped_total': (COUNTER, 'Callbacks dropped', ()),
+    'pytwitcher_spam_suppressed_total': (COUNTER, 'PRIVMSGs dropped or collapsed by the spam filter', ()),
+    'pytwitcher_cache_entries': (GAUGE, 'Entries in a plugin cache', ('plugin', 'cache')),
+    'pytwitcher_cache_bytes': (GAUGE, 'Estimated memory of a plugin cache', ('plugin', 'cache')),
+    'pytwitcher_cache_hits_total': (COUNTER, 'Plugin cache hits', ('plugin', 'cache')),
+    'pytwitcher_cache_misses_total': (COUNTER, 'Plugin cache misses', ('plugin', 'cache')),
+    'pytwitcher_cache_evictions_total': (COUNTER, 'Plugin cache entries evicted or expired', ('plugin', 'cache')),
+}
+
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, float('inf'))
+# Histograms of sizes rather than durations
+SIZE_BUCKETS = {
+    'pytwitcher_flush_lines': (1, 2, 5, 10, 20, 50, 100, float('inf')),
+    'pytwitcher_flush_bytes': (64, 256, 512, 1024, 4096, 16384, 65536, float('inf')),
+}
+
+clock = time.perf_counter
+
+
+def callback_name(func) -> str:
+    """
+    `Plugin.method` for bound methods, the qualified name otherwise.
+    """
+    owner = getattr(func, '__self__', None)
+    name = getattr(func, '__name__', None) or repr(func)
+    if owner is not None:
+        return '{}.{}'.format(type(owner).__name__, name)
+    return getattr(func, '__qualname__', name)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, metrics: dict = None):
+        self.metrics = dict(METRICS, **(metrics or {}))
+        # name -> labels tuple -> value or Histogram
+        self.values = defaultdict(dict)
+        # callables returning {(name, labels): value}, called on read
+        self.collectors = []
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        values = self.values[name]
+        values[labels] = values.get(labels, 0) + value
+
+    def set(self, name: str, labels: tuple = (), value: float = 0):
+        self.values[name][labels] = value
+
+    def observe(self, name: str, value: float, labels: tuple = ()):
+        values = self.values[name]
+        try:
+            histogram = values[labels]
+        except KeyError:
+            histogram = values[labels] = Histogram(SIZE_BUCKETS.get(name, BUCKETS))
+        histogram.observe(value)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            for (name, labels), value in collector().items():
+                self.set(name, labels, value)
+
+    def get(self, name: str, labels: tuple = ()):
+        """
+        Value of a counter or gauge, Histogram for histograms, None if
+        never recorded.
+        """
+        self.collect()
+        return self.values.get(name, {}).get(labels)
+
+    def snapshot(self) -> dict:
+        """
+        {name: {labels: value}} with histograms as {'count', 'sum', 'buckets'}.
+        """
+        self.collect()
+        snapshot = {}
+        for name, values in self.values.items():
+            snapshot[name] = {}
+            for labels, value in values.items():
+                if isinstance(value, Histogram):
+                    value = {'count': value.count, 'sum': value.sum, 'buckets': dict(zip(value.buckets, value.counts))}
+                snapshot[name][labels] = value
+        return snapshot
+
+    def _labels(self, name, labels, extra=()):
+        names = self.metrics.get(name, (None, None, ()))[2]
+        pairs = ['{}="{}"'.format(key, _escape(value)) for key, value in zip(names, labels)]
+        pairs.extend('{}="{}"'.format(key, value) for key, value in extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(pairs) + '}'
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format.
+        """
+        self.collect()
+        lines = []
+        for name in sorted(self.values):
+            kind, help_text, _ = self.metrics.get(name, (GAUGE, name, ()))
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in sorted(self.values[name].items()):
+                if isinstance(value, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(value.buckets, value.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        bucket_labels = self._labels(name, labels, (('le', le),))
+                        lines.append('{}_bucket{} {}'.format(name, bucket_labels, cumulative))
+                    lines.append('{}_sum{} {!r}'.format(name, self._labels(name, labels), value.sum))
+                    lines.append('{}_count{} {}'.format(name, self._labels(name, labels), value.count))
+                else:
+                    lines.append('{}{} {!r}'.format(name, self._labels(name, labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class MetricsHttpProtocol(asyncio.Protocol):
+    """
+    Bare HTTP/1.0 responder serving Metrics.render on GET /metrics.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.transport = None
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        if b'\r\n\r\n' not in self.buffer and b'\n\n' not in self.buffer:
+            if len(self.buffer) > 8192:
+                self.transport.close()
+            return
+
+        request_line = self.buffer.split(b'\n', 1)[0].decode('latin1').split()
+        if len(request_line) >= 2 and request_line[0] == 'GET' and request_line[1].split('?')[0] == '/metrics':
+            status = '200 OK'
+            body = self.metrics.render().encode('utf8')
+        else:
+            status = '404 Not Found'
+            body = b'Not Found\n'
+
+        self.transport.write(
+            'HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {}\r\n\r\n'.format(
+                status, len(body),
+            ).encode('latin1') + body
+        )
+        self.transport.close()
+
+
+async def start_http_server(metrics: Metrics, loop, host: str = '127.0.0.1', port: int = 9100):
+    server = await loop.create_server(lambda: MetricsHttpProtocol(metrics), host, port)
+    logger.info('Serving metrics on %s:%d', host, port)
+    return server
@@ -0,0 +1,412 @@
+"""
+Outbound line queue: priority lanes on top of the rate limiter, a
+configurable bound, and retention of unsent lines while disconnected.
+
+Within a lane lines go out in the order they were queued, except that a
+line waiting for the rate limiter only holds back the later lines of its
+channels (every later line if it has no channel, like QUIT) and of its
+rate limit group: chat does not wait for a JOIN batch, but a PART never
+overtakes its JOIN.
+Lines of a lower lane likewise wait for the higher lane lines of their
+channels.
+"""
+
+import asyncio
+from collections import deque
+import functools
+import logging
+
+from . import parser
+from . import state as state_
+
+
+logger = logging.getLogger(__name__)
+
+
+# Lanes, lower goes first. Everything not listed goes in NORMAL, BULK is
+# only used when asked for explicitly
+HIGH = 0
+NORMAL = 1
+BULK = 2
+
+LANES = {
+    'CAP': HIGH,
+    'NICK': HIGH,
+    'PASS': HIGH,
+    'PING': HIGH,
+    'PONG': HIGH,
+}
+
+# Overflow policies
+ERROR = 'error'  # send_line raises asyncio.QueueFull
+DROP_NEWEST = 'drop_newest'  # the new line's future fails with asyncio.QueueFull
+DROP_OLDEST = 'drop_oldest'  # the oldest line of the lowest lane is dropped instead
+POLICIES = (ERROR, DROP_NEWEST, DROP_OLDEST)
+
+
+def _channels(message) -> tuple:
+    """
+    Channels a parsed line is about, (None,) for lines about no channel.
+    """
+    if message.command in ('JOIN', 'PART') and message.params:
+        return tuple(message.params[0].split(','))
+    return (message.channel,)
+
+
+def all_written(loop, futures: list) -> asyncio.Future:
+    """
+    Future of a line sent in several parts, resolves once every part is
+    written, fails with the first part that fails. Cancelling it cancels the
+    parts.
+    """
+    gathered = asyncio.gather(*futures)
+    future = loop.create_future()
+
+    def done(gathered):
+        if future.done():
+            return
+        if gathered.cancelled():
+            future.cancel()
+        elif gathered.exception() is not None:
+            future.set_exception(gathered.exception())
+        else:
+            future.set_result(True)
+
+    def cancel(future):
+        if future.cancelled():
+            gathered.cancel()
+
+    gathered.add_done_callback(done)
+    future.add_done_callback(cancel)
+    return future
+
+
+def _insert(items: deque, item, sequence: int, key=None):
+    # Lines given back are older than most queued ones, look from the left
+    index = 0
+    for other in items:
+        if (other if key is None else key(other)) > sequence:
+            break
+        index += 1
+    items.insert(index, item)
+
+
+class OutboundQueue:
+    """
+    Lines wait in their lane, grouped by the rate limiter buckets they need,
+    until they can be written. Lines are only removed once handed to the
+    writer, so nothing is lost while paused (disconnected or not logged in
+    yet) and everything is replayed in order when resumed.
+
+    HIGH lane lines are never dropped and don't count towards max_size.
+    """
+
+    def __init__(self, loop, rate_limiter, max_size: int = 0, policy: str = ERROR, metrics=None, label: str = '0',
+                 state=None):
+        if policy not in POLICIES:
+            raise ValueError('Unknown overflow policy {}'.format(policy))
+
+        self.loop = loop
+        self.rate_limiter = rate_limiter
+        self.max_size = max_size
+        self.policy = policy
+        # metrics.Metrics if enabled, label is the connection index
+        self.metrics = metrics
+        self.metrics_labels = (label,)
+        # state.StateCache: lines it says Twitch would reject are not sent
+        self.state = state
+
+        # lane -> {buckets: deque of (sequence, future, line, cost, queued at, channels)}
+        self.lanes = tuple({} for _ in range(BULK + 1))
+        # lane -> {channel or None: deque of the sequences of its lines}
+        self.channel_lines = tuple({} for _ in range(BULK + 1))
+        self._sequence = 0
+        # queued lines counting towards max_size
+        self.size = 0
+        self.dropped = 0
+
+        # callable writing a line, None while paused
+        self.writer = None
+        self._waiter = None
+        self._drain_waiters = deque()
+
+    def __len__(self):
+        return sum(len(lines) for lane in self.lanes for lines in lane.values())
+
+    @property
+    def paused(self) -> bool:
+        return self.writer is None
+
+    def full(self) -> bool:
+        return 0 < self.max_size <= self.size
+
+    def put(self, line: str, priority: int = None, message=None) -> asyncio.Future:
+        """
+        Queue a line, the returned future resolves once the line is handed to
+        the transport. The writer may return a future for lines it batches,
+        lines are given back to the queue if it fails. message is the parsed
+        line if the caller has it, it is parsed only once for the rate
+        limiter and the state cache.
+        """
+        if message is None:
+            message = parser.parse(line)
+        if priority is None:
+            priority = LANES.get(message.command, NORMAL)
+
+        parts = self.rate_limiter.split(line, message)
+        if len(parts) > 1:
+            return self._put_parts(parts, priority)
+
+        future = self.loop.create_future()
+
+        if priority != HIGH and self.full():
+            if self.policy == ERROR:
+                raise asyncio.QueueFull()
+            if self.policy == DROP_NEWEST or not self._drop_oldest():
+                self.dropped += 1
+                future.set_exception(asyncio.QueueFull())
+                return future
+
+        buckets, cost = self.rate_limiter.get_buckets(message)
+        lane = self.lanes[priority]
+        try:
+            lines = lane[buckets]
+        except KeyError:
+            lines = lane[buckets] = deque()
+        self._sequence += 1
+        queued_at = self.loop.time() if self.metrics is not None else 0
+        channels = _channels(message)
+        lines.append((self._sequence, future, line, cost, queued_at, channels, message))
+        channel_lines = self.channel_lines[priority]
+        for channel in channels:
+            try:
+                channel_lines[channel].append(self._sequence)
+            except KeyError:
+                channel_lines[channel] = deque((self._sequence,))
+        if priority != HIGH:
+            self.size += 1
+
+        self._wakeup()
+        return future
+
+    def _put_parts(self, parts: list, priority: int) -> asyncio.Future:
+        # A line the rate limiter split, its future resolves once every part
+        # is written
+        if priority != HIGH and self.policy == ERROR and 0 < self.max_size < self.size + len(parts):
+            raise asyncio.QueueFull()
+        return all_written(self.loop, [self.put(part, priority) for part in parts])
+
+    def _drop_oldest(self) -> bool:
+        for priority in range(BULK, HIGH, -1):
+            lane = self.lanes[priority]
+            if not lane:
+                continue
+            buckets, lines = min(lane.items(), key=lambda item: item[1][0][0])
+            _, future, line, _, _, _, _ = lines[0]
+            self._pop(priority, buckets, lines)
+            self.dropped += 1
+            logger.warning('Outbound queue full, dropping %s', line)
+            if not future.done():
+                future.set_exception(asyncio.QueueFull())
+            return True
+        return False
+
+    def pause(self):
+        if self.writer is not None:
+            logger.debug('Pausing outbound queue with %d lines', len(self))
+        self.writer = None
+
+    def resume(self, writer):
+        logger.debug('Resuming outbound queue with %d lines', len(self))
+        self.writer = writer
+        self._wakeup()
+
+    def clear(self):
+        for lane in self.lanes:
+            for lines in lane.values():
+                for _, future, _, _, _, _, _ in lines:
+                    future.cancel()
+            lane.clear()
+        for channel_lines in self.channel_lines:
+            channel_lines.clear()
+        self.size = 0
+        self._wakeup_drain()
+
+    def _wakeup(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _wakeup_drain(self):
+        waiters = self._drain_waiters
+        while waiters and self.size <= self.max_size // 2:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def drain(self):
+        """
+        Backpressure: wait until the queue is at most half full.
+        """
+        if self.max_size <= 0 or self.size <= self.max_size // 2:
+            return
+        waiter = self.loop.create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def send_ready(self):
+        """
+        Write every queued line the rate limits allow right now, by lane and
+        in queue order (see the module docstring). Returns the delay until the
+        next line can be sent, None if there is nothing to wait for (empty or
+        paused).
+        """
+        next_delay = None
+        limiter = self.rate_limiter
+        metrics = self.metrics
+        state = self.state
+
+        for priority, lane in enumerate(self.lanes):
+            channel_lines = self.channel_lines[priority]
+            # Groups of lines by buckets, their heads taken in sequence order:
+            # the lines queued before a head are sent or in a waiting group
+            groups = list(lane.items())
+            waiting = False
+            while groups:
+                if self.writer is None:
+                    return None
+
+                group = min(groups, key=lambda item: item[1][0][0])
+                buckets, lines = group
+                entry = lines[0]
+                sequence, future, line, cost, queued_at, channels, message = entry
+                if future.cancelled():
+                    self._pop(priority, buckets, lines)
+                    if not lines:
+                        groups.remove(group)
+                    continue
+
+                if channels[0] is None:
+                    held = waiting or any(self.lanes[:priority])
+                else:
+                    held = None in channel_lines and channel_lines[None][0] < sequence
+                    for channel in channels:
+                        held = held or channel_lines[channel][0] != sequence
+                    # Lines left in higher lanes all wait
+                    for higher in self.channel_lines[:priority]:
+                        held = held or None in higher or not higher.keys().isdisjoint(channels)
+                if not held:
+                    delay = limiter.delay(buckets, cost)
+                    if delay > 0:
+                        held = True
+                        if next_delay is None or delay < next_delay:
+                            next_delay = delay
+                if held:
+                    # Waits for the rate limiter or an earlier line, and so
+                    # do the lines after it in its group
+                    groups.remove(group)
+                    waiting = True
+                    continue
+
+                if state is not None:
+                    reason = state.rejects(message)
+                    if reason is not None:
+                        logger.info('Not sending %s, Twitch would reject it (%s)', line, reason)
+                        self._pop(priority, buckets, lines)
+                        if not lines:
+                            groups.remove(group)
+                        if not future.done():
+                            future.set_exception(state_.MessageRejected(reason))
+                        continue
+
+                try:
+                    written = self.writer(line)
+                except Exception:
+                    # Keep the line for the next connection
+                    logger.warning('Could not write %s, pausing', line, exc_info=True)
+                    self.pause()
+                    return None
+
+                self._pop(priority, buckets, lines)
+                if not lines:
+                    groups.remove(group)
+                limiter.consume(buckets, cost)
+                if state is not None:
+                    state.sent(message)
+                if metrics is not None:
+                    waited = self.loop.time() - queued_at
+                    metrics.observe('pytwitcher_queue_wait_seconds', waited, self.metrics_labels)
+                if written is not None:
+                    # Batched by the protocol, see _flushed
+                    written.add_done_callback(functools.partial(self._flushed, priority, buckets, entry))
+                elif not future.done():
+                    future.set_result(True)
+
+        self._wakeup_drain()
+        return next_delay
+
+    def _flushed(self, priority: int, buckets, entry: tuple, written: asyncio.Future):
+        """
+        A line the writer batched is written, or lost with its connection:
+        it goes back in the queue, in its place.
+        """
+        future = entry[1]
+        if not written.cancelled() and written.exception() is None:
+            if not future.done():
+                future.set_result(True)
+            return
+        if future.done():
+            return
+        logger.debug('Queueing %s again, it was not written', entry[2])
+        sequence = entry[0]
+        lane = self.lanes[priority]
+        try:
+            lines = lane[buckets]
+        except KeyError:
+            lines = lane[buckets] = deque()
+        _insert(lines, entry, sequence, key=lambda item: item[0])
+        channel_lines = self.channel_lines[priority]
+        for channel in entry[5]:
+            try:
+                sequences = channel_lines[channel]
+            except KeyError:
+                sequences = channel_lines[channel] = deque()
+            _insert(sequences, sequence, sequence)
+        if priority != HIGH:
+            self.size += 1
+        self._wakeup()
+
+    def _pop(self, priority: int, buckets, lines: deque):
+        """
+        Remove the first line of a group.
+        """
+        sequence, _, _, _, _, channels, _ = lines.popleft()
+        lane = self.lanes[priority]
+        if not lines:
+            del lane[buckets]
+        if priority != HIGH:
+            self.size -= 1
+        channel_lines = self.channel_lines[priority]
+        for channel in channels:
+            sequences = channel_lines[channel]
+            if sequences[0] == sequence:
+                sequences.popleft()
+            else:
+                # Cancelled or rejected behind an earlier line
+                sequences.remove(sequence)
+            if not sequences:
+                del channel_lines[channel]
+
+    async def run(self):
+        while True:
+            delay = self.send_ready()
+            self._waiter = self.loop.create_future()
+            handle = None
+            if delay is not None:
+                handle = self.loop.call_later(delay, self._wakeup)
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+                if handle is not None:
+                    handle.cancel()
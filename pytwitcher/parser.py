@@ -0,0 +1,74 @@
+"""
+Single pass IRCv3 line tokenizer.
+http://ircv3.net/specs/core/message-tags-3.2.html
+"""
+
+from collections import namedtuple
+
+from . import utils
+
+
+class IrcMessage(namedtuple('IrcMessage', 'raw, tags, prefix, command, params')):
+    """
+    A tokenized IRC line.
+    tags is a lazy utils.Tags mapping (empty if the line has none), prefix
+    is None if the line has none, params includes the trailing parameter as
+    last element.
+    """
+    __slots__ = ()
+
+    @property
+    def nick(self):
+        if self.prefix is None:
+            return None
+        return self.prefix.partition('!')[0]
+
+    @property
+    def channel(self):
+        if self.params and self.params[0].startswith('#'):
+            return self.params[0]
+        return None
+
+    @property
+    def text(self):
+        if self.params:
+            return self.params[-1]
+        return None
+
+
+def parse(line: str) -> IrcMessage:
+    """
+    Split a raw line into tags, prefix, command and params.
+    Never raises, malformed lines get an empty command.
+    """
+    tags = ''
+    prefix = None
+    start = 0
+
+    if line.startswith('@'):
+        end = line.find(' ')
+        if end == -1:
+            return IrcMessage(line, utils.Tags(line[1:]), None, '', [])
+        tags = line[1:end]
+        start = end + 1
+
+    if line.startswith(':', start):
+        end = line.find(' ', start)
+        if end == -1:
+            return IrcMessage(line, utils.Tags(tags), line[start + 1:], '', [])
+        prefix = line[start + 1:end]
+        start = end + 1
+
+    end = line.find(' :', start)
+    if end == -1:
+        params = line[start:].split()
+    else:
+        params = line[start:end].split()
+        params.append(line[end + 2:])
+
+    if params:
+        command = params.pop(0)
+    else:
+        command = ''
+
+    return IrcMessage(line, utils.Tags(tags), prefix, command, params)
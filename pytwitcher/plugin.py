@@ -1,18 +1,71 @@
 """
 Convenience class for plugins to subclass.
-Provides settings interface.
+Provides settings interface, caches, and chat commands (see
+commands.chat_command).
 """
 
 from copy import deepcopy
 
+from . import cache as cache_
+from .commands import chat_command
+
+
+__all__ = ('BasePlugin', 'chat_command')
+
 
 class BasePlugin:
     DEFAULTS = None
 
     def __init__(self, bot):
         self.bot = bot
+        # name -> cache.Cache, see cache()
+        self.caches = {}
         self._load_config()
 
+    def cache(self, name: str, max_size: int = 0, ttl: float = 0, **kwargs) -> cache_.Cache:
+        """
+        New cache, counted in this plugin's memory() and metrics, cleared
+        when the plugin is unloaded. See cache.Cache for the arguments.
+        """
+        if name in self.caches:
+            raise ValueError('Cache {} already exists'.format(name))
+        cache = self.caches[name] = cache_.Cache(max_size, ttl, loop=self.bot.loop, **kwargs)
+        return cache
+
+    def memory(self) -> int:
+        """
+        Estimated bytes used by the entries of the plugin's caches.
+        """
+        return sum(cache.bytes for cache in self.caches.values())
+
+    def cache_stats(self) -> dict:
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def unload(self):
+        # Caches taken over by the instance reloaded in place of this one
+        # (see reloaded) are kept
+        current = self.bot.registry.plugins.get(type(self).__name__)
+        adopted = ()
+        if current is not None and current is not self:
+            adopted = {id(cache) for cache in getattr(current, 'caches', {}).values()}
+        for cache in self.caches.values():
+            if id(cache) not in adopted:
+                cache.close()
+
+    def reply(self, message, text: str):
+        """
+        Answer a PRIVMSG (eg. a command) in its channel, returns the
+        send_line future.
+        """
+        return self.bot.send_line('PRIVMSG {} :{}'.format(message.channel, text))
+
+    def reloaded(self, previous):
+        """
+        Called on hot reload (see IrcObject.reload) with the instance this
+        one replaces, before it is unloaded: copy the state to keep. Caches
+        taken over (self.caches = previous.caches) are not cleared.
+        """
+
     @classmethod
     def _get_config_key(cls):
         return cls.__name__
@@ -10,41 +10,55 @@ class EventTranslator:
         self.bot = bot
         # One time events that we only need to register temporarily
         self.before_connect_events = [
-            event.event(event.NOTICE, callback=self.check_login),
-            event.event(event.RPL_ENDOFMOTD, callback=self.remove_events),
-            event.event(event.GLOBALUSERSTATE, callback=self.set_user_state)
+            event.command('NOTICE', callback=self.check_login),
+            event.command('376', callback=self.remove_events),  # RPL_ENDOFMOTD
+            event.command('GLOBALUSERSTATE', callback=self.set_user_state),
         ]
 
     def handle_connection_attempted(self):
+        # Every connection (shard) attempts, only register them once
         for irc_event in self.before_connect_events:
+            self.bot.remove_irc_event(irc_event)
             self.bot.add_irc_event(irc_event)
 
-    async def check_login(self, tags, mask, event, target, data):
-        if data == 'Login authentication failed':
+    async def check_login(self, message):
+        if message.text == 'Login authentication failed':
             self.bot.notify('login_failed')
 
-    async def remove_events(self, **kwargs):
+    async def remove_events(self, message):
         for irc_event in self.before_connect_events:
             self.bot.remove_irc_event(irc_event)
 
-    async def set_user_state(self, data):
-        pass
+    async def set_user_state(self, message):
+        self.bot.state.update_global(message.tags)
+
+    @event.command('USERSTATE')
+    async def user_state(self, message):
+        self.bot.state.update_user(message.channel, message.tags)
+        # Moderators, broadcasters and VIPs get a higher rate limit in their channels
+        badges = message.tags.badges
+        elevated = 'moderator' in badges or 'broadcaster' in badges or 'vip' in badges
+        self.bot.rate_limiter.set_elevated(message.channel, elevated)
+
+    @event.command('ROOMSTATE')
+    async def room_state(self, message):
+        self.bot.state.update_room(message.channel, message.tags)
 
-    @event.event(event.NOTICE)
-    async def notice(self, tags, target, data):
-        if tags and 'msg-id' in tags:
-            self.bot.notify('notice', notice_type=enum[tags['msg-id']])
+    @event.command('NOTICE')
+    async def notice(self, message):
+        if 'msg-id' in message.tags:
+            self.bot.notify('notice', notice_type=message.tags['msg-id'])
 
-    @event.event(event.USERNOTICE)
-    async def usernotice(self, tags, target, data):
+    @event.command('USERNOTICE')
+    async def usernotice(self, message):
         pass
 
-    @event.event(event.PRIVMSG)
-    async def privmsg(self, tags, target, data):
+    @event.command('PRIVMSG')
+    async def privmsg(self, message):
         # handle resubscribe from twitchnotify
         pass
 
-    @event.event(event.RECONNECT)
-    async def reconnect(self):
-        # Log
-        self.bot.create_connection()
+    @event.command('RECONNECT')
+    async def reconnect(self, message):
+        # The connection receiving it reconnects by itself
+        self.bot.notify('reconnect')
@@ -1,17 +1,198 @@
+"""
+Who is in which channel, from NAMES replies, JOIN/PART and chatting.
+
+Logins and channel names are interned (see data.normalize). Each channel
+has a set of logins, and a reverse index maps a login to its channel, or
+to a set of channels once in several, so most chatters (in one channel)
+cost a single dict entry there.
+"""
+
+import logging
+
+from pytwitcher import data
 from pytwitcher import event
 
+
+logger = logging.getLogger(__name__)
+
+
 class UserList:
     def __init__(self, bot):
         self.bot = bot
+        # channel -> set of logins
+        self.channels = {}
+        # login -> channel, or set of channels when in more than one
+        self.user_channels = {}
+        # channels whose NAMES list is being received
+        self.receiving_names = set()
+
+    def reloaded(self, previous):
+        # Keep the lists, NAMES are only sent on JOIN
+        self.channels = previous.channels
+        self.user_channels = previous.user_channels
+        self.receiving_names = previous.receiving_names
+
+    # queries
+
+    def get_users(self, channel: str) -> set:
+        """
+        Logins in channel, the set is live: don't modify it.
+        """
+        return self.channels.get(data.normalize(channel), frozenset())
+
+    def count(self, channel: str) -> int:
+        users = self.channels.get(data.normalize(channel))
+        return 0 if users is None else len(users)
+
+    def get_channels(self, login: str) -> frozenset:
+        channels = self.user_channels.get(data.normalize(login))
+        if channels is None:
+            return frozenset()
+        if isinstance(channels, str):
+            return frozenset((channels,))
+        return frozenset(channels)
+
+    def is_in(self, login: str, channel: str) -> bool:
+        users = self.channels.get(data.normalize(channel))
+        return users is not None and data.normalize(login) in users
+
+    # bookkeeping
+
+    def _add(self, channel: str, login: str):
+        users = self.channels.get(channel)
+        if users is None or login in users:
+            # Not (or no longer) in the channel ourselves
+            return
+        users.add(login)
+
+        index = self.user_channels
+        channels = index.get(login)
+        if channels is None:
+            index[login] = channel
+        elif isinstance(channels, str):
+            index[login] = {channels, channel}
+        else:
+            channels.add(channel)
+
+    def _remove(self, channel: str, login: str):
+        users = self.channels.get(channel)
+        if users is None or login not in users:
+            return
+        users.discard(login)
+        self._unindex(channel, login)
+
+    def _unindex(self, channel: str, login: str):
+        index = self.user_channels
+        channels = index.get(login)
+        if channels is None:
+            return
+        if isinstance(channels, str):
+            if channels == channel:
+                del index[login]
+            return
+        channels.discard(channel)
+        if len(channels) == 1:
+            index[login] = channels.pop()
+
+    def add_channel(self, channel: str):
+        self.channels.setdefault(data.normalize(channel), set())
+
+    def remove_channel(self, channel: str):
+        """
+        Forget a channel and its users at once (we left it).
+        """
+        channel = data.normalize(channel)
+        users = self.channels.pop(channel, None)
+        self.receiving_names.discard(channel)
+        if not users:
+            return
+        if not self.channels:
+            # Last channel, nothing else to keep in the index
+            self.user_channels.clear()
+            return
+        unindex = self._unindex
+        for login in users:
+            unindex(channel, login)
+
+    def clear(self):
+        self.channels.clear()
+        self.user_channels.clear()
+        self.receiving_names.clear()
+
+    def _is_me(self, login: str) -> bool:
+        nick = self.bot.config['nick']
+        if nick:
+            return login == nick.lower()
+        return login.startswith('justinfan')
+
+    # events
+
+    def handle_connection_lost(self):
+        # We are out of every channel of the lost connection(s)
+        channels = self.bot.channels
+        default = self.bot.connections[0]
+        lost = [channel for channel in self.channels if not channels.get(channel, default).connected]
+        if len(lost) == len(self.channels):
+            self.clear()
+        else:
+            for channel in lost:
+                self.remove_channel(channel)
+
+    @event.command('353')  # RPL_NAMREPLY
+    async def names(self, message):
+        # :nick.tmi.twitch.tv 353 nick = #channel :user1 user2 ...
+        params = message.params
+        if len(params) < 4:
+            return
+        channel = data.normalize(params[2])
+        if channel not in self.receiving_names:
+            self.receiving_names.add(channel)
+            self.add_channel(channel)
+        add = self._add
+        for login in params[3].split():
+            add(channel, data.normalize(login))
+
+    @event.command('366')  # RPL_ENDOFNAMES
+    async def end_of_names(self, message):
+        if len(message.params) < 2:
+            return
+        channel = data.normalize(message.params[1])
+        self.receiving_names.discard(channel)
+        logger.debug('%d users in %s', self.count(channel), channel)
 
-    @event.event(event.JOIN)
-    def join(self):
-        pass
+    @event.command('JOIN')
+    async def join(self, message):
+        login = message.nick
+        if login is None or not message.params:
+            return
+        login = data.normalize(login)
+        channel = data.normalize(message.params[0])
+        if self._is_me(login):
+            self.add_channel(channel)
+        self._add(channel, login)
 
-    @event.event(event.PART)
-    def part(self):
-        pass
+    @event.command('PART')
+    async def part(self, message):
+        login = message.nick
+        if login is None or not message.params:
+            return
+        login = data.normalize(login)
+        channel = data.normalize(message.params[0])
+        if self._is_me(login):
+            self.remove_channel(channel)
+        else:
+            self._remove(channel, login)
 
-    @event.event(event.PRIVMSG)
-    def privmsg(self):
-        pass
+    @event.command('PRIVMSG')
+    async def privmsg(self, message):
+        # Twitch only sends JOIN/PART for channels under 1000 chatters,
+        # and with a delay, anyone talking is in the channel
+        login = message.nick
+        channel = message.channel
+        if login is None or channel is None:
+            return
+        users = self.channels.get(channel)
+        if users is None:
+            users = self.channels.get(channel.lower())
+        if users is not None and login not in users:
+            self._add(data.normalize(channel), data.normalize(login))
@@ -10,6 +10,28 @@ class IrcProtocol(asyncio.Protocol):
         self.encoding = factory.encoding
         self.transport = None
         self.closed = True
+        # Received bytes not forming a complete line yet
+        self.buffer = bytearray()
+        # Number of reads, for keepalive.Keepalive to tell if it is silent
+        self.reads = 0
+        # metrics.Metrics if enabled, labelled with the connection index
+        self.metrics = getattr(factory, 'metrics', None)
+        self.metrics_labels = (str(getattr(factory, 'index', 0)),)
+        # archive.ArchiveWriter given the bytes of the complete lines of
+        # each read, if any
+        self.archive = getattr(factory, 'archive', None)
+        # Outbound lines are gathered and written at once after write_window
+        # seconds (0: at the end of the loop iteration), None writes each
+        # line right away
+        self.write_window = getattr(factory, 'write_window', None)
+        self.loop = getattr(factory, 'loop', None)
+        # Encoded lines (and their \r\n) waiting for the flush
+        self.pending = []
+        self.pending_lines = 0
+        self._flush_handle = None
+        # Resolves once the pending lines are handed to the transport, fails
+        # if the connection is lost before
+        self._flushed = None
 
     def connection_made(self, transport):
         self.transport = transport
@@ -18,11 +40,53 @@ class IrcProtocol(asyncio.Protocol):
     def decode(self, data):
         return data.decode(self.encoding, 'ignore')
 
+    def frame(self, buffer, view: memoryview, end: int) -> int:
+        """
+        Process the complete lines in buffer[:end], decoding them straight
+        from view (a memoryview of buffer) to avoid copies.
+        Returns the number of bytes consumed, the rest is a partial line.
+        """
+        encoding = self.encoding
+        process_data = self.factory.process_data
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        start = 0
+        lines = 0
+        while True:
+            newline = buffer.find(b'\n', start, end)
+            if newline == -1:
+                if lines and self.metrics is not None:
+                    self.metrics.inc('pytwitcher_lines_received_total', self.metrics_labels, lines)
+                return start
+
+            stop = newline
+            if stop > start and buffer[stop - 1] == 13:  # \r
+                stop -= 1
+
+            if stop > start:
+                line = str(view[start:stop], encoding, 'ignore')
+                lines += 1
+                if debug:
+                    logger.debug('< %s', line)
+                try:
+                    process_data(line)
+                except Exception:
+                    logger.exception('Error when processing %s', line)
+
+            start = newline + 1
+
     def data_received(self, data):
-        data = self.decode(data)
-        for line in data.split('\r\n')[:-1]:
-            logger.debug('< {}'.format(data))
-            self.factory.process_data(line)
+        self.reads += 1
+        if self.metrics is not None:
+            self.metrics.inc('pytwitcher_bytes_received_total', self.metrics_labels, len(data))
+        buffer = self.buffer
+        buffer += data
+        with memoryview(buffer) as view:
+            consumed = self.frame(buffer, view, len(buffer))
+        if consumed:
+            if self.archive is not None:
+                self.archive.feed(buffer[:consumed])
+            del buffer[:consumed]
 
     def encode(self, data):
         if isinstance(data, str):
@@ -30,24 +94,135 @@ class IrcProtocol(asyncio.Protocol):
         return data
 
     def write(self, data):
-        logger.debug('> {}'.format(data))
-        if data is not None:
-            data = self.encode(data)
+        """
+        Write a line, returns None if it was handed to the transport, or a
+        future resolving once it is (see flush) when batching.
+        """
+        if data is None:
+            return None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('> %s', data)
+        data = self.encode(data)
+        if self.write_window is None:
             if not data.endswith(b'\r\n'):
-                data = data + b'\r\n'
-            self.transport.write(data)
+                data += b'\r\n'
+            self._write(data, 1)
+            return None
+
+        pending = self.pending
+        pending.append(data)
+        if not data.endswith(b'\r\n'):
+            pending.append(b'\r\n')
+        self.pending_lines += 1
+        if self._flush_handle is None:
+            if self.write_window:
+                self._flush_handle = self.loop.call_later(self.write_window, self.flush)
+            else:
+                self._flush_handle = self.loop.call_soon(self.flush)
+        if self._flushed is None:
+            self._flushed = self.loop.create_future()
+        return self._flushed
+
+    def flush(self):
+        """
+        Write the pending lines in one transport write (one TLS record).
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.pending:
+            return
+        data = b''.join(self.pending)
+        lines = self.pending_lines
+        flushed, self._flushed = self._flushed, None
+        self.pending.clear()
+        self.pending_lines = 0
+        if lines > 1:
+            logger.debug('Flushing %d lines, %d bytes', lines, len(data))
+        try:
+            self._write(data, lines)
+        except Exception as exc:
+            if flushed is not None:
+                flushed.set_exception(exc)
+            raise
+        if flushed is not None:
+            flushed.set_result(True)
+
+    def _write(self, data: bytes, lines: int):
+        self.transport.write(data)
+        metrics = self.metrics
+        if metrics is not None:
+            labels = self.metrics_labels
+            metrics.inc('pytwitcher_lines_sent_total', labels, lines)
+            metrics.inc('pytwitcher_bytes_sent_total', labels, len(data))
+            metrics.observe('pytwitcher_flush_lines', lines, labels)
+            metrics.observe('pytwitcher_flush_bytes', len(data), labels)
 
     def connection_lost(self, exc):
         logger.warning('Connection lost')
-        self.factory.notify('connection_lost')
-        if not self.closed:
-            self.close()
-            self.factory.loop.call_later(2, self.factory.create_connection)
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.pending.clear()
+        self.pending_lines = 0
+        if self._flushed is not None:
+            # The outbound queue takes the lines back
+            self._flushed.set_exception(ConnectionResetError('Connection lost before writing'))
+            self._flushed = None
+        # Closed by us, the factory already has a replacement
+        reconnect = not self.closed
+        self.closed = True
+        self.factory.connection_lost(self, reconnect)
 
     def close(self):
         if not self.closed:
             logger.debug('Closing protocol')
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Error when flushing pending lines')
             try:
                 self.transport.close()
             finally:
                 self.closed = True
+
+
+if hasattr(asyncio, 'BufferedProtocol'):
+    class IrcBufferedProtocol(IrcProtocol, asyncio.BufferedProtocol):
+        """
+        Receives directly into a preallocated buffer instead of getting a new
+        bytes object per read (python 3.7+).
+        """
+
+        def __init__(self, factory, buffer_size: int = 65536):
+            super().__init__(factory)
+            self.buffer = bytearray(buffer_size)
+            self.view = memoryview(self.buffer)
+            # Bytes of self.buffer holding received data
+            self.end = 0
+
+        def get_buffer(self, sizehint):
+            if self.end == len(self.buffer):
+                # A single line fills the buffer, grow it
+                buffer = bytearray(len(self.buffer) * 2)
+                buffer[:self.end] = self.buffer
+                self.buffer = buffer
+                self.view = memoryview(buffer)
+            return self.view[self.end:]
+
+        def buffer_updated(self, nbytes):
+            self.reads += 1
+            if self.metrics is not None:
+                self.metrics.inc('pytwitcher_bytes_received_total', self.metrics_labels, nbytes)
+            self.end += nbytes
+            consumed = self.frame(self.buffer, self.view, self.end)
+            if consumed:
+                if self.archive is not None:
+                    self.archive.feed(self.buffer[:consumed])
+                # Move the partial line to the front, same size so allowed
+                # while the memoryview is exported
+                remaining = self.end - consumed
+                self.buffer[:remaining] = self.buffer[consumed:self.end]
+                self.end = remaining
+else:
+    IrcBufferedProtocol = None
@@ -0,0 +1,137 @@
+"""
+Outbound rate limiting following the Twitch limits.
+https://dev.twitch.tv/docs/irc/guide#command--message-limits
+"""
+
+from collections import deque
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows `rate` tokens per `period` seconds, all of them in a burst if
+    needed.
+    Unlike a classic token bucket, a token is given back `period` seconds
+    after being spent rather than continuously: this is how Twitch counts,
+    so no `period` long window ever sees more than `rate` lines.
+    """
+    __slots__ = ('rate', 'period', 'clock', 'spent')
+
+    def __init__(self, rate: int, period: float, clock):
+        self.rate = rate
+        self.period = period
+        self.clock = clock
+        # times at which the spent tokens were taken, oldest first
+        self.spent = deque()
+
+    def _expire(self, now):
+        spent = self.spent
+        limit = now - self.period
+        while spent and spent[0] <= limit:
+            spent.popleft()
+
+    def delay(self, cost: int = 1) -> float:
+        """
+        Seconds until `cost` tokens are available, 0 if they are now.
+        """
+        now = self.clock()
+        self._expire(now)
+        cost = min(cost, self.rate)
+        missing = len(self.spent) + cost - self.rate
+        if missing <= 0:
+            return 0
+        return self.spent[missing - 1] + self.period - now
+
+    def consume(self, cost: int = 1):
+        now = self.clock()
+        self.spent.extend([now] * min(cost, self.rate))
+        # Never keep more than rate timestamps, older ones are irrelevant
+        while len(self.spent) > self.rate:
+            self.spent.popleft()
+
+    @property
+    def available(self) -> int:
+        self._expire(self.clock())
+        return self.rate - len(self.spent)
+
+
+class RateLimiter:
+    """
+    Picks the buckets an outbound line has to go through:
+
+    - PRIVMSG to a channel where we are moderator, broadcaster or VIP only counts
+      towards the elevated limit, otherwise towards both the normal and the
+      elevated one (the elevated one is the global cap)
+    - whispers (.w/ /w) also go through the whisper limit
+    - JOIN goes through the JOIN limit, once per joined channel (see split
+      for JOINs over the limit)
+    - everything else (auth, CAP, PONG, PART...) is not limited
+    """
+
+    def __init__(self, config: dict, clock):
+        period = config['flood_delay']
+        self.normal = TokenBucket(config['flood_rate_normal'], period, clock)
+        self.elevated = TokenBucket(config['flood_rate_elevated'], period, clock)
+        self.join = TokenBucket(config['flood_rate_join'], config['flood_delay_join'], clock)
+        self.whisper = TokenBucket(config['flood_rate_whisper'], config['flood_delay_whisper'], clock)
+
+        # Channels where we are moderator, broadcaster or VIP, from USERSTATE
+        self.elevated_channels = set()
+
+    def set_elevated(self, channel: str, elevated: bool):
+        if elevated:
+            if channel not in self.elevated_channels:
+                logger.debug('Using elevated rate limit in %s', channel)
+            self.elevated_channels.add(channel)
+        else:
+            self.elevated_channels.discard(channel)
+
+    def is_elevated(self, channel: str) -> bool:
+        return channel in self.elevated_channels
+
+    def get_buckets(self, message):
+        """
+        Return (buckets, cost) for a parsed outbound line.
+        """
+        command = message.command
+
+        if command == 'PRIVMSG':
+            if message.text is not None and message.text.startswith(('.w ', '/w ')):
+                return (self.whisper, self.normal, self.elevated), 1
+            if self.is_elevated(message.channel):
+                return (self.elevated,), 1
+            return (self.normal, self.elevated), 1
+
+        if command == 'JOIN' and message.params:
+            return (self.join,), message.params[0].count(',') + 1
+
+        return (), 0
+
+    def split(self, line: str, message) -> list:
+        """
+        Lines to send for line, message being the parsed line: JOINs of more
+        channels than the JOIN limit allows at once are split, the bucket
+        could never cover them.
+        """
+        if message.command != 'JOIN' or not message.params:
+            return [line]
+        channels = message.params[0].split(',')
+        rate = max(1, self.join.rate)
+        if len(channels) <= rate:
+            return [line]
+        return ['JOIN ' + ','.join(channels[i:i + rate]) for i in range(0, len(channels), rate)]
+
+    @staticmethod
+    def delay(buckets, cost: int) -> float:
+        delay = 0
+        for bucket in buckets:
+            delay = max(delay, bucket.delay(cost))
+        return delay
+
+    @staticmethod
+    def consume(buckets, cost: int):
+        for bucket in buckets:
+            bucket.consume(cost)
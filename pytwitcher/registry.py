@@ -7,8 +7,10 @@ import inspect
 import logging
 from typing import Tuple
 
-from . import utils
+from . import commands
 from . import event
+from . import metrics as metrics_
+from . import utils
 
 
 logger = logging.getLogger(__name__)
@@ -23,25 +25,103 @@ class Registry:
         self.irc_events_re = deque()
         self.irc_events = defaultdict(deque)
 
+        # command token -> matchers that can match a line with that command,
+        # in irc_events_re order. Matchers without a command are in every
+        # bucket and in the fallback one, used for unknown commands.
+        self.irc_events_index = {}
+        self.irc_events_fallback = ()
+
+        # command -> events receiving the tokenized line, no regex involved
+        self.irc_commands = defaultdict(deque)
+        # command -> (events for any channel, {channel: events}), channels
+        # being the ones some event filters on
+        self.irc_commands_index = {}
+        # regexp key -> channels, for keys whose events all filter on them
+        self.irc_events_channels = {}
+
         # on_ for the bot itself (use bot.notify to trigger)
         self.listeners = defaultdict(list)
+        # notify name -> (handle_ listeners, on_ listeners), only for names
+        # having any, rebuilt when listeners change
+        self.dispatch_table = {}
+
+        # chat commands of the plugins, see commands.chat_command
+        self.commands = commands.Router(config)
 
         self.plugins = {}
 
-    def get_event_matches(self, data):
+        # metrics.Metrics when enabled
+        self.metrics = None
+
+    def get_event_matches(self, data, command: str = None, channel: str = None):
+        if command is None:
+            command = utils.get_command(data)
         events = self.irc_events
-        for key, matcher in self.irc_events_re:
-            match = matcher(data)
+        metrics = self.metrics
+        restricted = self.irc_events_channels
+        for key, matcher in self.irc_events_index.get(command, self.irc_events_fallback):
+            if restricted and key in restricted and channel not in restricted[key]:
+                continue
+            if metrics is None:
+                match = matcher(data)
+            else:
+                start = metrics_.clock()
+                match = matcher(data)
+                name = getattr(events[key][0].regexp, 'name', key)
+                metrics.observe('pytwitcher_match_seconds', metrics_.clock() - start, (name,))
             if match is not None:
                 yield match, events[key]
 
-    def reload_plugin(self, name: str):
-        logging.debug('Reloading plugin %s', name)
-        plugin = self.remove_plugin(name)
-        if plugin is None:
-            raise ValueError('Plugin is not loaded')
-
-        self.add_plugin(plugin)
+    def get_command_events(self, command: str, channel: str = None):
+        """
+        Events subscribed to command, without those filtering on other
+        channels.
+        """
+        index = self.irc_commands_index.get(command)
+        if index is None:
+            return ()
+        events, by_channel = index
+        if by_channel:
+            return by_channel.get(channel, events)
+        return events
+
+    def copy(self):
+        """
+        Registry with the same events, listeners and plugins, whose
+        containers can be changed without affecting this one.
+        Matchers are shared, they are not recompiled.
+        """
+        new = Registry(self.config)
+        new.irc_events_re = deque(self.irc_events_re)
+        for key, events in self.irc_events.items():
+            new.irc_events[key] = deque(events)
+        new.irc_events_index = dict(self.irc_events_index)
+        new.irc_events_fallback = self.irc_events_fallback
+        for command, events in self.irc_commands.items():
+            new.irc_commands[command] = deque(events)
+        new.irc_commands_index = dict(self.irc_commands_index)
+        new.irc_events_channels = dict(self.irc_events_channels)
+        for name, funcs in self.listeners.items():
+            new.listeners[name] = list(funcs)
+        new.dispatch_table = dict(self.dispatch_table)
+        new.commands = self.commands.copy()
+        new.plugins = dict(self.plugins)
+        new.metrics = self.metrics
+        return new
+
+    def replace_plugins(self, plugins):
+        """
+        Copy of the registry with plugins (new instances) in place of the
+        loaded plugins of the same name. Nothing is unloaded, the old
+        instances keep working until the copy is swapped in.
+        """
+        new = self.copy()
+        for plugin in plugins:
+            name = type(plugin).__name__
+            logger.debug('Replacing plugin %s', name)
+            new.remove_plugin(name, unload=False)
+            new.add_plugin(plugin)
+        return new
 
     def add_plugin(self, plugin):
         self.plugins[type(plugin).__name__] = plugin
@@ -50,11 +130,13 @@ class Registry:
             # Register IRC events
             if isinstance(member, event.event):
                 self.add_irc_event(member)
+            elif isinstance(member, commands.chat_command):
+                self.commands.add(member)
             # Register listeners
             elif name.startswith(('on_', 'handle_')):
                 self.add_listener(member)
 
-    def remove_plugin(self, name: str):
+    def remove_plugin(self, name: str, unload: bool = True):
         plugin = self.plugins.pop(name, None)
         if plugin is None:
             return plugin
@@ -63,10 +145,15 @@ class Registry:
             # Remove IRC events
             if isinstance(member, event.event):
                 self.remove_irc_event(member)
+            elif isinstance(member, commands.chat_command):
+                self.commands.remove(member)
             # Remove listeners
             elif name.startswith(('on_', 'handle_')):
                 self.remove_listener(member)
 
+        if not unload:
+            return plugin
+
         try:
             unloader = getattr(plugin, 'unload')
         except AttributeError:
@@ -90,6 +177,7 @@ class Registry:
             raise ValueError('Listeners must start with `on_` or `handle_`')
 
         self.listeners[name].append(func)
+        self._rebuild_dispatch(name)
 
     def remove_listener(self, func, name: str = None):
         name = name or func.__name__
@@ -100,11 +188,37 @@ class Registry:
                 self.listeners[name].remove(func)
             except ValueError:
                 pass
+            self._rebuild_dispatch(name)
+
+    def _rebuild_dispatch(self, name: str):
+        def with_checks(funcs):
+            # (listener, Filter.matches or None), see event.filtered
+            checks = []
+            for func in funcs:
+                listener_filter = getattr(func, 'filter', None)
+                checks.append((func, None if listener_filter is None else listener_filter.matches))
+            return tuple(checks)
+
+        _, _, base = name.partition('_')
+        handles = with_checks(self.listeners.get('handle_' + base, ()))
+        ons = with_checks(self.listeners.get('on_' + base, ()))
+        if handles or ons:
+            self.dispatch_table[base] = (handles, ons)
+        else:
+            self.dispatch_table.pop(base, None)
 
     def add_irc_event(self, irc_event: event.event, insert: bool = False):
         if not asyncio.iscoroutinefunction(irc_event.callback):
             raise ValueError('Event handlers must be coroutines')
 
+        if isinstance(irc_event, event.command):
+            if insert:
+                self.irc_commands[irc_event.command].appendleft(irc_event)
+            else:
+                self.irc_commands[irc_event.command].append(irc_event)
+            self._reindex_command(irc_event.command)
+            return
+
         # key is used to link irc_events_re and irc_events
         matcher = irc_event.compile(self.config)
         key = irc_event.key  # = regexp
@@ -120,8 +234,21 @@ class Registry:
         else:
             self.irc_events[key].append(irc_event)
 
+        self._reindex()
 
     def remove_irc_event(self, irc_event: event.event):
+        if isinstance(irc_event, event.command):
+            handlers = self.irc_commands.get(irc_event.command)
+            if handlers is not None:
+                try:
+                    handlers.remove(irc_event)
+                except ValueError:
+                    pass
+                if not handlers:
+                    del self.irc_commands[irc_event.command]
+                self._reindex_command(irc_event.command)
+            return
+
         all_events = self.irc_events
         key = irc_event.key
         delete = []
@@ -138,11 +265,13 @@ class Registry:
                 delete.append(key)
                 del all_events[key]
 
-        self.irc_events_re = [r for r in self.irc_events_re if r[0] not in delete]
+        self.irc_events_re = deque(r for r in self.irc_events_re if r[0] not in delete)
+        self._reindex()
 
     def recompile(self, config: dict):
         logging.info('Recompiling registry using config %s', config)
         self.config = config
+        self.commands.recompile(config)
 
         events_re = self.irc_events_re
         events = self.irc_events
@@ -153,3 +282,64 @@ class Registry:
             new_events_re.append((key, events[key][0].compile(config)))
 
         self.irc_events_re = new_events_re
+        self._reindex()
+
+    def _reindex(self):
+        """
+        Rebuild the command dispatch index from irc_events_re.
+        Only called when events change, never on the hot path.
+        """
+        events = self.irc_events
+        key_commands = {}
+        for key, _ in self.irc_events_re:
+            # Events sharing a regexp but not a command can match anything
+            command = {irc_event.command for irc_event in events[key]}
+            key_commands[key] = command.pop() if len(command) == 1 else None
+
+        commands = {command: [] for command in key_commands.values() if command is not None}
+        fallback = []
+        for key, matcher in self.irc_events_re:
+            command = key_commands[key]
+            if command is None:
+                fallback.append((key, matcher))
+                for bucket in commands.values():
+                    bucket.append((key, matcher))
+            else:
+                commands[command].append((key, matcher))
+
+        self.irc_events_index = {command: tuple(bucket) for command, bucket in commands.items()}
+        self.irc_events_fallback = tuple(fallback)
+
+        # Matchers only worth running for some channels
+        restricted = {}
+        for key, _ in self.irc_events_re:
+            channels = set()
+            for irc_event in events[key]:
+                if irc_event.filter is None or irc_event.filter.channels is None:
+                    break
+                channels |= irc_event.filter.channels
+            else:
+                restricted[key] = frozenset(channels)
+        self.irc_events_channels = restricted
+
+    def _reindex_command(self, command: str):
+        handlers = self.irc_commands.get(command)
+        if not handlers:
+            self.irc_commands_index.pop(command, None)
+            return
+
+        def channel_filter(irc_event):
+            return None if irc_event.filter is None else irc_event.filter.channels
+
+        any_channel = tuple(irc_event for irc_event in handlers if channel_filter(irc_event) is None)
+        channels = set()
+        for irc_event in handlers:
+            channels |= channel_filter(irc_event) or set()
+        by_channel = {
+            channel: tuple(
+                irc_event for irc_event in handlers
+                if channel_filter(irc_event) is None or channel in channel_filter(irc_event)
+            )
+            for channel in channels
+        }
+        self.irc_commands_index[command] = (any_channel, by_channel)
@@ -0,0 +1,249 @@
+"""
+Offline replay of recorded lines through a bot and its plugins, without a
+socket and without waiting: the bot runs on a VirtualClockLoop, whose time
+jumps to the next timer whenever there is nothing else to run, so sleeps,
+call_later and flood delays pass instantly.
+
+    loop = replay.VirtualClockLoop()
+    bot = IrcBot(loop=loop, nick='bot')
+    bot.load_plugin('my.Plugin')
+    report = replay.Replay(bot).replay('chat.log', 'archive/')
+
+Inputs are logs of raw lines (gzipped if ending with .gz), read in chunks,
+or archive directories (see archive), whose timestamps drive the clock.
+What the bot sends is captured in Replay.sent.
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import selectors
+import time
+
+from . import archive
+
+
+logger = logging.getLogger(__name__)
+
+
+class _VirtualSelector:
+    """
+    Selector never blocking for a timeout: the loop's clock is moved forward
+    by it instead.
+    """
+
+    def __init__(self, selector):
+        self.selector = selector
+        self.loop = None
+
+    def select(self, timeout=None):
+        if timeout is not None and timeout > 0:
+            self.loop.advance(timeout)
+            timeout = 0
+        return self.selector.select(timeout)
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, start: float = 0.0):
+        selector = _VirtualSelector(selectors.DefaultSelector())
+        super().__init__(selector)
+        selector.loop = self
+        self._now = start
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float):
+        self._now += seconds
+
+    def advance_to(self, when: float):
+        """
+        Move the clock to when, timers due before it run late.
+        """
+        if when > self._now:
+            self._now = when
+
+
+def read_lines(path: str, chunk_size: int = 2 ** 20, encoding: str = 'utf8'):
+    """
+    Yield (timestamp or None, line) from a log file or an archive directory.
+    """
+    if os.path.isdir(path):
+        yield from archive.ArchiveReader(path).read()
+        return
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        rest = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                if line.endswith(b'\r'):
+                    line = line[:-1]
+                if line:
+                    yield None, line.decode(encoding, 'ignore')
+        if rest.strip():
+            yield None, rest.rstrip(b'\r').decode(encoding, 'ignore')
+
+
+class CaptureTransport:
+    def __init__(self, replay):
+        self.replay = replay
+
+    def pause_reading(self):
+        self.replay.pause()
+
+    def resume_reading(self):
+        self.replay.resume()
+
+    def close(self):
+        pass
+
+    abort = close
+
+
+class CaptureProtocol:
+    """
+    Stands in for a connection's protocol, recording written lines.
+    """
+
+    def __init__(self, replay, index: int):
+        self.replay = replay
+        self.index = index
+        self.transport = CaptureTransport(replay)
+        self.closed = False
+        self.reads = 0
+
+    def write(self, data):
+        if data is None:
+            return
+        if isinstance(data, bytes):
+            data = data.decode('utf8', 'ignore')
+        self.replay.sent.append((self.replay.loop.time(), self.index, data.rstrip('\r\n')))
+
+    def close(self):
+        self.closed = True
+
+
+class Replay:
+    """
+    Feeds lines to bot.process_data, `batch_size` lines between two loop
+    iterations so callbacks run as the replay goes. Once done, it waits for
+    callbacks still running and queued lines, giving up after
+    `settle_timeout` (virtual) seconds without progress.
+    """
+
+    def __init__(self, bot, chunk_size: int = 2 ** 20, batch_size: int = 1000, settle_timeout: float = 60):
+        self.bot = bot
+        self.loop = bot.loop
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.settle_timeout = settle_timeout
+
+        # (loop time, connection index, line) of what the bot sent
+        self.sent = []
+        self.lines = 0
+        self._resumed = None
+
+    def pause(self):
+        if self._resumed is None:
+            self._resumed = self.loop.create_future()
+
+    def resume(self):
+        if self._resumed is not None:
+            self._resumed.set_result(None)
+            self._resumed = None
+
+    def _capture(self):
+        # Connections added by JOINs get a protocol too
+        for conn in self.bot.connections:
+            if conn.protocol is None:
+                conn.protocol = CaptureProtocol(self, conn.index)
+                conn.logged_in = True
+                conn.queue.resume(conn.protocol.write)
+
+    def replay(self, *paths) -> dict:
+        return self.loop.run_until_complete(self.run(*paths))
+
+    async def run(self, *paths) -> dict:
+        """
+        Replay the files in order, returns the throughput report.
+        """
+        loop = self.loop
+        process_data = self.bot.process_data
+        batch_size = self.batch_size
+        virtual = isinstance(loop, VirtualClockLoop)
+        self._capture()
+
+        start = time.perf_counter()
+        loop_start = loop.time()
+        lines = 0
+        first = True
+        for path in paths:
+            logger.info('Replaying %s', path)
+            for timestamp, line in read_lines(path, self.chunk_size, self.bot.encoding):
+                if timestamp is not None and virtual:
+                    if first:
+                        loop.advance_to(timestamp)
+                        loop_start = timestamp
+                    elif timestamp > loop.time():
+                        # Timers due in between run first, in order
+                        await asyncio.sleep(timestamp - loop.time())
+                first = False
+
+                process_data(line)
+                lines += 1
+                if not lines % batch_size:
+                    await asyncio.sleep(0)
+                    self._capture()
+                    while self._resumed is not None:
+                        await self._resumed
+        await self._settle()
+
+        self.lines += lines
+        seconds = time.perf_counter() - start
+        report = {
+            'lines': lines,
+            'seconds': seconds,
+            'lines_per_second': lines / seconds if seconds else 0.0,
+            'virtual_seconds': loop.time() - loop_start,
+            'sent': len(self.sent),
+        }
+        logger.info('Replayed %d lines in %.3fs (%.0f lines/s)', lines, seconds, report['lines_per_second'])
+        return report
+
+    async def _settle(self):
+        # Wait while callbacks finish or lines get sent, up to settle_timeout
+        # without any progress
+        loop = self.loop
+        try:
+            current_task, all_tasks = asyncio.current_task, asyncio.all_tasks  # python 3.7+
+        except AttributeError:
+            current_task, all_tasks = asyncio.Task.current_task, asyncio.Task.all_tasks
+        current = current_task(loop=loop)
+        deadline = loop.time() + self.settle_timeout
+        progress = None
+        while loop.time() < deadline:
+            self._capture()
+            # Outbound queues run forever
+            idle = {current} | {conn._queue_task for conn in self.bot.connections}
+            # Task.all_tasks also returns finished tasks
+            tasks = {task for task in all_tasks(loop=loop) if not task.done()} - idle
+            queued = sum(len(conn.queue) for conn in self.bot.connections)
+            if not tasks and not queued:
+                return
+            if progress != (len(tasks), queued, len(self.sent)):
+                progress = (len(tasks), queued, len(self.sent))
+                deadline = loop.time() + self.settle_timeout
+            if tasks:
+                await asyncio.wait(tasks, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(min(1, deadline - loop.time()))
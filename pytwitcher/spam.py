@@ -0,0 +1,254 @@
+"""
+Duplicate PRIVMSG filter, run on parsed lines before any dispatch (see
+IrcObject.process_data) so spam waves cost neither the registry nor the
+plugins.
+
+Message texts are normalized (case, punctuation, repeated characters) and
+hashed, or SimHashed on character trigrams to also catch near duplicates.
+Each channel keeps its recent fingerprints in a fixed size ring buffer
+covering `window` seconds at most: past `threshold` copies in the window, further copies are dropped,
+or collapsed into one `spam` notification per window with their count.
+"""
+
+import logging
+import re
+import struct
+import zlib
+
+from . import cache
+
+
+logger = logging.getLogger(__name__)
+
+DROP = 'drop'
+COLLAPSE = 'collapse'
+
+_NON_WORD = re.compile(r'[\W_]+')
+_REPEATED = re.compile(r'(.)\1{2,}')
+
+# SimHash size and the bands it is split into to find near duplicates:
+# fingerprints at most BANDS - 1 bits apart share at least one band
+BITS = 64
+BANDS = 8
+BAND_BITS = BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def normalize(text: str) -> str:
+    """
+    Text with case, punctuation, spacing and character floods (LULLLLL)
+    ironed out.
+    """
+    text = _NON_WORD.sub(' ', text.lower()).strip()
+    return _REPEATED.sub(r'\1\1', text)
+
+
+def _popcount(value: int) -> int:
+    return bin(value).count('1')
+
+
+_popcount = getattr(int, 'bit_count', _popcount)  # python 3.10+
+
+# Trigrams hashed at most, Twitch messages are up to 500 characters
+MAX_SHINGLES = 512
+# Odd 64 bits multiplier (golden ratio) spreading CRC32s over 64 bits
+_SPREAD = 0x9E3779B97F4A7C15
+# Per bit, mask of that bit in each of MAX_SHINGLES concatenated hashes
+_masks = None
+
+
+def _bit_masks():
+    global _masks
+    if _masks is None:
+        _masks = [sum(1 << (BITS * i + bit) for i in range(MAX_SHINGLES)) for bit in range(BITS)]
+    return _masks
+
+
+def simhash(text: str) -> int:
+    """
+    SimHash of the trigrams of normalized text. The trigram hashes (CRC32
+    spread over 64 bits, stable across runs unlike hash()) are concatenated
+    in one integer, each bit of the fingerprint is then a popcount of it,
+    not a loop over the trigrams.
+    """
+    data = text.encode('utf8')
+    count = min(max(1, len(data) - 2), MAX_SHINGLES)
+    hashes = [zlib.crc32(data[i:i + 3]) * _SPREAD & 0xFFFFFFFFFFFFFFFF for i in range(count)]
+    concatenated = int.from_bytes(struct.pack('<{}Q'.format(count), *hashes), 'little')
+    half = count / 2
+    fingerprint = 0
+    for bit, mask in enumerate(_bit_masks()):
+        if _popcount(concatenated & mask) > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class RollingWindow:
+    """
+    Ring buffer of the last `size` (time, fingerprint) of a channel, with the
+    count of each fingerprint in it. With bands, fingerprints are also
+    indexed by SimHash band.
+    """
+    __slots__ = ('times', 'keys', 'start', 'length', 'counts', 'bands')
+
+    def __init__(self, size: int, bands: bool = False):
+        self.times = [0.0] * size
+        self.keys = [None] * size
+        self.start = 0
+        self.length = 0
+        self.counts = {}
+        # (band number, band value) -> fingerprints
+        self.bands = {} if bands else None
+
+    def expire(self, oldest: float):
+        times = self.times
+        while self.length and times[self.start] < oldest:
+            self._pop()
+
+    def _pop(self):
+        start = self.start
+        key = self.keys[start]
+        self.keys[start] = None
+        self.start = (start + 1) % len(self.keys)
+        self.length -= 1
+        count = self.counts[key] - 1
+        if count:
+            self.counts[key] = count
+            return
+        del self.counts[key]
+        if self.bands is not None:
+            for band in range(BANDS):
+                index = (band, key >> band * BAND_BITS & BAND_MASK)
+                keys = self.bands[index]
+                keys.discard(key)
+                if not keys:
+                    del self.bands[index]
+
+    def add(self, now: float, key) -> int:
+        """
+        Returns the number of times key is now in the window.
+        """
+        size = len(self.keys)
+        if self.length == size:
+            self._pop()
+        position = (self.start + self.length) % size
+        self.times[position] = now
+        self.keys[position] = key
+        self.length += 1
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count == 1 and self.bands is not None:
+            for band in range(BANDS):
+                self.bands.setdefault((band, key >> band * BAND_BITS & BAND_MASK), set()).add(key)
+        return count
+
+    def similar(self, fingerprint: int, distance: int):
+        """
+        Fingerprint in the window at most distance bits away, None if none.
+        """
+        if fingerprint in self.counts:
+            return fingerprint
+        for band in range(BANDS):
+            for key in self.bands.get((band, fingerprint >> band * BAND_BITS & BAND_MASK), ()):
+                if _popcount(key ^ fingerprint) <= distance:
+                    return key
+        return None
+
+
+class SpamFilter:
+    """
+    allow(message) tells if a PRIVMSG goes on to dispatch. mode is DROP or
+    COLLAPSE, in which case on_collapse(message, count) is called once per
+    window with the first suppressed copy and the number of copies.
+    similarity 'simhash' also treats texts `distance` bits apart (at most
+    BANDS - 1) as copies.
+    """
+
+    def __init__(self, loop, mode: str = COLLAPSE, window: float = 10, threshold: int = 3, size: int = 256,
+                 similarity: str = None, distance: int = 6, on_collapse=None, metrics=None):
+        if mode not in (DROP, COLLAPSE):
+            raise ValueError('Unknown spam filter mode {!r}'.format(mode))
+        if similarity not in (None, 'simhash'):
+            raise ValueError('Unknown similarity {!r}'.format(similarity))
+        self.loop = loop
+        self.mode = mode
+        self.window = window
+        self.threshold = threshold
+        self.size = size
+        self.similarity = similarity
+        self.distance = min(distance, BANDS - 1)
+        self.on_collapse = on_collapse
+        self.metrics = metrics
+
+        # channel -> RollingWindow
+        self.windows = {}
+        # (channel, fingerprint) -> [first suppressed message, count]
+        self.collapsed = {}
+        self._flush_handle = None
+        self.suppressed = 0
+        # normalized text -> SimHash, spam waves repeat the same texts
+        self._simhashes = cache.Cache(max_size=4096)
+
+    def fingerprint(self, window: RollingWindow, text: str):
+        # Emotes and punctuation only messages normalize to nothing, they are
+        # only compared as they are
+        text = normalize(text) or text.lower().strip()
+        if self.similarity is None:
+            return hash(text)
+        fingerprint = self._simhashes.get(text)
+        if fingerprint is None:
+            fingerprint = self._simhashes[text] = simhash(text)
+        similar = window.similar(fingerprint, self.distance)
+        return fingerprint if similar is None else similar
+
+    def allow(self, message) -> bool:
+        channel = message.channel
+        text = message.text
+        if channel is None or text is None:
+            return True
+        window = self.windows.get(channel)
+        if window is None:
+            window = self.windows[channel] = RollingWindow(self.size, bands=self.similarity is not None)
+
+        now = self.loop.time()
+        window.expire(now - self.window)
+        key = self.fingerprint(window, text)
+        if window.add(now, key) <= self.threshold:
+            return True
+
+        self.suppressed += 1
+        if self.metrics is not None:
+            self.metrics.inc('pytwitcher_spam_suppressed_total')
+        if self.mode == COLLAPSE:
+            collapsed = self.collapsed.get((channel, key))
+            if collapsed is None:
+                self.collapsed[channel, key] = [message, 1]
+                if self._flush_handle is None:
+                    self._flush_handle = self.loop.call_later(self.window, self.flush)
+            else:
+                collapsed[1] += 1
+        return False
+
+    def flush(self):
+        """
+        Report the collapsed copies so far.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        collapsed, self.collapsed = self.collapsed, {}
+        for message, count in collapsed.values():
+            logger.debug('Collapsed %d copies of a message in %s', count, message.channel)
+            if self.on_collapse is not None:
+                self.on_collapse(message, count)
+
+    def remove(self, channel: str):
+        self.windows.pop(channel, None)
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.collapsed.clear()
+        self.windows.clear()
+        self._simhashes.clear()
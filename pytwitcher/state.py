@@ -0,0 +1,176 @@
+"""
+Per channel state from ROOMSTATE (chat modes) and USERSTATE (our badges),
+and our global state from GLOBALUSERSTATE.
+https://dev.twitch.tv/docs/irc/tags#roomstate-twitch-tags
+
+Lookups are plain attribute reads. The outbound queue asks rejects() before
+writing a PRIVMSG, so lines Twitch would refuse don't use rate budget.
+"""
+
+import logging
+import sys
+
+from . import utils
+
+
+logger = logging.getLogger(__name__)
+
+# ROOMSTATE tag -> ChannelState attribute
+ROOM_TAGS = {
+    'emote-only': 'emote_only',
+    'followers-only': 'followers_only',
+    'r9k': 'r9k',
+    'slow': 'slow',
+    'subs-only': 'subs_only',
+}
+
+PRIVILEGED = frozenset(('broadcaster', 'moderator', 'staff', 'admin', 'global_mod'))
+
+
+class MessageRejected(Exception):
+    """
+    The line would be rejected by Twitch, the reason is a NOTICE msg-id
+    (eg. msg_slowmode).
+    """
+
+
+class ChannelState:
+    __slots__ = (
+        'channel', 'room_id', 'emote_only', 'followers_only', 'r9k', 'slow', 'subs_only',
+        '_badges', 'last_sent', 'last_text',
+    )
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.room_id = None
+        # Modes, as sent by Twitch: flags are 0/1, followers_only is in
+        # minutes (-1 when off), slow in seconds
+        self.emote_only = 0
+        self.followers_only = -1
+        self.r9k = 0
+        self.slow = 0
+        self.subs_only = 0
+        # Our badges in the channel, raw
+        self._badges = ''
+        # Our last PRIVMSG to the channel
+        self.last_sent = None
+        self.last_text = None
+
+    @property
+    def badges(self):
+        return utils.parse_badges(self._badges)
+
+    @property
+    def is_moderator(self) -> bool:
+        """
+        Moderator or broadcaster (or Twitch staff), exempt from chat modes.
+        """
+        return not PRIVILEGED.isdisjoint(self.badges)
+
+    @property
+    def is_vip(self) -> bool:
+        return 'vip' in self.badges
+
+    @property
+    def is_subscriber(self) -> bool:
+        badges = self.badges
+        return 'subscriber' in badges or 'founder' in badges
+
+    def __repr__(self):
+        return '<ChannelState {} slow={} subs_only={} r9k={} emote_only={} followers_only={}>'.format(
+            self.channel, self.slow, self.subs_only, self.r9k, self.emote_only, self.followers_only,
+        )
+
+
+def _int(value: str, default: int = 0) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+class StateCache:
+    def __init__(self, clock):
+        self.clock = clock
+        # channel -> ChannelState
+        self.channels = {}
+        # GLOBALUSERSTATE tags (user-id, display-name, color, badges...)
+        self.global_state = {}
+
+    def get(self, channel: str) -> ChannelState:
+        """
+        State of a channel, None until Twitch told us about it.
+        """
+        return self.channels.get(channel)
+
+    def _get_or_create(self, channel: str) -> ChannelState:
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = ChannelState(sys.intern(channel))
+        return state
+
+    def is_moderator(self, channel: str) -> bool:
+        state = self.channels.get(channel)
+        return state is not None and state.is_moderator
+
+    def update_room(self, channel: str, tags):
+        """
+        Merge a ROOMSTATE: on join every tag is sent, afterwards only the
+        ones that changed.
+        """
+        state = self._get_or_create(channel)
+        if 'room-id' in tags:
+            state.room_id = tags['room-id']
+        for tag, attribute in ROOM_TAGS.items():
+            if tag in tags:
+                setattr(state, attribute, _int(tags[tag], getattr(state, attribute)))
+        logger.debug('Room state: %r', state)
+
+    def update_user(self, channel: str, tags):
+        self._get_or_create(channel)._badges = sys.intern(tags.get('badges', ''))
+
+    def update_global(self, tags):
+        self.global_state = dict(tags)
+
+    def remove(self, channel: str):
+        self.channels.pop(channel, None)
+
+    def clear(self):
+        self.channels.clear()
+
+    def rejects(self, message):
+        """
+        Reason Twitch would reject a parsed outbound line for (a NOTICE msg-id),
+        None if it should go through. Only PRIVMSG lines are checked,
+        against what is known for sure: subscribers-only, slow mode, and
+        r9k/duplicate of our own last message.
+        """
+        if message.command != 'PRIVMSG':
+            return None
+        state = self.channels.get(message.channel)
+        if state is None or state.is_moderator:
+            return None
+        text = message.text
+        if text is None or (text.startswith(('/', '.')) and not text.startswith(('/me ', '.me '))):
+            # Chat commands (whispers...) are not chat messages
+            return None
+
+        if state.subs_only and not state.is_subscriber:
+            return 'msg_subsonly'
+        if state.slow and state.last_sent is not None and not state.is_vip:
+            if self.clock() - state.last_sent < state.slow:
+                return 'msg_slowmode'
+        if state.r9k and text == state.last_text:
+            return 'msg_r9k'
+        return None
+
+    def sent(self, message):
+        """
+        Remember when we last talked in a channel, for slow mode and r9k.
+        """
+        if message.command != 'PRIVMSG':
+            return
+        state = self.channels.get(message.channel)
+        if state is not None:
+            state.last_sent = self.clock()
+            state.last_text = message.text
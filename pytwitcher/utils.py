@@ -1,3 +1,8 @@
+from collections.abc import Mapping
+import functools
+from types import MappingProxyType
+
+
 
 _UNESCAPES = (
     (r'\:', ';'),
@@ -15,11 +20,14 @@ def _unescape(string):
 def decode(tagstring):
     """
     Decode a tag-string from an IRC message into a python dictionary.
+    Also takes Tags, as given to regex events.
     http://ircv3.net/specs/core/message-tags-3.2.html
     """
 
     if not tagstring:
         return {}
+    if isinstance(tagstring, Mapping):
+        return dict(tagstring)
 
     tags = {}
 
@@ -31,6 +39,128 @@ def decode(tagstring):
 
     return tags
 
+# Values repeated across most messages, shared instead of sliced per message
+_MEMOIZED_TAGS = frozenset((
+    'badge-info', 'badges', 'color', 'emote-sets', 'flags', 'mod', 'msg-id', 'room-id', 'subscriber', 'turbo',
+    'user-type',
+))
+
+_unescape_cached = functools.lru_cache(maxsize=4096)(_unescape)
+
+@functools.lru_cache(maxsize=4096)
+def _memoize(value):
+    return value
+
+@functools.lru_cache(maxsize=4096)
+def parse_badges(value):
+    """
+    Parse a badges tag value (eg. `subscriber/12,premium/1`) into a read-only
+    mapping of badge to version. Memoized, the same few values come back all
+    the time.
+    """
+    badges = {}
+    if value:
+        for badge in value.split(','):
+            name, _, version = badge.partition('/')
+            badges[name] = version
+    return MappingProxyType(badges)
+
+class Tags(Mapping):
+    """
+    Lazy version of decode: keeps the raw tag-string and only looks up and
+    unescapes a key when it is accessed.
+    """
+    __slots__ = ('raw', '_cache', '_values')
+
+    def __init__(self, tagstring: str = ''):
+        self.raw = tagstring or ''
+        # key -> decoded value, for keys already accessed
+        self._cache = None
+        # key -> escaped value, only built when iterating
+        self._values = None
+
+    def _find(self, key):
+        raw = self.raw
+        if self._values is not None:
+            return self._values[key]
+
+        needle = key + '='
+        if raw.startswith(needle):
+            start = len(needle)
+        else:
+            start = raw.find(';' + needle)
+            if start == -1:
+                # Tags without a value
+                if raw == key or raw.startswith(key + ';') or raw.endswith(';' + key) or (';' + key + ';') in raw:
+                    return ''
+                raise KeyError(key)
+            start += len(needle) + 1
+
+        end = raw.find(';', start)
+        if end == -1:
+            return raw[start:]
+        return raw[start:end]
+
+    def __getitem__(self, key):
+        cache = self._cache
+        if cache is None:
+            cache = self._cache = {}
+        elif key in cache:
+            return cache[key]
+
+        value = self._find(key)
+        if '\\' in value:
+            value = _unescape_cached(value)
+        elif key in _MEMOIZED_TAGS:
+            value = _memoize(value)
+        cache[key] = value
+        return value
+
+    def _split(self):
+        values = self._values
+        if values is None:
+            values = self._values = {}
+            if self.raw:
+                for tag in self.raw.split(';'):
+                    key, _, value = tag.partition('=')
+                    values[key] = value
+        return values
+
+    def __iter__(self):
+        return iter(self._split())
+
+    def __len__(self):
+        return len(self._split())
+
+    def __bool__(self):
+        return bool(self.raw)
+
+    @property
+    def badges(self):
+        return parse_badges(self.get('badges', ''))
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.raw)
+
+def get_command(line):
+    """
+    Extract the command (or numeric) token of a raw IRC line, skipping the
+    optional tags and prefix, without parsing the rest of the line.
+    """
+    start = 0
+    if line.startswith('@'):
+        start = line.find(' ') + 1
+        if not start:
+            return ''
+    if line.startswith(':', start):
+        start = line.find(' ', start) + 1
+        if not start:
+            return ''
+    end = line.find(' ', start)
+    if end == -1:
+        return line[start:]
+    return line[start:end]
+
 def future(func):
     """
     Return a future instead of None.
@@ -0,0 +1,321 @@
+"""
+Worker processes for CPU heavy plugins.
+
+The main process does the network I/O and tokenizes lines, then fans the
+tokenized messages out to worker processes, each running its own registry
+with the worker plugins loaded. A channel always goes to the same worker, so
+messages of a channel are processed in order. Lines sent by the workers go
+back through the main process outbound queues.
+
+Messages between processes are length-prefixed marshal dumps of tuples of
+strings, over a socketpair per worker. When a worker falls behind and its pipe
+buffers more than high_water bytes, the main process stops reading from Twitch
+until it catches up.
+
+    pool = WorkerPool(bot, 4, ['myplugins.SpamClassifier'])
+    bot.loop.run_until_complete(pool.start())
+    bot.run()
+"""
+
+import asyncio
+import logging
+import marshal
+import multiprocessing
+import socket
+import struct
+import zlib
+
+from . import bot
+from . import parser
+from . import utils
+
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('!I')
+
+# main -> worker
+LINES = 0  # (LINES, [(raw, tags, prefix, command, params), ...])
+SENT = 1  # (SENT, send id, error or None)
+# worker -> main
+SEND = 2  # (SEND, send id, line, priority)
+
+# Config only the main process uses: the workers have no connection, and the
+# archive, spam filter and metrics server stay in the main process
+MAIN_ONLY_CONFIG = (
+    'archive_dir', 'buffered_protocol', 'channels_per_shard', 'keepalive_interval', 'keepalive_timeout',
+    'metrics_port', 'password', 'reconnect_delay', 'reconnect_max_delay', 'send_queue_policy', 'send_queue_size',
+    'spam_filter', 'ssl', 'write_batch_window', 'write_batching',
+)
+
+
+def worker_config(config: dict) -> dict:
+    """
+    Config the workers are built with: the main process' one without
+    MAIN_ONLY_CONFIG, plugin configs are passed along.
+    """
+    return {key: value for key, value in config.items() if key not in MAIN_ONLY_CONFIG}
+
+
+class PipeProtocol(asyncio.Protocol):
+    """
+    Length-prefixed marshal frames over a stream, both ways.
+    """
+
+    def __init__(self, on_message, on_lost=None, on_pause=None, on_resume=None):
+        self.on_message = on_message
+        self.on_lost = on_lost
+        # Called when the write buffer goes over its high-water mark, and
+        # back under its low-water mark
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        buffer = self.buffer
+        buffer += data
+        start = 0
+        end = len(buffer)
+        while end - start >= _HEADER.size:
+            size, = _HEADER.unpack_from(buffer, start)
+            stop = start + _HEADER.size + size
+            if stop > end:
+                break
+            message = marshal.loads(bytes(buffer[start + _HEADER.size:stop]))
+            start = stop
+            try:
+                self.on_message(message)
+            except Exception:
+                logger.exception('Error when handling worker message')
+        if start:
+            del buffer[:start]
+
+    def send(self, message):
+        payload = marshal.dumps(message)
+        self.transport.write(_HEADER.pack(len(payload)) + payload)
+
+    def pause_writing(self):
+        if self.on_pause is not None:
+            self.on_pause()
+
+    def resume_writing(self):
+        if self.on_resume is not None:
+            self.on_resume()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.on_lost is not None:
+            self.on_lost()
+
+
+class WorkerBot(bot.IrcBot):
+    """
+    Bot running in a worker process: no connection, lines come from and go
+    to the main process.
+    """
+
+    def __init__(self, index: int, loop: asyncio.BaseEventLoop = None, **config):
+        super().__init__(loop=loop, **config)
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+        self.index = index
+        self.pipe = None
+        self._send_id = 0
+        # send id -> future waiting for the main process to write the line
+        self._pending = {}
+
+    def create_connection(self):
+        pass
+
+    def send_line(self, data, priority: int = None):
+        future = self.loop.create_future()
+        if self.pipe is None or self.pipe.transport is None:
+            future.set_exception(ConnectionError('Not connected to the main process'))
+            return future
+
+        self._send_id += 1
+        self._pending[self._send_id] = future
+        self.pipe.send((SEND, self._send_id, data, priority))
+        return future
+
+    def send(self, data):
+        self.send_line(data)
+
+    def on_message(self, message):
+        if message[0] == LINES:
+            for raw, tags, prefix, command, params in message[1]:
+                self.process_message(parser.IrcMessage(raw, utils.Tags(tags), prefix, command, params))
+        elif message[0] == SENT:
+            future = self._pending.pop(message[1], None)
+            if future is not None and not future.done():
+                if message[2] is None:
+                    future.set_result(True)
+                else:
+                    future.set_exception(ConnectionError(message[2]))
+
+    async def serve(self, sock: socket.socket):
+        lost = self.loop.create_future()
+
+        def on_lost():
+            if not lost.done():
+                lost.set_result(None)
+
+        _, self.pipe = await self.loop.create_connection(
+            lambda: PipeProtocol(self.on_message, on_lost), sock=sock,
+        )
+        logger.info('Worker %d ready', self.index)
+        await lost
+
+
+def _worker_main(index: int, sock: socket.socket, config: dict, plugins):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    worker = WorkerBot(index, loop=loop, **config)
+    for name in plugins:
+        worker.load_plugin(name)
+    try:
+        loop.run_until_complete(worker.serve(sock))
+    finally:
+        worker.notify('stop')
+        worker._cleanup()
+
+
+class WorkerPool:
+    """
+    Runs `size` worker processes, each loading `plugins`. The parent stops
+    reading while a pipe buffers more than `high_water` bytes.
+    """
+
+    def __init__(self, parent, size: int, plugins, context: str = None, high_water: int = 2 ** 20):
+        self.parent = parent
+        self.loop = parent.loop
+        self.size = size
+        self.plugins = list(plugins)
+        self.context = multiprocessing.get_context(context)
+        self.high_water = high_water
+
+        self.processes = []
+        self.pipes = []
+        # Per worker messages waiting for the next flush
+        self.batches = [[] for _ in range(size)]
+        self._flush_handle = None
+        # Workers whose pipe is over its high-water mark
+        self.full_pipes = set()
+
+    @property
+    def paused(self) -> bool:
+        return bool(self.full_pipes)
+
+    async def start(self):
+        config = worker_config(self.parent.config)
+        for index in range(self.size):
+            parent_sock, child_sock = socket.socketpair()
+            process = self.context.Process(
+                target=_worker_main, args=(index, child_sock, config, self.plugins),
+                name='pytwitcher-worker-{}'.format(index), daemon=True,
+            )
+            process.start()
+            child_sock.close()
+            self.processes.append(process)
+
+            _, pipe = await self.loop.create_connection(
+                lambda index=index: PipeProtocol(
+                    lambda message: self.on_message(index, message),
+                    on_pause=lambda: self.pipe_full(index),
+                    on_resume=lambda: self.pipe_drained(index),
+                ),
+                sock=parent_sock,
+            )
+            pipe.transport.set_write_buffer_limits(high=self.high_water)
+            self.pipes.append(pipe)
+
+        self.parent.workers = self
+        logger.info('Started %d workers', self.size)
+
+    def get_worker(self, message: parser.IrcMessage) -> int:
+        """
+        Index of the worker handling a message: by channel, else by nick.
+        """
+        key = message.channel or message.nick
+        if not key:
+            return 0
+        return zlib.crc32(key.encode('utf8')) % self.size
+
+    def dispatch(self, message: parser.IrcMessage):
+        index = self.get_worker(message)
+        self.batches[index].append((message.raw, message.tags.raw, message.prefix, message.command, message.params))
+        # Batch everything received during this loop iteration
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self._flush_handle = None
+        for index, batch in enumerate(self.batches):
+            if not batch:
+                continue
+            if index < len(self.pipes) and self.pipes[index].transport is not None:
+                self.pipes[index].send((LINES, batch))
+            else:
+                logger.warning('Worker %d is gone, dropping %d messages', index, len(batch))
+            self.batches[index] = []
+
+    def pipe_full(self, index: int):
+        if not self.full_pipes:
+            logger.warning('Worker %d is behind, pausing reading', index)
+            self.parent.pause_reading()
+        self.full_pipes.add(index)
+
+    def pipe_drained(self, index: int):
+        if index not in self.full_pipes:
+            return
+        self.full_pipes.discard(index)
+        if not self.full_pipes:
+            logger.info('Workers caught up, resuming reading')
+            self.parent.resume_reading()
+
+    def on_message(self, index: int, message):
+        if message[0] != SEND:
+            return
+        _, send_id, line, priority = message
+        pipe = self.pipes[index]
+
+        def done(future):
+            if pipe.transport is None:
+                return
+            if future.cancelled():
+                pipe.send((SENT, send_id, 'cancelled'))
+            elif future.exception() is not None:
+                pipe.send((SENT, send_id, repr(future.exception())))
+            else:
+                pipe.send((SENT, send_id, None))
+
+        try:
+            future = self.parent.send_line(line, priority=priority)
+        except Exception as exc:
+            pipe.send((SENT, send_id, repr(exc)))
+        else:
+            future.add_done_callback(done)
+
+    def close(self):
+        if self.parent.workers is self:
+            self.parent.workers = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self.full_pipes:
+            self.full_pipes.clear()
+            self.parent.resume_reading()
+        for pipe in self.pipes:
+            if pipe.transport is not None:
+                pipe.transport.close()
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self.pipes = []
+        self.processes = []
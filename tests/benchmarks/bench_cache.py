@@ -0,0 +1,47 @@
+"""
+Cost of cache inserts, LRU evictions and TTL expiry as the cache grows:
+the per-key times should stay flat.
+
+    python tests/benchmarks/bench_cache.py --keys 1000000
+"""
+import argparse
+import asyncio
+import time
+
+from pytwitcher import cache
+from pytwitcher import replay
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    loop = replay.VirtualClockLoop()
+    for size in (args.keys // 100, args.keys // 10, args.keys):
+        lru = cache.Cache(max_size=size)
+        for i in range(size):
+            lru[i] = i
+        start = time.perf_counter()
+        for i in range(size, size * 2):
+            lru[i] = i
+        evict = (time.perf_counter() - start) / size
+
+        ttl = cache.Cache(ttl=60, loop=loop)
+        start = time.perf_counter()
+        for i in range(size):
+            ttl[i] = i
+        insert = (time.perf_counter() - start) / size
+        start = time.perf_counter()
+        loop.run_until_complete(asyncio.sleep(62))
+        expire = (time.perf_counter() - start) / size
+        assert not ttl.data
+
+        print('{:>9} keys  insert+evict {:6.0f} ns  ttl insert {:6.0f} ns  expire {:6.0f} ns'.format(
+            size, evict * 1e9, insert * 1e9, expire * 1e9,
+        ))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Memory used by tracked users, against plain per-user dicts.
+
+    python tests/benchmarks/bench_data.py --users 1000000
+"""
+import argparse
+import gc
+import tracemalloc
+
+from pytwitcher import data
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return used, result
+
+
+def with_store(users: int, channels: int, memberships: int):
+    store = data.Store()
+    channel_objects = [store.channel('#channel{}'.format(i)) for i in range(channels)]
+    for i in range(users):
+        user = store.user('user{}'.format(i), id=str(100000 + i))
+        for j in range(memberships):
+            channel_objects[(i + j) % channels].add(user, 'subscriber/12' if i % 3 else '')
+    return store
+
+
+def with_dicts(users: int, channels: int, memberships: int):
+    # What a plugin would do without the models: a dict per user per channel
+    channel_members = [{} for _ in range(channels)]
+    for i in range(users):
+        login = 'user{}'.format(i)
+        for j in range(memberships):
+            channel_members[(i + j) % channels][login] = {
+                'login': login, 'id': str(100000 + i), 'badges': 'subscriber/12' if i % 3 else '',
+            }
+    return channel_members
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--memberships', type=int, default=2, help='channels each user is in')
+    args = parser.parse_args(argv)
+
+    for name, build in (('data.Store', with_store), ('dicts', with_dicts)):
+        used, result = measure(lambda: build(args.users, args.channels, args.memberships))
+        print('{:<10} {:8.1f} MB  {:6.1f} bytes/user'.format(name, used / 2 ** 20, used / args.users))
+        del result
+
+
+if __name__ == '__main__':
+    main()
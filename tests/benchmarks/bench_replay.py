@@ -0,0 +1,247 @@
+"""
+End-to-end benchmark: replays traffic from a local fake Twitch server
+through a real IrcBot with the stock plugins loaded.
+
+    python tests/benchmarks/bench_replay.py --lines 200000 --output before.json
+    python tests/benchmarks/bench_replay.py --lines 200000 --output after.json --compare before.json
+
+Traffic is synthetic (seeded, so identical between runs) unless --input
+gives a log of raw lines or an archive directory (see pytwitcher.archive).
+Reports lines/sec, per-line latency percentiles (written by the server to
+callback started), memory growth and task counts.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import fake_twitch
+from pytwitcher import bot
+from pytwitcher import event
+
+
+NICK = 'benchbot'
+PLUGINS = (
+    'pytwitcher.plugins.core.Core',
+    'pytwitcher.plugins.event_translator.EventTranslator',
+    'pytwitcher.plugins.userlist.UserList',
+)
+
+
+class BenchBot(bot.IrcBot):
+    def __init__(self, port: int, **config):
+        super().__init__(**config)
+        self.port = port
+
+    def _get_connection_data(self):
+        return {'host': '127.0.0.1', 'port': self.port}
+
+
+class Probe:
+    """
+    Follows the replayed lines the server tracks, in order.
+    """
+
+    def __init__(self, bot, server, expected: int):
+        self.bot = bot
+        self.server = server
+        self.expected = expected
+        self.joined = set()
+        self.latencies = []
+        self.done = bot.loop.create_future()
+        self.events = [event.command(command, self.received) for command in fake_twitch.TRACKED]
+
+    async def received(self, message):
+        now = time.perf_counter()
+        if message.command == 'JOIN' and message.nick == NICK:
+            self.joined.add(message.channel)
+            return
+
+        index = len(self.latencies)
+        if index >= len(self.server.sent_times):
+            return
+        self.latencies.append(now - self.server.sent_times[index])
+        if len(self.latencies) == self.expected and not self.done.done():
+            self.done.set_result(None)
+
+
+def rss_kb() -> int:
+    """
+    Current resident memory, peak resident memory if unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(lines, rate: float = 0, channels: int = 10, timeout: float = 300, plugins=PLUGINS, **config) -> dict:
+    # Our own JOINs, in archives recorded by this benchmark, are not
+    # followed by the probe
+    own = ':{0}!{0}@'.format(NICK)
+    lines = [line for line in lines if not line.startswith(own)]
+    expected = sum(1 for line in lines if fake_twitch.get_command(line) in fake_twitch.TRACKED)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(fake_twitch.FakeTwitchServer(loop).start())
+
+    config.setdefault('flood_rate_join', max(20, channels))
+    irc_bot = BenchBot(server.port, loop=loop, nick=NICK, password='oauth:bench', **config)
+    for name in plugins:
+        irc_bot.load_plugin(name)
+    probe = Probe(irc_bot, server, expected)
+    for irc_event in probe.events:
+        irc_bot.add_irc_event(irc_event)
+
+    tasks = {'max': 0}
+
+    def sample_tasks():
+        tasks['max'] = max(tasks['max'], len(asyncio.all_tasks(loop)))
+        tasks['handle'] = loop.call_later(0.05, sample_tasks)
+
+    async def scenario():
+        irc_bot.run(forever=False)
+        while not irc_bot.connections[0].logged_in:
+            await asyncio.sleep(0.01)
+
+        names = sorted({'#channel{}'.format(i) for i in range(channels)} | {
+            line.split(' ')[-1] for line in lines if fake_twitch.get_command(line) == 'JOIN'
+        })
+        for name in names:
+            irc_bot.join(name)
+        while len(probe.joined) < len(names):
+            await asyncio.sleep(0.01)
+
+        gc.collect()
+        memory_start = rss_kb()
+        tasks_start = len(asyncio.all_tasks(loop))
+        sample_tasks()
+
+        start = time.perf_counter()
+        await server.replay(lines, rate=rate)
+        if expected:
+            await asyncio.wait_for(probe.done, timeout)
+        elapsed = time.perf_counter() - start
+        tasks['handle'].cancel()
+
+        # Let the last callbacks finish
+        await asyncio.sleep(0)
+        return memory_start, tasks_start, elapsed
+
+    try:
+        memory_start, tasks_start, elapsed = loop.run_until_complete(scenario())
+        tasks_end = len(asyncio.all_tasks(loop))
+        memory_end = rss_kb()
+    finally:
+        server.close()
+        irc_bot._cleanup()
+
+    latencies = sorted(probe.latencies)
+    return {
+        'lines': len(lines),
+        'tracked_lines': expected,
+        'seconds': elapsed,
+        'lines_per_second': len(lines) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p90': percentile(latencies, 0.9) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': latencies[-1] * 1000 if latencies else 0.0,
+        },
+        'memory_kb': {
+            'start': memory_start,
+            'end': memory_end,
+            'growth': memory_end - memory_start,
+        },
+        'tasks': {
+            'start': tasks_start,
+            'max': tasks['max'],
+            'end': tasks_end,
+        },
+    }
+
+
+def compare(results: dict, previous: dict):
+    print('Compared to {}:'.format(previous.get('revision') or 'previous run'))
+    for key, old, new in (
+        ('lines/s', previous['results']['lines_per_second'], results['results']['lines_per_second']),
+        ('p50 ms', previous['results']['latency_ms']['p50'], results['results']['latency_ms']['p50']),
+        ('p99 ms', previous['results']['latency_ms']['p99'], results['results']['latency_ms']['p99']),
+        ('memory KB', previous['results']['memory_kb']['growth'], results['results']['memory_kb']['growth']),
+        ('max tasks', previous['results']['tasks']['max'], results['results']['tasks']['max']),
+    ):
+        change = (new - old) / old * 100 if old else 0.0
+        print('  {:<10} {:>12.2f} -> {:>12.2f} ({:+.1f}%)'.format(key, old, new, change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=100000, help='lines to replay')
+    parser.add_argument('--rate', type=float, default=0, help='lines per second, 0 for as fast as possible')
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--input', help='log of raw lines or archive directory to replay instead of synthetic traffic')
+    parser.add_argument('--buffered', action='store_true', help='use the BufferedProtocol')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    if args.input:
+        lines = fake_twitch.recorded(args.input, args.lines)
+    else:
+        lines = fake_twitch.synthetic(args.lines, channels=args.channels, users=args.users, seed=args.seed)
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'lines': args.lines,
+            'rate': args.rate,
+            'channels': args.channels,
+            'users': args.users,
+            'seed': args.seed,
+            'input': args.input,
+            'buffered': args.buffered,
+        },
+        'results': run(lines, rate=args.rate, channels=args.channels, buffered_protocol=args.buffered),
+    }
+
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
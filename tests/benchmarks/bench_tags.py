@@ -0,0 +1,36 @@
+"""
+Micro-benchmark of utils.decode against the lazy utils.Tags.
+
+    python tests/benchmarks/bench_tags.py
+"""
+import timeit
+
+from pytwitcher import utils
+
+
+TAGS = (
+    r'badge-info=subscriber/14;badges=subscriber/12,premium/1;client-nonce=4b7c0e3b1b2a4b7c9e1d2f3a4b5c6d7e;'
+    r'color=#1E90FF;display-name=Some\sUser;emotes=25:0-4,12-16/1902:6-10;first-msg=0;flags=;'
+    r'id=b34ccfc7-4977-403a-8a94-33c6bac34fb8;mod=0;returning-chatter=0;room-id=1337;subscriber=1;'
+    r'tmi-sent-ts=1507246572675;turbo=0;user-id=1337;user-type='
+)
+
+CASES = (
+    ('one key', lambda tags: tags['user-id']),
+    ('three keys', lambda tags: (tags['user-id'], tags['badges'], tags['color'])),
+    ('missing key', lambda tags: 'msg-id' in tags),
+    ('all keys', lambda tags: [tags[key] for key in tags]),
+)
+
+
+def main(number=100000):
+    for name, case in CASES:
+        eager = timeit.timeit(lambda: case(utils.decode(TAGS)), number=number)
+        lazy = timeit.timeit(lambda: case(utils.Tags(TAGS)), number=number)
+        print('{:<12} decode {:7.3f}us  Tags {:7.3f}us  x{:.2f}'.format(
+            name, eager / number * 1e6, lazy / number * 1e6, eager / lazy,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+UserList memory per membership and cost of leaving big channels.
+
+    python tests/benchmarks/bench_userlist.py --users 100000
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+
+from pytwitcher import parser
+from pytwitcher.plugins import userlist
+
+
+class FakeConnection:
+    connected = True
+
+
+class FakeBot:
+    def __init__(self):
+        self.config = {'nick': 'bot'}
+        self.connections = [FakeConnection()]
+        self.channels = {}
+
+
+def names(channel: str, logins):
+    # Twitch sends NAMES in batches of about 500 bytes
+    batch = []
+    for login in logins:
+        batch.append(login)
+        if len(batch) == 50:
+            yield parser.parse(':bot.tmi.twitch.tv 353 bot = {} :{}'.format(channel, ' '.join(batch)))
+            batch = []
+    if batch:
+        yield parser.parse(':bot.tmi.twitch.tv 353 bot = {} :{}'.format(channel, ' '.join(batch)))
+
+
+def main(argv=None):
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('--users', type=int, default=100000, help='chatters in each of the two channels')
+    args = args_parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    plugin = userlist.UserList(FakeBot())
+    # Half the chatters of #big are also in #other
+    big = ['user{}'.format(i) for i in range(args.users)]
+    other = ['user{}'.format(i) for i in range(args.users // 2, args.users + args.users // 2)]
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for channel, logins in (('#big', big), ('#other', other)):
+        loop.run_until_complete(plugin.join.callback(parser.parse(':bot!bot@bot.tmi.twitch.tv JOIN ' + channel)))
+        for message in names(channel, logins):
+            loop.run_until_complete(plugin.names.callback(message))
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    memberships = len(big) + len(other)
+    print('NAMES     {:8.3f}s  {:6.1f} bytes/membership'.format(elapsed, used / memberships))
+
+    start = time.perf_counter()
+    plugin.remove_channel('#big')
+    print('PART #big {:8.3f}s  ({} users left indexed)'.format(time.perf_counter() - start, len(plugin.user_channels)))
+
+    start = time.perf_counter()
+    plugin.bot.connections[0].connected = False
+    plugin.handle_connection_lost()
+    print('Lost      {:8.3f}s'.format(time.perf_counter() - start))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
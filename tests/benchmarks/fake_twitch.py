@@ -0,0 +1,241 @@
+"""
+Local stand-in for irc.chat.twitch.tv, and traffic to replay through it.
+
+The server speaks enough of the CAP/PASS/NICK handshake, JOIN and PING for
+a bot to log in and join its channels, then replays lines at a given rate.
+"""
+
+import asyncio
+import itertools
+import os
+import random
+import time
+import uuid
+
+from pytwitcher import archive
+
+
+HOST = 'tmi.twitch.tv'
+
+# Commands the benchmark follows line by line
+TRACKED = ('PRIVMSG', 'USERNOTICE', 'JOIN')
+
+WORDS = (
+    'Kappa', 'PogChamp', 'LUL', 'gg', 'wp', 'hello', 'chat', 'what', 'is', 'this', 'game', 'no', 'way',
+    'that', 'was', 'insane', 'clip', 'it', 'monkaS', 'KEKW', 'first', 'time', 'here', 'love', 'the', 'stream',
+)
+COLORS = ('#1E90FF', '#FF0000', '#008000', '#B22222', '#FF7F50', '#9ACD32', '#FF4500', '#2E8B57', '')
+BADGES = ('', 'subscriber/12', 'subscriber/3,premium/1', 'moderator/1', 'vip/1', 'bits/100', 'premium/1')
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace(';', '\\:').replace(' ', '\\s')
+
+
+def synthetic(count: int, channels: int = 10, users: int = 5000, seed: int = 0,
+              usernotice_ratio: float = 0.02, join_ratio: float = 0.05):
+    """
+    Yield `count` lines looking like busy Twitch chat: mostly tagged
+    PRIVMSG, some USERNOTICE (subs) and JOIN, over `channels` channels.
+    Same arguments, same lines.
+    """
+    rng = random.Random(seed)
+    channel_names = ['#channel{}'.format(i) for i in range(channels)]
+    room_ids = {name: str(1000 + i) for i, name in enumerate(channel_names)}
+    timestamp = 1507246572675
+
+    for _ in range(count):
+        channel = rng.choice(channel_names)
+        user_id = rng.randrange(users)
+        nick = 'user{}'.format(user_id)
+        timestamp += rng.randrange(50)
+        kind = rng.random()
+
+        if kind < join_ratio:
+            yield ':{nick}!{nick}@{nick}.tmi.twitch.tv JOIN {channel}'.format(nick=nick, channel=channel)
+            continue
+
+        badges = rng.choice(BADGES)
+        tags = [
+            ('badge-info', 'subscriber/14' if badges.startswith('subscriber') else ''),
+            ('badges', badges),
+            ('color', rng.choice(COLORS)),
+            ('display-name', 'User{}'.format(user_id)),
+            ('emotes', '25:0-4' if rng.random() < 0.1 else ''),
+            ('flags', ''),
+            ('id', str(uuid.UUID(int=rng.getrandbits(128)))),
+            ('mod', '1' if badges.startswith('moderator') else '0'),
+            ('room-id', room_ids[channel]),
+            ('subscriber', '1' if badges.startswith('subscriber') else '0'),
+            ('tmi-sent-ts', str(timestamp)),
+            ('turbo', '0'),
+            ('user-id', str(100000 + user_id)),
+        ]
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(1, 15)))
+
+        if kind < join_ratio + usernotice_ratio:
+            tags.extend((
+                ('login', nick),
+                ('msg-id', 'resub'),
+                ('msg-param-cumulative-months', str(rng.randrange(1, 60))),
+                ('system-msg', 'User{} subscribed at Tier 1.'.format(user_id)),
+            ))
+            yield '@{} :{} USERNOTICE {} :{}'.format(
+                ';'.join('{}={}'.format(key, _escape(value)) for key, value in tags), HOST, channel, text,
+            )
+        else:
+            tags.append(('user-type', ''))
+            yield '@{} :{nick}!{nick}@{nick}.tmi.twitch.tv PRIVMSG {} :{}'.format(
+                ';'.join('{}={}'.format(key, _escape(value)) for key, value in tags), channel, text, nick=nick,
+            )
+
+
+def recorded(path: str, count: int = None):
+    """
+    Yield the raw lines of a log (one line per line) or of an archive
+    directory (see pytwitcher.archive), looping over it until `count` lines
+    were yielded if given.
+    """
+    if os.path.isdir(path):
+        lines = list(archive.ArchiveReader(path).lines())
+    else:
+        with open(path, encoding='utf8') as f:
+            lines = [line.rstrip('\r\n') for line in f if line.strip()]
+    if not lines:
+        return
+    if count is None:
+        yield from lines
+    else:
+        yield from itertools.islice(itertools.cycle(lines), count)
+
+
+def get_command(line: str) -> str:
+    if line.startswith('@'):
+        line = line.partition(' ')[2]
+    if line.startswith(':'):
+        line = line.partition(' ')[2]
+    return line.partition(' ')[0]
+
+
+class FakeTwitchServer:
+    """
+    Accepts bots on a local port. Lines given to replay() are written to
+    every logged in client, `rate` lines per second (0 for as fast as the
+    socket takes them). The time each TRACKED line was written is kept in
+    sent_times, in order.
+    """
+
+    def __init__(self, loop, host: str = '127.0.0.1', port: int = 0):
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.server = None
+        self.clients = []
+        # lines received from the clients, after the handshake
+        self.received = []
+        self.sent_times = []
+        self.sent = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def close(self):
+        for writer in self.clients:
+            writer.close()
+        if self.server is not None:
+            self.server.close()
+
+    def _write(self, writer, *lines):
+        writer.write(''.join(line + '\r\n' for line in lines).encode('utf8'))
+
+    async def handle(self, reader, writer):
+        nick = None
+        while True:
+            try:
+                data = await reader.readline()
+            except (ConnectionError, asyncio.CancelledError):
+                break
+            if not data:
+                break
+            line = data.decode('utf8', 'ignore').rstrip('\r\n')
+            command, _, params = line.partition(' ')
+
+            if command == 'CAP':
+                self._write(writer, ':{} CAP * ACK :{}'.format(HOST, params.partition(':')[2]))
+            elif command == 'PASS':
+                pass
+            elif command == 'NICK':
+                nick = params
+                self._write(
+                    writer,
+                    ':{} 001 {} :Welcome, GLHF!'.format(HOST, nick),
+                    ':{} 002 {} :Your host is {}'.format(HOST, nick, HOST),
+                    ':{} 003 {} :This server is rather new'.format(HOST, nick),
+                    ':{} 004 {} :-'.format(HOST, nick),
+                    ':{} 375 {} :-'.format(HOST, nick),
+                    ':{} 372 {} :You are in a maze of twisty passages, all alike.'.format(HOST, nick),
+                    ':{} 376 {} :>'.format(HOST, nick),
+                )
+                if not nick.startswith('justinfan'):
+                    self._write(writer, '@badges=;color=;display-name={0};user-id=1 :{1} GLOBALUSERSTATE'.format(
+                        nick, HOST,
+                    ))
+                self.clients.append(writer)
+            elif command == 'JOIN':
+                for channel in params.split(','):
+                    self._write(
+                        writer,
+                        ':{0}!{0}@{0}.{1} JOIN {2}'.format(nick, HOST, channel),
+                        ':{0}.{1} 353 {0} = {2} :{0}'.format(nick, HOST, channel),
+                        ':{0}.{1} 366 {0} {2} :End of /NAMES list'.format(nick, HOST, channel),
+                        '@badges=;color=;display-name={0};mod=0;subscriber=0 :{1} USERSTATE {2}'.format(
+                            nick, HOST, channel,
+                        ),
+                        '@emote-only=0;followers-only=-1;r9k=0;slow=0;subs-only=0 :{} ROOMSTATE {}'.format(
+                            HOST, channel,
+                        ),
+                    )
+            elif command == 'PART':
+                self._write(writer, ':{0}!{0}@{0}.{1} PART {2}'.format(nick, HOST, params))
+            elif command == 'PING':
+                self._write(writer, ':{0} PONG {0} {1}'.format(HOST, params))
+            else:
+                self.received.append(line)
+
+        if writer in self.clients:
+            self.clients.remove(writer)
+        writer.close()
+
+    async def replay(self, lines, rate: float = 0, chunk: int = 1000):
+        """
+        Write lines to every client, at `rate` lines per second if given.
+        """
+        clock = time.perf_counter
+        interval = 0.01
+        if rate:
+            chunk = max(1, int(rate * interval))
+        start = clock()
+        lines = iter(lines)
+
+        while True:
+            batch = list(itertools.islice(lines, chunk))
+            if not batch:
+                break
+
+            data = ''.join(line + '\r\n' for line in batch).encode('utf8')
+            now = clock()
+            for writer in self.clients:
+                writer.write(data)
+            self.sent_times.extend(now for line in batch if get_command(line) in TRACKED)
+            self.sent += len(batch)
+
+            for writer in self.clients:
+                await writer.drain()
+            if rate:
+                delay = start + self.sent / rate - clock()
+                await asyncio.sleep(max(0, delay))
+            else:
+                # Let the bot read
+                await asyncio.sleep(0)
@@ -0,0 +1,20 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import replay
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def virtual_loop():
+    # Virtual time, sleeps are instant
+    loop = replay.VirtualClockLoop()
+    yield loop
+    loop.close()
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from pytwitcher import archive
+from pytwitcher import protocol
+
+
+def privmsg(channel, text):
+    return ':a!a@a.tmi.twitch.tv PRIVMSG {} :{}'.format(channel, text)
+
+
+@pytest.fixture(params=[True, False], ids=['compressed', 'raw'])
+def writer(request, tmpdir):
+    return archive.ArchiveWriter(str(tmpdir), compress=request.param)
+
+
+def feed(writer, timestamp, *lines):
+    writer.feed(''.join(line + '\r\n' for line in lines).encode('utf8'), timestamp)
+
+
+class TestArchive:
+    def test_roundtrip(self, writer):
+        feed(writer, 10, privmsg('#a', 'one'), 'PING :tmi.twitch.tv', privmsg('#b', 'two'))
+        writer.flush()
+        feed(writer, 20, privmsg('#a', 'é'))
+        writer.close()
+
+        reader = archive.ArchiveReader(writer.directory)
+        assert list(reader.read()) == [
+            (10, privmsg('#a', 'one')),
+            (10, 'PING :tmi.twitch.tv'),
+            (10, privmsg('#b', 'two')),
+            (20, privmsg('#a', 'é')),
+        ]
+        assert list(reader.lines('#a')) == [privmsg('#a', 'one'), privmsg('#a', 'é')]
+        assert list(reader.lines('#a', start=15)) == [privmsg('#a', 'é')]
+        assert list(reader.lines('#b', start=15)) == []
+        assert list(reader.lines('#c')) == []
+
+    def test_segments_and_index(self, writer):
+        writer.segment_size = 1
+        for i in range(3):
+            feed(writer, i, privmsg('#a' if i % 2 else '#b', i))
+            writer.flush()
+        # Still open, read from the block headers
+        feed(writer, 3, privmsg('#a', 3))
+        writer.flush()
+        writer.segment_size = 2 ** 20
+        feed(writer, 4, privmsg('#b', 4))
+        writer.flush()
+
+        names = sorted(os.listdir(writer.directory))
+        assert names == [
+            'archive-00000001.idx', 'archive-00000001.seg',
+            'archive-00000002.idx', 'archive-00000002.seg',
+            'archive-00000003.idx', 'archive-00000003.seg',
+            'archive-00000004.idx', 'archive-00000004.seg',
+            'archive-00000005.seg',
+        ]
+        reader = archive.ArchiveReader(writer.directory)
+        assert list(reader.lines('#a')) == [privmsg('#a', 1), privmsg('#a', 3)]
+        assert list(reader.lines('#b', start=1, end=4)) == [privmsg('#b', 2), privmsg('#b', 4)]
+        writer.close()
+
+    def test_thread(self, writer):
+        writer.flush_interval = 0.01
+        writer.start()
+        feed(writer, 1, privmsg('#a', 'one'))
+        writer.close()
+        assert list(archive.ArchiveReader(writer.directory).lines()) == [privmsg('#a', 'one')]
+        # Numbering continues after existing segments
+        writer.start()
+        feed(writer, 2, privmsg('#a', 'two'))
+        writer.close()
+        assert archive.segments(writer.directory)[-1].endswith('archive-00000002.seg')
+
+
+class Factory:
+    encoding = 'utf8'
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.lines = []
+
+    def process_data(self, data):
+        self.lines.append(data)
+
+
+def test_protocol_feed(writer):
+    proto = protocol.IrcProtocol(Factory(writer))
+    proto.data_received(b'PING :a\r\nPRIVMSG #a :par')
+    proto.data_received(b'tial\r\n')
+    writer.close()
+    assert list(archive.ArchiveReader(writer.directory).lines()) == ['PING :a', 'PRIVMSG #a :partial']
@@ -0,0 +1,552 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from pytwitcher import base
+from pytwitcher import connection
+from pytwitcher import event
+from pytwitcher import outbound
+from pytwitcher import parser
+from pytwitcher import protocol
+from pytwitcher import state
+from pytwitcher import utils
+
+
+class FakeProtocol:
+    def __init__(self):
+        self.lines = []
+        self.closed = False
+        self.reads = 0
+
+    def write(self, data):
+        self.lines.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+def connect(conn):
+    conn.protocol = FakeProtocol()
+    conn.process_data(':tmi.twitch.tv 376 justinfan :>')
+    return conn.protocol
+
+
+@pytest.fixture
+def bot(loop):
+    bot = base.IrcObject(loop=loop, flood_rate_normal=2, flood_delay=0.2)
+    connect(bot.connections[0])
+    yield bot
+    bot._cleanup()
+
+
+class TestQueue:
+    def test_burst_then_wait(self, loop, bot):
+        futures = [bot.send_line('PRIVMSG #chan :{}'.format(i)) for i in range(3)]
+        loop.run_until_complete(asyncio.gather(*futures[:2]))
+        assert bot.protocol.lines == ['PRIVMSG #chan :0', 'PRIVMSG #chan :1']
+        assert not futures[2].done()
+
+        start = loop.time()
+        loop.run_until_complete(futures[2])
+        assert loop.time() - start > 0.1
+        assert bot.protocol.lines[-1] == 'PRIVMSG #chan :2'
+
+    def test_no_head_of_line_blocking(self, loop, bot):
+        messages = [bot.send_line('PRIVMSG #chan :{}'.format(i)) for i in range(3)]
+        join = bot.send_line('JOIN #other')
+        loop.run_until_complete(join)
+        assert bot.protocol.lines == ['PRIVMSG #chan :0', 'PRIVMSG #chan :1', 'JOIN #other']
+        assert not messages[2].done()
+        loop.run_until_complete(messages[2])
+
+
+class TestOutbound:
+    def test_long_join_split(self, loop):
+        bot = base.IrcObject(loop=loop, flood_rate_join=2, flood_delay_join=0.05)
+        proto = connect(bot.connections[0])
+        future = bot.send_line('JOIN #a,#b,#c,#d,#e')
+        loop.run_until_complete(asyncio.sleep(0))
+        assert proto.lines == ['JOIN #a,#b']
+        assert not future.done()
+        loop.run_until_complete(future)
+        assert proto.lines == ['JOIN #a,#b', 'JOIN #c,#d', 'JOIN #e']
+        bot._cleanup()
+
+    def test_priority(self, loop, bot):
+        queue = bot.connections[0].queue
+        queue.pause()
+        message = bot.send_line('PRIVMSG #chan :hi')
+        part = bot.send_line('PART #chan')
+        pong = bot.send_line('PONG :tmi.twitch.tv')
+        queue.resume(bot.protocol.write)
+        loop.run_until_complete(asyncio.gather(message, part, pong))
+        assert bot.protocol.lines == ['PONG :tmi.twitch.tv', 'PRIVMSG #chan :hi', 'PART #chan']
+
+    def test_part_forgets_state(self, loop, bot):
+        bot.state.update_room('#chan', utils.Tags('subs-only=1'))
+        with pytest.raises(state.MessageRejected):
+            loop.run_until_complete(bot.send_line('PRIVMSG #chan :hi'))
+        bot.state.update_room('#other', utils.Tags('slow=30'))
+        bot.rate_limiter.set_elevated('#other', True)
+
+        # Kept until the PART is written
+        queue = bot.connections[0].queue
+        queue.pause()
+        future = bot.send_line('PART #chan,#other')
+        loop.run_until_complete(asyncio.sleep(0.01))
+        assert sorted(bot.state.channels) == ['#chan', '#other']
+        queue.resume(bot.protocol.write)
+        loop.run_until_complete(future)
+        assert not bot.state.channels
+        assert not bot.rate_limiter.elevated_channels
+        loop.run_until_complete(bot.send_line('PRIVMSG #chan :hi'))
+
+    def test_future_resolves_on_write(self, loop, bot):
+        queue = bot.connections[0].queue
+        queue.pause()
+        future = bot.send_line('PRIVMSG #chan :hi')
+        loop.run_until_complete(asyncio.sleep(0.01))
+        assert not future.done()
+        queue.resume(bot.protocol.write)
+        loop.run_until_complete(future)
+        assert bot.protocol.lines == ['PRIVMSG #chan :hi']
+
+    def test_kept_across_reconnections(self, loop, bot):
+        conn = bot.connections[0]
+        old_protocol = conn.protocol
+        old_protocol.close()
+        conn.connection_lost(old_protocol, reconnect=False)
+        assert conn.queue.paused
+        future = bot.send_line('PRIVMSG #chan :hi')
+
+        connect(conn)
+        loop.run_until_complete(future)
+        assert old_protocol.lines == []
+        assert conn.protocol.lines == ['PRIVMSG #chan :hi']
+
+    def test_unflushed_lines_kept(self, loop):
+        bot = base.IrcObject(loop=loop, write_batch_window=5)
+        conn = bot.connections[0]
+        conn.protocol = protocol.IrcProtocol(conn)
+        conn.protocol.connection_made(FakeTransport())
+        conn.process_data(':tmi.twitch.tv 376 justinfan :>')
+        future = bot.send_line('PRIVMSG #chan :hi')
+        loop.run_until_complete(asyncio.sleep(0.01))
+        assert conn.protocol.transport.writes == []
+        assert not future.done()
+
+        lost = conn.protocol
+        lost.closed = True
+        lost.connection_lost(None)
+        loop.run_until_complete(asyncio.sleep(0))
+        assert not future.done()
+        assert len(conn.queue) == 1
+
+        connect(conn)
+        loop.run_until_complete(future)
+        assert conn.protocol.lines == ['PRIVMSG #chan :hi']
+        bot._cleanup()
+
+    def test_replaced_connection_lost(self, loop, bot):
+        conn = bot.connections[0]
+        old_protocol = conn.protocol
+        connect(conn)
+        # The old connection closing doesn't pause the new one
+        conn.connection_lost(old_protocol, reconnect=False)
+        assert not conn.queue.paused
+
+    def test_write_error_keeps_line(self, loop, bot):
+        def write(data):
+            raise RuntimeError
+        queue = bot.connections[0].queue
+        queue.resume(write)
+        future = bot.send_line('PRIVMSG #chan :hi')
+        loop.run_until_complete(asyncio.sleep(0.01))
+        assert queue.paused
+        assert not future.done()
+        queue.resume(bot.protocol.write)
+        loop.run_until_complete(future)
+
+
+class TestShards:
+    @pytest.fixture
+    def bot(self, loop):
+        bot = base.IrcObject(loop=loop, channels_per_shard=2)
+        connect(bot.connections[0])
+        add_connection = bot._add_connection
+
+        def _add_connection():
+            conn = add_connection()
+            connect(conn)
+            return conn
+        bot._add_connection = _add_connection
+        yield bot
+        bot._cleanup()
+
+    def test_routing(self, loop, bot):
+        futures = [bot.send_line('JOIN #{}'.format(i)) for i in range(5)]
+        loop.run_until_complete(asyncio.gather(*futures))
+        assert [sorted(conn.channels) for conn in bot.connections] == [['#0', '#1'], ['#2', '#3'], ['#4']]
+        assert bot.connections[1].protocol.lines == ['JOIN #2', 'JOIN #3']
+
+        loop.run_until_complete(bot.send_line('PRIVMSG #3 :hi'))
+        assert bot.connections[1].protocol.lines[-1] == 'PRIVMSG #3 :hi'
+
+        loop.run_until_complete(bot.send_line('PART #1'))
+        assert bot.connections[0].protocol.lines[-1] == 'PART #1'
+        assert '#1' not in bot.channels
+
+        # Room was made on the first connection
+        loop.run_until_complete(bot.send_line('JOIN #5'))
+        assert bot.channels['#5'] is bot.connections[0]
+
+    def test_multi_channel_lines_split(self, loop, bot):
+        loop.run_until_complete(bot.send_line('JOIN #0,#1,#2'))
+        assert [sorted(conn.channels) for conn in bot.connections] == [['#0', '#1'], ['#2']]
+        assert bot.connections[0].protocol.lines[-1] == 'JOIN #0,#1'
+        assert bot.connections[1].protocol.lines == ['JOIN #2']
+
+        loop.run_until_complete(bot.send_line('PART #1,#2'))
+        assert bot.connections[0].protocol.lines[-1] == 'PART #1'
+        assert bot.connections[1].protocol.lines[-1] == 'PART #2'
+        assert sorted(bot.channels) == ['#0']
+        assert [sorted(conn.channels) for conn in bot.connections] == [['#0'], []]
+
+    def test_independent_reconnections(self, loop, bot):
+        loop.run_until_complete(asyncio.gather(*[bot.send_line('JOIN #{}'.format(i)) for i in range(3)]))
+        first, second = bot.connections
+        lost = second.protocol
+        lost.close()
+        second.connection_lost(lost, reconnect=False)
+        assert second.queue.paused
+        assert not first.queue.paused
+
+        loop.run_until_complete(bot.send_line('PRIVMSG #0 :hi'))
+        future = bot.send_line('PRIVMSG #2 :hi')
+        loop.run_until_complete(asyncio.sleep(0.01))
+        assert not future.done()
+        connect(second)
+        loop.run_until_complete(future)
+
+
+def connection_made(loop, conn, proto):
+    future = loop.create_future()
+    future.set_result((None, proto))
+    conn._connection_made(future)
+
+
+class TestReconnect:
+    def test_backoff(self):
+        backoff = connection.Backoff(1, 10, random=lambda: 1)
+        assert [backoff.next() for _ in range(6)] == [1, 2, 4, 8, 10, 10]
+        backoff.reset()
+        assert backoff.next() == 1
+
+    def test_backoff_jitter(self):
+        backoff = connection.Backoff(1, 10)
+        for _ in range(20):
+            assert 0 <= backoff.next() <= 10
+
+    def test_lost_schedules_with_backoff(self, loop, bot):
+        conn = bot.connections[0]
+        conn.backoff.random = lambda: 1
+        lost = conn.protocol
+        lost.close()
+        conn.connection_lost(lost, reconnect=True)
+        handle = conn._reconnect_handle
+        assert handle is not None
+        assert 0.9 < handle.when() - loop.time() <= 1
+        # Only one pending reconnection
+        conn.connection_lost(lost, reconnect=True)
+        assert conn._reconnect_handle is handle
+
+    def test_make_before_break(self, loop, bot):
+        conn = bot.connections[0]
+        old = conn.protocol
+        new = FakeProtocol()
+        connection_made(loop, conn, new)
+        # The old connection is still used while the new one logs in
+        assert conn.protocol is old and conn.next_protocol is new
+        assert not old.closed
+        assert new.lines[0].startswith('CAP REQ')
+
+        loop.run_until_complete(bot.send_line('PRIVMSG #chan :during'))
+        assert old.lines == ['PRIVMSG #chan :during']
+
+        conn.channels.add('#chan')
+        conn.process_data(':tmi.twitch.tv 376 justinfan :>')
+        assert conn.protocol is new and conn.next_protocol is None
+        # Still read from until the channels are joined again on the new one
+        assert conn.old_protocol is old and not old.closed
+        loop.run_until_complete(bot.send_line('PRIVMSG #chan :after'))
+        assert new.lines[-2:] == ['JOIN #chan', 'PRIVMSG #chan :after']
+        loop.run_until_complete(asyncio.sleep(0.01))
+        assert old.closed and conn.old_protocol is None
+
+    def test_make_before_break_closed_by_server(self, loop, bot):
+        conn = bot.connections[0]
+        conn.channels.add('#chan')
+        old = conn.protocol
+        new = FakeProtocol()
+        connection_made(loop, conn, new)
+        conn.process_data(':tmi.twitch.tv 376 justinfan :>')
+        assert conn.old_protocol is old
+        old.closed = True
+        conn.connection_lost(old, reconnect=True)
+        assert conn.old_protocol is None
+        assert conn.protocol is new and conn._reconnect_handle is None
+
+    def test_rejoin(self, loop, bot):
+        conn = bot.connections[0]
+        bot.rate_limiter.join.rate = 2
+        conn.channels.update(('#0', '#1', '#2'))
+
+        lost = conn.protocol
+        lost.close()
+        conn.connection_lost(lost, reconnect=False)
+        message = bot.send_line('PRIVMSG #0 :hi')
+        connection_made(loop, conn, FakeProtocol())
+        conn.process_data(':tmi.twitch.tv 376 justinfan :>')
+        loop.run_until_complete(message)
+        # JOINs go first, batched by what the JOIN limit allows at once
+        assert conn.protocol.lines[-2:] == ['JOIN #0,#1', 'PRIVMSG #0 :hi']
+        assert [line for _, _, line, _, _, _, _ in conn.queue.lanes[outbound.HIGH][(bot.rate_limiter.join,)]] == [
+            'JOIN #2',
+        ]
+
+
+class FakeTransport:
+    def __init__(self):
+        self.aborted = False
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        self.aborted = True
+
+
+class TestKeepalive:
+    @pytest.fixture
+    def bot(self, loop):
+        bot = base.IrcObject(loop=loop, keepalive_interval=0.05, keepalive_timeout=0.05)
+        connect(bot.connections[0])
+        bot.protocol.transport = FakeTransport()
+        yield bot
+        bot._cleanup()
+
+    def test_answer_ping(self, loop, bot):
+        bot.connections[0].process_data('PING :tmi.twitch.tv')
+        assert bot.protocol.lines == ['PONG :tmi.twitch.tv']
+
+    def test_ping_while_receiving(self, loop, bot):
+        conn = bot.connections[0]
+        for _ in range(4):
+            bot.protocol.reads += 1
+            loop.run_until_complete(asyncio.sleep(0.03))
+        # Busy connections get their round trip measured too
+        assert len(bot.protocol.lines) == 2
+        assert all(line.startswith('PING :keepalive-') for line in bot.protocol.lines)
+        conn.process_data(':tmi.twitch.tv PONG tmi.twitch.tv :{}'.format(bot.protocol.lines[-1][len('PING :'):]))
+        assert conn.keepalive.rtt is not None
+        assert not bot.protocol.transport.aborted
+
+    def test_idle_ping_and_rtt(self, loop, bot):
+        loop.run_until_complete(asyncio.sleep(0.07))
+        ping = bot.protocol.lines[0]
+        assert ping.startswith('PING :keepalive-')
+        conn = bot.connections[0]
+        bot.protocol.reads += 1
+        conn.process_data(':tmi.twitch.tv PONG tmi.twitch.tv :{}'.format(ping[len('PING :'):]))
+        assert 0 < conn.keepalive.rtt < 0.1
+        loop.run_until_complete(asyncio.sleep(0.04))
+        assert not bot.protocol.transport.aborted
+
+    def test_dead(self, loop, bot):
+        loop.run_until_complete(asyncio.sleep(0.15))
+        assert bot.protocol.transport.aborted
+
+
+class TestNotify:
+    def test_handle_errors_isolated(self, loop, bot):
+        called = []
+
+        def handle_thing(value):
+            raise RuntimeError
+
+        class Plugin:
+            def handle_thing(self, value):
+                called.append(value)
+
+        bot.add_listener(handle_thing)
+        bot.registry.add_plugin(Plugin())
+        bot.notify('thing', 1)
+        assert called == [1]
+
+    def test_eager_listeners(self, loop):
+        bot = base.IrcObject(loop=loop, eager_listeners=True)
+        called = []
+
+        async def on_thing(value):
+            called.append(value)
+
+        bot.add_listener(on_thing)
+        bot.notify('thing', 1)
+        assert called == [1]
+        bot.notify('unknown', 2)
+        bot._cleanup()
+
+
+class TestRegexEvents:
+    def test_decode_tags(self, loop, bot):
+        received = []
+
+        async def privmsg(tags=None, data=None, **kwargs):
+            received.append((type(tags), utils.decode(tags), data))
+
+        bot.add_irc_event(event.event(event.PRIVMSG, callback=privmsg))
+        bot.process_data(r'@color=#FF0000;display-name=A\sB :a!a@a.tmi.twitch.tv PRIVMSG #chan :hi')
+        loop.run_until_complete(asyncio.sleep(0))
+        assert received == [(str, {'color': '#FF0000', 'display-name': 'A B'}, 'hi')]
+
+
+class TestFilters:
+    def test_events(self, loop, bot):
+        received = []
+
+        async def commands(message):
+            received.append(('command', message.text))
+
+        async def subscribers(message):
+            received.append(('subscriber', message.text))
+
+        bot.add_irc_event(event.command('PRIVMSG', commands, channels={'#chan'}, prefix='!'))
+        bot.add_irc_event(event.command('PRIVMSG', subscribers, tags={'subscriber': '1'}))
+        for line in (
+            '@subscriber=0 :a!a@a.tmi.twitch.tv PRIVMSG #chan :!cmd',
+            '@subscriber=1 :a!a@a.tmi.twitch.tv PRIVMSG #other :!cmd',
+            '@subscriber=0 :a!a@a.tmi.twitch.tv PRIVMSG #chan :hi',
+        ):
+            bot.process_data(line)
+        loop.run_until_complete(asyncio.sleep(0))
+        assert received == [('command', '!cmd'), ('subscriber', '!cmd')]
+
+    def test_listeners(self, loop, bot):
+        received = []
+
+        @event.filtered(users={'a'})
+        def handle_thing(message):
+            received.append(message.nick)
+
+        bot.add_listener(handle_thing)
+        bot.notify('thing', parser.parse(':a!a@a.tmi.twitch.tv PRIVMSG #chan :hi'))
+        bot.notify('thing', message=parser.parse(':b!b@b.tmi.twitch.tv PRIVMSG #chan :hi'))
+        assert received == ['a']
+
+
+PLUGIN_SOURCE = """
+from pytwitcher import event
+
+
+class Echo:
+    VERSION = {version}
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.seen = []
+
+    def reloaded(self, previous):
+        self.seen = previous.seen
+
+    @event.command('PRIVMSG')
+    async def privmsg(self, message):
+        {body}
+        self.seen.append((self.VERSION, message.text))
+"""
+
+
+CACHED_PLUGIN_SOURCE = """
+from pytwitcher.plugin import BasePlugin
+
+
+class Cached(BasePlugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.users = self.cache('users', max_size=10)
+        self.other = self.cache('other')
+
+    def reloaded(self, previous):
+        self.caches['users'] = self.users = previous.users
+"""
+
+
+class TestReload:
+    @pytest.fixture
+    def plugin_file(self, tmpdir, monkeypatch):
+        monkeypatch.syspath_prepend(str(tmpdir))
+        path = tmpdir.join('reloaded_plugin.py')
+        yield path
+        sys.modules.pop('reloaded_plugin', None)
+
+    def write(self, path, version, body='pass', mtime=0):
+        path.write(PLUGIN_SOURCE.format(version=version, body=body))
+        os.utime(str(path), (1000000000 + mtime, 1000000000 + mtime))
+
+    def test_swap(self, loop, bot, plugin_file):
+        self.write(plugin_file, 1, 'await self.bot.gate')
+        bot.gate = loop.create_future()
+        bot.load_plugin('reloaded_plugin.Echo')
+        old = bot.registry.plugins['Echo']
+        old_registry = bot.registry
+        bot.process_data(':a!a@a.tmi.twitch.tv PRIVMSG #chan :first')
+        loop.run_until_complete(asyncio.sleep(0))
+
+        assert not bot.reload()
+        self.write(plugin_file, 2, mtime=1)
+        assert bot.reload()
+        assert bot.registry is not old_registry
+        assert old_registry.plugins['Echo'] is old
+        plugin = bot.registry.plugins['Echo']
+        assert plugin is not old and plugin.VERSION == 2
+        assert len(bot.registry.get_command_events('PRIVMSG')) == 1
+
+        bot.process_data(':a!a@a.tmi.twitch.tv PRIVMSG #chan :second')
+        bot.gate.set_result(None)
+        loop.run_until_complete(asyncio.sleep(0))
+        # In flight event finished on the old code, state carried over
+        assert plugin.seen == [(2, 'second'), (1, 'first')]
+
+    def test_caches_carried_over(self, loop, bot, plugin_file):
+        plugin_file.write(CACHED_PLUGIN_SOURCE)
+        bot.load_plugin('reloaded_plugin.Cached')
+        old = bot.registry.plugins['Cached']
+        old.users['a'] = 1
+        old.other['b'] = 2
+        assert bot.reload(names={'Cached'})
+        plugin = bot.registry.plugins['Cached']
+        assert plugin is not old
+        assert plugin.users['a'] == 1
+        # Not taken over, cleared with the old instance
+        assert len(old.other) == 0
+
+    def test_failure_keeps_plugins(self, loop, bot, plugin_file):
+        self.write(plugin_file, 1)
+        bot.load_plugin('reloaded_plugin.Echo')
+        registry = bot.registry
+        plugin_file.write('syntax error')
+        os.utime(str(plugin_file), (1000000001, 1000000001))
+        assert not bot.reload()
+        assert bot.registry is registry
+
+    def test_by_name(self, loop, bot, plugin_file):
+        self.write(plugin_file, 1)
+        bot.load_plugin('reloaded_plugin.Echo')
+        old = bot.registry.plugins['Echo']
+        assert bot.reload(names={'Echo'})
+        assert bot.registry.plugins['Echo'] is not old
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import base
+from pytwitcher import cache
+from pytwitcher.plugin import BasePlugin
+
+
+@pytest.fixture
+def loop(virtual_loop):
+    return virtual_loop
+
+
+def sleep(loop, seconds):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+
+class TestCache:
+    def test_lru(self):
+        lru = cache.Cache(max_size=2)
+        lru['a'] = 1
+        lru['b'] = 2
+        assert lru['a'] == 1
+        lru['c'] = 3
+        assert 'b' not in lru
+        assert lru.get('b') is None
+        assert list(lru.data) == ['a', 'c']
+        assert lru.stats() == {
+            'entries': 2, 'bytes': lru.bytes, 'hits': 1, 'misses': 1, 'evictions': 1, 'expirations': 0,
+        }
+        del lru['a']
+        with pytest.raises(KeyError):
+            lru['a']
+        assert lru.bytes == cache.sizeof('c', 3)
+        lru.clear()
+        assert lru.bytes == 0
+
+    def test_ttl(self, loop):
+        ttl = cache.Cache(ttl=10, loop=loop)
+        ttl['a'] = 1
+        sleep(loop, 5)
+        ttl.set('b', 2)
+        ttl.set('c', 3, ttl=100)
+        sleep(loop, 6)
+        assert 'a' not in ttl.data
+        assert ttl.get('b') == 2
+        sleep(loop, 10)
+        assert list(ttl.data) == ['c']
+        assert ttl.expirations == 2
+        sleep(loop, 100)
+        assert not ttl.data and ttl.wheel.count == 0
+        # The timer stops once empty
+        assert ttl.wheel._handle is None
+
+    def test_long_ttl_filed_once(self, loop):
+        ttl = cache.Cache(ttl=10, loop=loop)
+        wheel = ttl.wheel
+        ttl.set('long', 1, ttl=100)
+        ttl.set('cancelled', 2, ttl=200)
+        # Slots only hold what is due this turn
+        assert not any(wheel.slots) and len(wheel.later) == 2
+        del ttl['cancelled']
+        assert len(wheel.later) == 1
+        sleep(loop, 99.5)
+        assert 'long' in ttl.data and not wheel.later
+        sleep(loop, 5)
+        assert not ttl.data and wheel.count == 0
+
+    def test_overwrite_and_pop(self, loop):
+        ttl = cache.Cache(ttl=10, loop=loop)
+        ttl['a'] = 1
+        sleep(loop, 8)
+        ttl['a'] = 2
+        sleep(loop, 8)
+        assert ttl['a'] == 2
+        assert ttl.pop('a') == 2
+        assert ttl.wheel.count == 0
+        assert ttl.pop('a', 'gone') == 'gone'
+
+    def test_expired_before_tick(self, loop):
+        ttl = cache.Cache(ttl=1, loop=loop, resolution=5)
+        ttl['a'] = 1
+        loop.advance(10)
+        # Due, its timer did not run yet
+        assert 'a' not in ttl
+        assert ttl.get('a') is None
+
+    def test_ttl_needs_loop(self):
+        with pytest.raises(ValueError):
+            cache.Cache(ttl=10)
+        with pytest.raises(ValueError):
+            cache.Cache().set('a', 1, ttl=10)
+
+
+class Plugin(BasePlugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.users = self.cache('users', max_size=100)
+
+
+class TestPlugin:
+    def test_accounting(self, loop):
+        bot = base.IrcObject(loop=loop, metrics=True)
+        plugin = Plugin(bot)
+        bot.registry.add_plugin(plugin)
+        plugin.users['a'] = 'x' * 1000
+        plugin.users.get('b')
+        assert plugin.memory() > 1000
+        assert plugin.cache_stats()['users']['misses'] == 1
+        assert bot.metrics.get('pytwitcher_cache_bytes', ('Plugin', 'users')) == plugin.memory()
+        assert bot.metrics.get('pytwitcher_cache_misses_total', ('Plugin', 'users')) == 1
+        with pytest.raises(ValueError):
+            plugin.cache('users')
+
+        bot.registry.remove_plugin('Plugin')
+        assert plugin.memory() == 0
+        bot._cleanup()
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import base
+from pytwitcher import commands
+from pytwitcher import parser
+from pytwitcher.plugin import BasePlugin, chat_command
+
+
+def privmsg(text, badges='', nick='a', channel='#chan'):
+    return parser.parse('@badges={} :{n}!{n}@{n}.tmi.twitch.tv PRIVMSG {} :{}'.format(badges, channel, text, n=nick))
+
+
+async def noop(message, *args):
+    pass
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRouter:
+    def test_find(self):
+        router = commands.Router({'command_prefix': '!'})
+        dice = commands.chat_command('dice', noop, aliases=('roll',))
+        so = commands.chat_command('so', noop, prefix='?')
+        router.add(dice)
+        router.add(so)
+        assert router.first == {'!', '?'}
+        assert router.find('!dice 20') == (dice, '20')
+        assert router.find('!ROLL') == (dice, '')
+        assert router.find('?so name') == (so, 'name')
+        assert router.find('hello') is None
+        assert router.find('!dicey') is None
+        assert router.find('!di') is None
+        assert router.find('') is None
+        with pytest.raises(ValueError):
+            router.add(commands.chat_command('roll', noop))
+
+        router.remove(dice)
+        assert router.find('!dice') is None
+        assert router.first == {'?'}
+
+    def test_parse(self):
+        async def callback(message, sides: int, label='d', *rest: float):
+            pass
+
+        cmd = commands.chat_command('dice', callback)
+        assert cmd.parse('20') == (20,)
+        assert cmd.parse('20 "big one" 1.5 2') == (20, 'big one', 1.5, 2.0)
+        assert cmd.parse('20 "unbalanced') == (20, '"unbalanced')
+        with pytest.raises(commands.CommandError):
+            cmd.parse('')
+        with pytest.raises(commands.CommandError):
+            cmd.parse('twenty')
+
+        async def ping(message):
+            pass
+
+        with pytest.raises(commands.CommandError):
+            commands.chat_command('ping', ping).parse('extra')
+
+    def test_permissions(self):
+        router = commands.Router({})
+        router.add(commands.chat_command('ban', noop, permission='moderator'))
+        assert router.dispatch(privmsg('!ban x')) is None
+        assert router.dispatch(privmsg('!ban x', badges='subscriber/12,vip/1')) is None
+        assert router.dispatch(privmsg('!ban x', badges='moderator/1'))[1] == ('x',)
+        assert router.dispatch(privmsg('!ban x', badges='broadcaster/1'))[1] == ('x',)
+        with pytest.raises(ValueError):
+            commands.chat_command('ban', noop, permission='owner')
+
+    def test_cooldowns(self):
+        clock = Clock()
+        router = commands.Router({}, clock=clock)
+        router.add(commands.chat_command('hi', noop, user_cooldown=10, channel_cooldown=2))
+        assert router.dispatch(privmsg('!hi')) is not None
+        # Channel cooldown
+        assert router.dispatch(privmsg('!hi', nick='b')) is None
+        assert router.dispatch(privmsg('!hi', nick='b', channel='#other')) is not None
+        clock.now = 3
+        assert router.dispatch(privmsg('!hi', nick='b')) is not None
+        clock.now = 6
+        # User cooldown
+        assert router.dispatch(privmsg('!hi')) is None
+        clock.now = 11
+        assert router.dispatch(privmsg('!hi')) is not None
+        clock.now = 100
+        assert len(router.cooldowns) == 0
+
+
+class Dice(BasePlugin):
+    @chat_command('dice', aliases=('roll',), channels={'#chan'})
+    async def dice(self, message, sides: int = 6):
+        await self.reply(message, 'rolled a d{}'.format(sides))
+
+
+class TestBot:
+    def test_plugin(self, loop):
+        bot = base.IrcObject(loop=loop)
+        lines = []
+
+        def send_line(line):
+            lines.append(line)
+            future = loop.create_future()
+            future.set_result(True)
+            return future
+
+        bot.send_line = send_line
+        errors = []
+
+        def handle_command_error(message, error):
+            errors.append(str(error))
+
+        bot.add_listener(handle_command_error)
+        bot.registry.add_plugin(Dice(bot))
+        for text in ('!roll 20', '!dice', '!dice twenty', 'dice', '!dice 4 4'):
+            bot.process_message(privmsg(text))
+        bot.process_message(privmsg('!dice', channel='#other'))
+        loop.run_until_complete(asyncio.sleep(0))
+        assert lines == ['PRIVMSG #chan :rolled a d20', 'PRIVMSG #chan :rolled a d6']
+        assert errors == ["Invalid argument 'twenty' for dice", 'dice takes at most 1 arguments']
+
+        # Registry copies (hot reload) keep the commands
+        assert bot.registry.copy().commands.find('!dice')[0] == bot.registry.commands.find('!dice')[0]
+        bot.registry.remove_plugin('Dice')
+        assert not bot.registry.commands
+        bot._cleanup()
@@ -0,0 +1,91 @@
+import pytest
+
+from pytwitcher import data
+
+
+LINE = (
+    r'@badges=moderator/1;display-name=Nick\sName;room-id=1337;user-id=42 '
+    r':nick!nick@nick.tmi.twitch.tv PRIVMSG #Channel :hi'
+)
+
+
+@pytest.fixture
+def store():
+    return data.Store()
+
+
+class TestStore:
+    def test_identity(self, store):
+        user = store.user('Nick')
+        assert store.user('nick') is user
+        assert store.users.find('NICK') is user
+        assert user.login == 'nick'
+        assert len(store.users) == 1
+
+    def test_interned(self, store):
+        login = ''.join(['ni', 'ck'])
+        assert store.user(login).login is store.user('nick').login
+
+    def test_update(self, store):
+        user = store.user('nick', id='42')
+        store.user('nick', display_name='Nick')
+        assert (user.id, user.display_name) == ('42', 'Nick')
+
+    def test_remove(self, store):
+        user = store.user('nick')
+        assert store.users.remove('Nick') is user
+        assert 'nick' not in store.users
+        assert store.users.find('nick') is None
+
+    def test_slots(self, store):
+        with pytest.raises(AttributeError):
+            store.user('nick').foo = 1
+
+
+class TestChannel:
+    def test_members(self, store):
+        channel = store.channel('#Channel')
+        user = store.user('nick')
+        member = channel.add(user, 'moderator/1,subscriber/3')
+        assert channel.add(user) is member
+        assert user in channel
+        assert list(channel) == [member]
+        assert member.badges == {'moderator': '1', 'subscriber': '3'}
+        assert member.is_moderator
+
+        channel.add(user, '')
+        assert not member.is_moderator
+        assert channel.remove(user) is member
+        assert len(channel) == 0
+
+    def test_same_user_across_channels(self, store):
+        first = store.channel('#first').add(store.user('nick'))
+        second = store.channel('#second').add(store.user('nick'))
+        assert first is not second
+        assert first.user is second.user
+
+
+class TestMessage:
+    def test_lazy(self, store):
+        message = store.message(LINE)
+        assert message._parsed is None
+        assert message.text == 'hi'
+        assert message._parsed is not None
+
+    def test_user_and_channel(self, store):
+        message = store.message(LINE)
+        assert message.user is store.user('nick')
+        assert message.user.id == '42'
+        assert message.user.display_name == 'Nick Name'
+        assert message.channel is store.channel('#channel')
+        assert message.channel.id == '1337'
+
+    def test_server_prefix(self, store):
+        message = store.message('@login=sub;user-id=7 :tmi.twitch.tv USERNOTICE #channel :hey')
+        assert message.user is store.user('sub')
+        assert data.Message(':tmi.twitch.tv NOTICE * :Login unsuccessful').user is None
+
+    def test_without_store(self):
+        message = data.Message(LINE)
+        assert message.user.login == 'nick'
+        assert message.channel.name == '#channel'
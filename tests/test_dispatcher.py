@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import dispatcher
+
+
+class Recorder:
+    def __init__(self, loop):
+        self.loop = loop
+        self.running = 0
+        self.max_running = 0
+        self.done = []
+        self.release = loop.create_future()
+
+    async def __call__(self, name):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await self.release
+        self.running -= 1
+        self.done.append(name)
+
+
+def settle(loop):
+    loop.run_until_complete(asyncio.sleep(0.01))
+
+
+class TestDispatcher:
+    def test_unbounded(self, loop):
+        recorder = Recorder(loop)
+        disp = dispatcher.Dispatcher(loop)
+        for i in range(10):
+            disp.submit('a', recorder, (i,))
+        settle(loop)
+        assert recorder.running == 10
+        assert disp.pending == 0
+        recorder.release.set_result(None)
+        settle(loop)
+
+    def test_max_tasks(self, loop):
+        recorder = Recorder(loop)
+        disp = dispatcher.Dispatcher(loop, max_tasks=3)
+        for i in range(10):
+            disp.submit('a', recorder, (i,))
+        settle(loop)
+        assert recorder.running == 3
+        assert disp.stats() == {'running': 3, 'pending': 7, 'dropped': 0, 'paused': False}
+        recorder.release.set_result(None)
+        settle(loop)
+        assert sorted(recorder.done) == list(range(10))
+        assert recorder.max_running == 3
+        assert disp.running == disp.pending == 0
+
+    def test_max_per_event(self, loop):
+        slow = Recorder(loop)
+        fast = Recorder(loop)
+        fast.release.set_result(None)
+        disp = dispatcher.Dispatcher(loop, max_per_event=1)
+        for i in range(3):
+            disp.submit('slow', slow, (i,))
+        for i in range(3):
+            disp.submit('fast', fast, (i,))
+        settle(loop)
+        # One slow event doesn't hold back the others
+        assert slow.running == 1
+        assert fast.done == [0, 1, 2]
+        slow.release.set_result(None)
+        settle(loop)
+        assert slow.done == [0, 1, 2]
+
+    def test_serial_channels(self, loop):
+        order = []
+
+        async def callback(channel, i):
+            await asyncio.sleep(0.001 * (3 - i))
+            order.append((channel, i))
+
+        disp = dispatcher.Dispatcher(loop, serial_channels=True)
+        for i in range(3):
+            for channel in ('#a', '#b'):
+                disp.submit('event', callback, (channel, i), channel=channel)
+        assert disp.running == 2
+        settle(loop)
+        assert [i for channel, i in order if channel == '#a'] == [0, 1, 2]
+        assert [i for channel, i in order if channel == '#b'] == [0, 1, 2]
+        assert not disp.busy_channels
+
+    def test_backpressure(self, loop):
+        recorder = Recorder(loop)
+        calls = []
+        disp = dispatcher.Dispatcher(
+            loop, max_tasks=1, max_pending=4, drop_pending=6,
+            on_pause=lambda: calls.append('pause'), on_resume=lambda: calls.append('resume'),
+        )
+        results = [disp.submit('a', recorder, (i,)) for i in range(10)]
+        assert calls == ['pause']
+        assert disp.paused
+        assert results == [True] * 7 + [False] * 3
+        assert disp.dropped == 3
+
+        recorder.release.set_result(None)
+        settle(loop)
+        assert calls == ['pause', 'resume']
+        assert len(recorder.done) == 7
+
+    def test_pending_limits_need_a_limit(self, loop):
+        for kwargs in ({'max_pending': 2}, {'drop_pending': 2}):
+            with pytest.raises(ValueError):
+                dispatcher.Dispatcher(loop, **kwargs)
+
+    def test_error_logged(self, loop, monkeypatch):
+        errors = []
+        monkeypatch.setattr(dispatcher.logger, 'error', lambda *args, **kwargs: errors.append(kwargs['exc_info']))
+
+        async def fail():
+            raise ValueError('boom')
+
+        disp = dispatcher.Dispatcher(loop, max_tasks=1)
+        disp.submit('a', fail)
+        settle(loop)
+        assert [str(exc) for exc in errors] == ['boom']
+        assert disp.running == 0
+
+    def test_kwargs(self, loop):
+        received = []
+
+        async def callback(**kwargs):
+            received.append(kwargs)
+
+        disp = dispatcher.Dispatcher(loop, serial_channels=True)
+        # A `channel` kwarg of the callback doesn't clash with the routing one
+        disp.submit('a', callback, kwargs={'channel': '#a'}, channel='#a')
+        settle(loop)
+        assert received == [{'channel': '#a'}]
+
+    def test_eager_synchronous(self, loop):
+        done = []
+
+        async def quick(value):
+            done.append(value)
+
+        disp = dispatcher.Dispatcher(loop)
+        disp.submit_eager('a', quick, (1,))
+        # Ran inline, no task
+        assert done == [1]
+        assert not asyncio.all_tasks(loop)
+
+    def test_eager_suspending(self, loop):
+        recorder = Recorder(loop)
+        disp = dispatcher.Dispatcher(loop)
+        disp.submit_eager('a', recorder, (1,))
+        assert recorder.running == 1
+        recorder.release.set_result(None)
+        settle(loop)
+        assert recorder.done == [1]
+
+    def test_eager_cancel(self, loop):
+        recorder = Recorder(loop)
+        disp = dispatcher.Dispatcher(loop)
+        disp.submit_eager('a', recorder, (1,))
+        task, = asyncio.all_tasks(loop)
+        task.cancel()
+        settle(loop)
+        assert task.cancelled()
+        assert recorder.done == []
+
+    def test_eager_with_limits(self, loop):
+        recorder = Recorder(loop)
+        disp = dispatcher.Dispatcher(loop, max_tasks=1)
+        disp.submit_eager('a', recorder, (1,))
+        disp.submit_eager('a', recorder, (2,))
+        settle(loop)
+        assert recorder.max_running == 1
+        recorder.release.set_result(None)
+        settle(loop)
+        assert recorder.done == [1, 2]
@@ -0,0 +1,88 @@
+import asyncio
+
+from pytwitcher import base
+from pytwitcher import metrics
+from pytwitcher.event import event
+
+
+class TestMetrics:
+    def test_counters(self):
+        m = metrics.Metrics()
+        m.inc('pytwitcher_lines_received_total', ('0',))
+        m.inc('pytwitcher_lines_received_total', ('0',), 2)
+        assert m.get('pytwitcher_lines_received_total', ('0',)) == 3
+        assert m.get('pytwitcher_lines_received_total', ('1',)) is None
+
+    def test_histogram(self):
+        m = metrics.Metrics()
+        m.observe('pytwitcher_parse_seconds', 0.00002)
+        m.observe('pytwitcher_parse_seconds', 2)
+        histogram = m.snapshot()['pytwitcher_parse_seconds'][()]
+        assert histogram['count'] == 2
+        assert histogram['buckets'][0.00005] == 1
+        assert histogram['buckets'][5] == 1
+
+    def test_render(self):
+        m = metrics.Metrics()
+        m.inc('pytwitcher_lines_sent_total', ('0',))
+        m.observe('pytwitcher_callback_seconds', 0.001, ('Plugin.on_"message"',))
+        text = m.render()
+        assert '# TYPE pytwitcher_lines_sent_total counter\n' in text
+        assert 'pytwitcher_lines_sent_total{connection="0"} 1\n' in text
+        assert 'pytwitcher_callback_seconds_bucket{callback="Plugin.on_\\"message\\"",le="+Inf"} 1\n' in text
+        assert 'pytwitcher_callback_seconds_count{callback="Plugin.on_\\"message\\""} 1\n' in text
+
+    def test_collector(self):
+        m = metrics.Metrics()
+        m.add_collector(lambda: {('pytwitcher_dispatch_pending', ()): 4})
+        assert m.get('pytwitcher_dispatch_pending') == 4
+
+    def test_http(self, loop):
+        m = metrics.Metrics()
+        m.inc('pytwitcher_lines_sent_total', ('0',))
+        server = loop.run_until_complete(metrics.start_http_server(m, loop, port=0))
+        port = server.sockets[0].getsockname()[1]
+
+        async def get(path):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('GET {} HTTP/1.0\r\n\r\n'.format(path).encode())
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+
+        response = loop.run_until_complete(get('/metrics'))
+        assert response.startswith('HTTP/1.0 200 OK')
+        assert 'pytwitcher_lines_sent_total{connection="0"} 1' in response
+        assert loop.run_until_complete(get('/')).startswith('HTTP/1.0 404')
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+
+
+class TestBot:
+    def test_disabled(self, loop):
+        bot = base.IrcObject(loop=loop)
+        assert bot.metrics is None
+        assert bot.registry.metrics is None
+        assert bot.connections[0].queue.metrics is None
+        bot._cleanup()
+
+    def test_enabled(self, loop):
+        bot = base.IrcObject(loop=loop, metrics=True)
+        calls = []
+
+        async def on_message(nick, channel, message):
+            calls.append(message)
+
+        bot.registry.add_irc_event(event(r'^:(?P<nick>\S+)!\S+ PRIVMSG (?P<channel>#\S+) :(?P<message>.*)$',
+                                         on_message, 'PRIVMSG'))
+        bot.process_data(':nick!nick@nick.tmi.twitch.tv PRIVMSG #chan :hi')
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.run_until_complete(asyncio.sleep(0))
+
+        assert calls == ['hi']
+        snapshot = bot.metrics.snapshot()
+        assert snapshot['pytwitcher_parse_seconds'][()]['count'] == 1
+        assert sum(h['count'] for h in snapshot['pytwitcher_match_seconds'].values()) >= 1
+        assert snapshot['pytwitcher_callback_seconds'][('TestBot.test_enabled.<locals>.on_message',)]['count'] == 1
+        assert snapshot['pytwitcher_queue_lines'][('0',)] == 0
+        bot._cleanup()
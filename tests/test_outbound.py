@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import outbound
+
+
+class Limiter:
+    def split(self, line, message):
+        return [line]
+
+    def get_buckets(self, message):
+        return (), 0
+
+    def delay(self, buckets, cost):
+        return 0
+
+    def consume(self, buckets, cost):
+        pass
+
+
+class JoinLimiter(Limiter):
+    """
+    JOINs wait until allowed.
+    """
+
+    def __init__(self):
+        self.joins_allowed = False
+
+    def get_buckets(self, message):
+        return (message.command,), 1
+
+    def delay(self, buckets, cost):
+        return 1 if buckets == ('JOIN',) and not self.joins_allowed else 0
+
+
+def make_queue(loop, **kwargs):
+    return outbound.OutboundQueue(loop, Limiter(), **kwargs)
+
+
+class TestOutboundQueue:
+    def test_lanes(self, loop):
+        queue = make_queue(loop)
+        lines = []
+        for line in ('PRIVMSG #a :1', 'JOIN #a', 'PART #a', 'CAP REQ :x', 'PRIVMSG #a :2'):
+            queue.put(line)
+        queue.resume(lines.append)
+        queue.send_ready()
+        assert lines == ['CAP REQ :x', 'PRIVMSG #a :1', 'JOIN #a', 'PART #a', 'PRIVMSG #a :2']
+        assert len(queue) == 0
+        assert queue.size == 0
+
+    def test_order_kept_while_rate_limited(self, loop):
+        limiter = JoinLimiter()
+        queue = outbound.OutboundQueue(loop, limiter)
+        lines = []
+        for line in ('JOIN #a', 'PART #a', 'PRIVMSG #b :hi', 'PRIVMSG #a :hi', 'PART #c', 'QUIT'):
+            queue.put(line)
+        queue.resume(lines.append)
+        assert queue.send_ready() == 1
+        # Only the lines about other channels go ahead of the JOIN
+        # Nor does PART #c, behind PART #a in its rate limit group
+        assert lines == ['PRIVMSG #b :hi']
+        limiter.joins_allowed = True
+        assert queue.send_ready() is None
+        assert lines == ['PRIVMSG #b :hi', 'JOIN #a', 'PART #a', 'PRIVMSG #a :hi', 'PART #c', 'QUIT']
+        assert queue.size == 0
+        assert queue.channel_lines == ({}, {}, {})
+
+    def test_lower_lanes_wait_for_their_channels(self, loop):
+        limiter = JoinLimiter()
+        queue = outbound.OutboundQueue(loop, limiter)
+        lines = []
+        queue.put('PRIVMSG #a :hi')
+        queue.put('PART #b')
+        queue.put('JOIN #a', priority=outbound.HIGH)
+        queue.resume(lines.append)
+        queue.send_ready()
+        assert lines == ['PART #b']
+        limiter.joins_allowed = True
+        queue.send_ready()
+        assert lines == ['PART #b', 'JOIN #a', 'PRIVMSG #a :hi']
+
+    def test_explicit_priority(self, loop):
+        queue = make_queue(loop)
+        lines = []
+        queue.put('PRIVMSG #a :1')
+        queue.put('PRIVMSG #a :2', priority=outbound.HIGH)
+        queue.resume(lines.append)
+        queue.send_ready()
+        assert lines == ['PRIVMSG #a :2', 'PRIVMSG #a :1']
+
+    def test_error_policy(self, loop):
+        queue = make_queue(loop, max_size=1)
+        queue.put('PRIVMSG #a :1')
+        with pytest.raises(asyncio.QueueFull):
+            queue.put('PRIVMSG #a :2')
+        # High priority lines are never refused
+        queue.put('PONG :tmi.twitch.tv')
+        assert len(queue) == 2
+
+    def test_drop_newest(self, loop):
+        queue = make_queue(loop, max_size=1, policy=outbound.DROP_NEWEST)
+        first = queue.put('PRIVMSG #a :1')
+        second = queue.put('PRIVMSG #a :2')
+        assert isinstance(second.exception(), asyncio.QueueFull)
+        assert not first.done()
+        assert queue.dropped == 1
+
+    def test_drop_oldest(self, loop):
+        queue = make_queue(loop, max_size=2, policy=outbound.DROP_OLDEST)
+        first = queue.put('PRIVMSG #a :1')
+        part = queue.put('PART #a')
+        third = queue.put('PRIVMSG #a :3')
+        # Lowest lane first
+        assert isinstance(first.exception(), asyncio.QueueFull)
+        assert not part.done()
+        assert not third.done()
+        assert queue.size == 2
+
+    def test_cancelled(self, loop):
+        queue = make_queue(loop)
+        lines = []
+        future = queue.put('PRIVMSG #a :1')
+        future.cancel()
+        queue.resume(lines.append)
+        queue.send_ready()
+        assert lines == []
+        assert queue.size == 0
+
+    def test_drain(self, loop):
+        queue = make_queue(loop, max_size=4)
+        for i in range(4):
+            queue.put('PRIVMSG #a :{}'.format(i))
+        drain = asyncio.ensure_future(queue.drain(), loop=loop)
+        loop.run_until_complete(asyncio.sleep(0))
+        assert not drain.done()
+        queue.resume(lambda line: None)
+        queue.send_ready()
+        loop.run_until_complete(drain)
+
+    def test_bad_policy(self, loop):
+        with pytest.raises(ValueError):
+            make_queue(loop, policy='foo')
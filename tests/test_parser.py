@@ -0,0 +1,46 @@
+import pytest
+
+from pytwitcher import parser
+
+
+class TestParse:
+    def test_privmsg(self):
+        line = r'@badges=subscriber/6;display-name=Nick\sName :nick!nick@nick.tmi.twitch.tv PRIVMSG #channel :hi :)'
+        message = parser.parse(line)
+        assert message.raw == line
+        assert message.tags == {'badges': 'subscriber/6', 'display-name': 'Nick Name'}
+        assert message.prefix == 'nick!nick@nick.tmi.twitch.tv'
+        assert message.command == 'PRIVMSG'
+        assert message.params == ['#channel', 'hi :)']
+        assert message.nick == 'nick'
+        assert message.channel == '#channel'
+        assert message.text == 'hi :)'
+
+    def test_no_prefix(self):
+        message = parser.parse('PING :tmi.twitch.tv')
+        assert message.tags == {}
+        assert message.prefix is None
+        assert message.nick is None
+        assert message.command == 'PING'
+        assert message.params == ['tmi.twitch.tv']
+        assert message.channel is None
+
+    def test_no_trailing(self):
+        message = parser.parse(':nick!nick@nick.tmi.twitch.tv JOIN #channel')
+        assert message.command == 'JOIN'
+        assert message.params == ['#channel']
+
+    def test_numeric(self):
+        message = parser.parse(':tmi.twitch.tv 353 nick = #channel :a b c')
+        assert message.command == '353'
+        assert message.params == ['nick', '=', '#channel', 'a b c']
+
+    def test_empty_trailing(self):
+        message = parser.parse(':tmi.twitch.tv CAP * ACK :')
+        assert message.params == ['*', 'ACK', '']
+
+    @pytest.mark.parametrize('line', ['', '@a=b', ':prefix', '@a=b :prefix'])
+    def test_malformed(self, line):
+        message = parser.parse(line)
+        assert message.command == ''
+        assert message.params == []
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import metrics
+from pytwitcher import protocol
+
+
+class Factory:
+    encoding = 'utf8'
+
+    def __init__(self):
+        self.lines = []
+
+    def process_data(self, data):
+        self.lines.append(data)
+
+    def connection_lost(self, proto, reconnect):
+        pass
+
+
+PROTOCOLS = [protocol.IrcProtocol]
+if protocol.IrcBufferedProtocol is not None:
+    PROTOCOLS.append(protocol.IrcBufferedProtocol)
+
+
+def feed(proto, data):
+    if hasattr(proto, 'get_buffer'):
+        while data:
+            buffer = proto.get_buffer(-1)
+            size = min(len(buffer), len(data))
+            buffer[:size] = data[:size]
+            proto.buffer_updated(size)
+            data = data[size:]
+    else:
+        proto.data_received(data)
+
+
+@pytest.fixture(params=PROTOCOLS)
+def proto(request):
+    return request.param(Factory())
+
+
+class TestIrcProtocol:
+    def test_lines(self, proto):
+        feed(proto, b'PING :a\r\nPING :b\r\n')
+        assert proto.factory.lines == ['PING :a', 'PING :b']
+
+    def test_partial_line(self, proto):
+        feed(proto, b'PING :a\r\nPRIVMSG #chan')
+        assert proto.factory.lines == ['PING :a']
+        feed(proto, b'nel :hello\r')
+        assert proto.factory.lines == ['PING :a']
+        feed(proto, b'\n')
+        assert proto.factory.lines == ['PING :a', 'PRIVMSG #channel :hello']
+
+    def test_split_utf8(self, proto):
+        data = 'PRIVMSG #channel :é\r\n'.encode('utf8')
+        cut = data.index(b'\xa9')
+        feed(proto, data[:cut])
+        feed(proto, data[cut:])
+        assert proto.factory.lines == ['PRIVMSG #channel :é']
+
+    def test_bare_newline(self, proto):
+        feed(proto, b'PING :a\n\r\nPING :b\n')
+        assert proto.factory.lines == ['PING :a', 'PING :b']
+
+    def test_long_line(self, proto):
+        line = 'PRIVMSG #channel :' + 'a' * 200000
+        feed(proto, line.encode('utf8') + b'\r\n')
+        assert proto.factory.lines == [line]
+
+    def test_error_isolated(self, proto):
+        def process_data(data):
+            if data == 'BAD':
+                raise ValueError
+            proto.factory.lines.append(data)
+        proto.factory.process_data = process_data
+
+        feed(proto, b'BAD\r\nPING :a\r\n')
+        assert proto.factory.lines == ['PING :a']
+
+
+class Transport:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def close(self):
+        pass
+
+
+class TestWrite:
+    def connect(self, loop, window):
+        factory = Factory()
+        factory.loop = loop
+        factory.write_window = window
+        proto = protocol.IrcProtocol(factory)
+        proto.connection_made(Transport())
+        return proto
+
+    def test_immediate(self):
+        proto = protocol.IrcProtocol(Factory())
+        proto.connection_made(Transport())
+        proto.write('PONG :a')
+        proto.write(b'PONG :b\r\n')
+        assert proto.transport.writes == [b'PONG :a\r\n', b'PONG :b\r\n']
+
+    def test_same_iteration(self, loop):
+        proto = self.connect(loop, 0)
+        proto.write('JOIN #a')
+        proto.write('PONG :b\r\n')
+        assert proto.transport.writes == []
+        loop.run_until_complete(asyncio.sleep(0))
+        assert proto.transport.writes == [b'JOIN #a\r\nPONG :b\r\n']
+        assert proto.pending == [] and proto.pending_lines == 0
+
+    def test_window(self, loop):
+        proto = self.connect(loop, 0.05)
+        proto.write('JOIN #a')
+        loop.run_until_complete(asyncio.sleep(0.01))
+        proto.write('JOIN #b')
+        assert proto.transport.writes == []
+        loop.run_until_complete(asyncio.sleep(0.1))
+        assert proto.transport.writes == [b'JOIN #a\r\nJOIN #b\r\n']
+
+    def test_flushed_future(self, loop):
+        proto = self.connect(loop, 0)
+        written = proto.write('JOIN #a')
+        assert proto.write('JOIN #b') is written
+        assert not written.done()
+        loop.run_until_complete(written)
+        assert proto.transport.writes == [b'JOIN #a\r\nJOIN #b\r\n']
+
+        lost = proto.write('JOIN #c')
+        proto.closed = True
+        proto.connection_lost(None)
+        assert isinstance(lost.exception(), ConnectionResetError)
+
+    def test_close_flushes(self, loop):
+        proto = self.connect(loop, 1)
+        proto.write('PART #a')
+        proto.close()
+        assert proto.transport.writes == [b'PART #a\r\n']
+        assert proto._flush_handle is None
+
+    def test_flush_metrics(self, loop):
+        proto = self.connect(loop, 0)
+        proto.metrics = metrics.Metrics()
+        proto.write('JOIN #a')
+        proto.write('JOIN #b')
+        proto.flush()
+        assert proto.metrics.get('pytwitcher_lines_sent_total', ('0',)) == 2
+        histogram = proto.metrics.get('pytwitcher_flush_lines', ('0',))
+        assert histogram.count == 1 and histogram.sum == 2
+        assert histogram.buckets == metrics.SIZE_BUCKETS['pytwitcher_flush_lines']
@@ -0,0 +1,100 @@
+import pytest
+
+from pytwitcher import parser
+from pytwitcher import ratelimit
+
+
+CONFIG = {
+    'flood_delay': 30,
+    'flood_delay_join': 10,
+    'flood_delay_whisper': 1,
+    'flood_rate_elevated': 100,
+    'flood_rate_join': 20,
+    'flood_rate_normal': 20,
+    'flood_rate_whisper': 3,
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+class TestTokenBucket:
+    def test_burst(self, clock):
+        bucket = ratelimit.TokenBucket(3, 10, clock)
+        for _ in range(3):
+            assert bucket.delay() == 0
+            bucket.consume()
+        assert bucket.available == 0
+        assert bucket.delay() == 10
+
+    def test_window(self, clock):
+        bucket = ratelimit.TokenBucket(2, 10, clock)
+        bucket.consume()
+        clock.now += 4
+        bucket.consume()
+        # First token comes back 10s after being spent, not continuously
+        assert bucket.delay() == 6
+        clock.now += 6
+        assert bucket.delay() == 0
+        bucket.consume()
+        assert bucket.delay() == 4
+
+    def test_cost(self, clock):
+        bucket = ratelimit.TokenBucket(3, 10, clock)
+        bucket.consume()
+        clock.now += 1
+        bucket.consume()
+        assert bucket.delay(2) == 9
+        assert bucket.delay(3) == 10
+        # Costs over the rate are capped
+        assert bucket.delay(5) == 10
+
+
+class TestRateLimiter:
+    def test_buckets(self, clock):
+        limiter = ratelimit.RateLimiter(CONFIG, clock)
+        assert limiter.get_buckets(parser.parse('PRIVMSG #chan :hi')) == ((limiter.normal, limiter.elevated), 1)
+        assert limiter.get_buckets(parser.parse('PRIVMSG #chan :.w user hi')) == (
+            (limiter.whisper, limiter.normal, limiter.elevated), 1
+        )
+        assert limiter.get_buckets(parser.parse('JOIN #a,#b,#c')) == ((limiter.join,), 3)
+        assert limiter.get_buckets(parser.parse('PONG :tmi.twitch.tv')) == ((), 0)
+
+    def test_split(self, clock):
+        limiter = ratelimit.RateLimiter(dict(CONFIG, flood_rate_join=2), clock)
+
+        def split(line):
+            return limiter.split(line, parser.parse(line))
+
+        assert split('PRIVMSG #a :#b,#c,#d') == ['PRIVMSG #a :#b,#c,#d']
+        assert split('JOIN #a,#b') == ['JOIN #a,#b']
+        assert split('JOIN #a,#b,#c,#d,#e') == ['JOIN #a,#b', 'JOIN #c,#d', 'JOIN #e']
+
+    def test_elevated(self, clock):
+        limiter = ratelimit.RateLimiter(CONFIG, clock)
+        limiter.set_elevated('#chan', True)
+        assert limiter.get_buckets(parser.parse('PRIVMSG #chan :hi')) == ((limiter.elevated,), 1)
+        assert limiter.get_buckets(parser.parse('PRIVMSG #other :hi')) == ((limiter.normal, limiter.elevated), 1)
+        limiter.set_elevated('#chan', False)
+        assert limiter.get_buckets(parser.parse('PRIVMSG #chan :hi')) == ((limiter.normal, limiter.elevated), 1)
+
+    def test_delay(self, clock):
+        limiter = ratelimit.RateLimiter(CONFIG, clock)
+        buckets, cost = limiter.get_buckets(parser.parse('PRIVMSG #chan :hi'))
+        for _ in range(20):
+            assert limiter.delay(buckets, cost) == 0
+            limiter.consume(buckets, cost)
+        assert limiter.delay(buckets, cost) == 30
+        # Elevated channels are not held back by the normal limit
+        limiter.set_elevated('#mod', True)
+        assert limiter.delay(*limiter.get_buckets(parser.parse('PRIVMSG #mod :hi'))) == 0
@@ -0,0 +1,189 @@
+import pytest
+
+from pytwitcher import event
+from pytwitcher import parser
+from pytwitcher import registry
+
+
+PRIVMSG_LINE = '@badges=;color= :nick!nick@nick.tmi.twitch.tv PRIVMSG #channel :hello'
+JOIN_LINE = ':nick!nick@nick.tmi.twitch.tv JOIN #channel'
+
+
+async def callback(**kwargs):
+    pass
+
+
+async def other_callback(**kwargs):
+    pass
+
+
+def matched(reg, data):
+    return [list(events) for _, events in reg.get_event_matches(data)]
+
+
+class TestRegistry:
+    def test_dispatch_by_command(self):
+        reg = registry.Registry({})
+        privmsg = event.event(event.PRIVMSG, callback=callback)
+        join = event.event(event.JOIN, callback=callback)
+        reg.add_irc_event(privmsg)
+        reg.add_irc_event(join)
+
+        assert [key for key, _ in reg.irc_events_index['PRIVMSG']] == [event.PRIVMSG.re]
+        assert matched(reg, PRIVMSG_LINE) == [[privmsg]]
+        assert matched(reg, JOIN_LINE) == [[join]]
+        assert matched(reg, 'PING :tmi.twitch.tv') == []
+
+    def test_fallback(self):
+        reg = registry.Registry({})
+        privmsg = event.event(event.PRIVMSG, callback=callback)
+        custom = event.event(r'.*PRIVMSG.*', callback=callback)
+        reg.add_irc_event(privmsg)
+        reg.add_irc_event(custom, insert=True)
+
+        # Order of irc_events_re is kept inside a bucket
+        assert matched(reg, PRIVMSG_LINE) == [[custom], [privmsg]]
+        assert matched(reg, 'FOO PRIVMSG') == [[custom]]
+
+    def test_declared_command(self):
+        reg = registry.Registry({})
+        custom = event.event(r'.* JOIN .*', callback=callback, command='JOIN')
+        reg.add_irc_event(custom)
+
+        assert matched(reg, JOIN_LINE) == [[custom]]
+        assert matched(reg, 'FOO JOIN BAR') == []
+
+    def test_remove(self):
+        reg = registry.Registry({})
+        privmsg = event.event(event.PRIVMSG, callback=callback)
+        other = event.event(event.PRIVMSG, callback=other_callback)
+        reg.add_irc_event(privmsg)
+        reg.add_irc_event(other)
+        reg.remove_irc_event(privmsg)
+        assert matched(reg, PRIVMSG_LINE) == [[other]]
+
+        reg.remove_irc_event(other)
+        assert matched(reg, PRIVMSG_LINE) == []
+        assert 'PRIVMSG' not in reg.irc_events_index
+
+        # irc_events_re must stay a deque for insertions
+        reg.add_irc_event(other, insert=True)
+        assert matched(reg, PRIVMSG_LINE) == [[other]]
+
+    def test_recompile(self):
+        reg = registry.Registry({'nick': 'foo'})
+        custom = event.event(r':(?P<mask>\S+) JOIN #{nick}', callback=callback, command='JOIN')
+        reg.add_irc_event(custom)
+        assert matched(reg, ':a JOIN #foo') == [[custom]]
+
+        reg.recompile({'nick': 'bar'})
+        assert matched(reg, ':a JOIN #foo') == []
+        assert matched(reg, ':a JOIN #bar') == [[custom]]
+
+    def test_sync_callback(self):
+        reg = registry.Registry({})
+        with pytest.raises(ValueError):
+            reg.add_irc_event(event.event(event.JOIN, callback=lambda: None))
+
+    def test_command_events(self):
+        reg = registry.Registry({})
+        privmsg = event.command('PRIVMSG', callback=callback)
+        reg.add_irc_event(privmsg)
+
+        assert list(reg.get_command_events('PRIVMSG')) == [privmsg]
+        assert list(reg.get_command_events('JOIN')) == []
+        # Not part of the regex dispatch
+        assert matched(reg, PRIVMSG_LINE) == []
+
+        reg.remove_irc_event(privmsg)
+        assert list(reg.get_command_events('PRIVMSG')) == []
+
+    def test_plugin(self):
+        class Plugin:
+            @event.command('PRIVMSG')
+            async def privmsg(self, message):
+                pass
+
+            @event.event(event.JOIN)
+            async def join(self, mask, channel):
+                pass
+
+        reg = registry.Registry({})
+        plugin = Plugin()
+        reg.add_plugin(plugin)
+        handler, = reg.get_command_events('PRIVMSG')
+        assert handler.callback == plugin.privmsg.callback
+        assert handler.callback.__self__ is plugin
+        assert matched(reg, JOIN_LINE) == [[plugin.join]]
+
+        reg.remove_plugin('Plugin')
+        assert list(reg.get_command_events('PRIVMSG')) == []
+        assert matched(reg, JOIN_LINE) == []
+
+    def test_dispatch_table(self):
+        reg = registry.Registry({})
+        assert reg.dispatch_table == {}
+
+        def handle_thing():
+            pass
+
+        async def on_thing():
+            pass
+
+        reg.add_listener(handle_thing)
+        reg.add_listener(on_thing)
+        assert reg.dispatch_table['thing'] == (((handle_thing, None),), ((on_thing, None),))
+        reg.remove_listener(handle_thing)
+        assert reg.dispatch_table['thing'] == ((), ((on_thing, None),))
+        reg.remove_listener(on_thing)
+        assert 'thing' not in reg.dispatch_table
+
+    def test_command_channel_index(self):
+        reg = registry.Registry({})
+        everywhere = event.command('PRIVMSG', callback=callback)
+        one = event.command('PRIVMSG', callback=callback, channels={'#One'})
+        both = event.command('PRIVMSG', callback=other_callback, channels={'#one', '#two'})
+        for irc_event in (everywhere, one, both):
+            reg.add_irc_event(irc_event)
+
+        assert reg.get_command_events('PRIVMSG', '#one') == (everywhere, one, both)
+        assert reg.get_command_events('PRIVMSG', '#two') == (everywhere, both)
+        assert reg.get_command_events('PRIVMSG', '#three') == (everywhere,)
+        assert reg.get_command_events('PRIVMSG') == (everywhere,)
+
+        reg.remove_irc_event(everywhere)
+        assert reg.get_command_events('PRIVMSG', '#three') == ()
+        reg.remove_irc_event(one)
+        reg.remove_irc_event(both)
+        assert 'PRIVMSG' not in reg.irc_commands_index
+
+    def test_regexp_channel_restriction(self):
+        reg = registry.Registry({})
+        privmsg = event.event(event.PRIVMSG, callback=callback, channels={'#other'})
+        reg.add_irc_event(privmsg)
+        assert list(reg.get_event_matches(PRIVMSG_LINE, 'PRIVMSG', '#channel')) == []
+        assert len(list(reg.get_event_matches(PRIVMSG_LINE, 'PRIVMSG', '#other'))) == 1
+
+        # Another event on the same regexp for every channel lifts it
+        reg.add_irc_event(event.event(event.PRIVMSG, callback=other_callback))
+        assert len(list(reg.get_event_matches(PRIVMSG_LINE, 'PRIVMSG', '#channel'))) == 1
+
+
+class TestFilter:
+    def test_matches(self):
+        line = '@badges=subscriber/3;subscriber=1 :Nick!nick@nick.tmi.twitch.tv PRIVMSG #channel :!cmd arg'
+        message = parser.parse(line)
+        assert event.Filter(channels={'#Channel'}).matches(message)
+        assert not event.Filter(channels={'#other'}).matches(message)
+        assert event.Filter(users={'nick'}).matches(message)
+        assert not event.Filter(users={'other'}).matches(message)
+        assert event.Filter(tags={'subscriber': '1'}).matches(message)
+        assert event.Filter(tags={'subscriber': ('0', '1')}).matches(message)
+        assert not event.Filter(tags={'subscriber': '0'}).matches(message)
+        assert not event.Filter(tags={'mod': '1'}).matches(message)
+        assert event.Filter(prefix='!').matches(message)
+        assert not event.Filter(prefix=('?', '.')).matches(message)
+
+    def test_no_filter(self):
+        assert event.command('PRIVMSG', callback=callback).filter is None
+        assert event.command('PRIVMSG', callback=callback, prefix='!') != event.command('PRIVMSG', callback=callback)
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+
+import pytest
+
+from pytwitcher import archive
+from pytwitcher import base
+from pytwitcher import event
+from pytwitcher import replay
+
+
+@pytest.fixture
+def loop(virtual_loop):
+    return virtual_loop
+
+
+@pytest.fixture
+def bot(loop):
+    bot = base.IrcObject(loop=loop, flood_rate_normal=1, flood_delay=30)
+    yield bot
+    bot._cleanup()
+
+
+def privmsg(text, channel='#chan'):
+    return ':a!a@a.tmi.twitch.tv PRIVMSG {} :{}'.format(channel, text)
+
+
+class TestVirtualClock:
+    def test_sleep_is_instant(self, loop):
+        async def wait():
+            await asyncio.sleep(3600)
+            return loop.time()
+
+        assert loop.run_until_complete(wait()) == 3600
+
+    def test_timers_in_order(self, loop):
+        fired = []
+        loop.call_later(2, fired.append, 2)
+        loop.call_later(1, fired.append, 1)
+        loop.run_until_complete(asyncio.sleep(5))
+        assert fired == [1, 2]
+        assert loop.time() == 5
+
+
+class TestReplay:
+    def test_log(self, tmpdir, bot):
+        received = []
+
+        async def answer(message):
+            received.append(message.text)
+            # Rate limited: one line per 30 (virtual) seconds
+            await bot.send_line('PRIVMSG #chan :re {}'.format(message.text))
+
+        bot.add_irc_event(event.command('PRIVMSG', answer))
+        path = tmpdir.join('chat.log.gz')
+        with gzip.open(str(path), 'wb') as f:
+            f.write(''.join(privmsg(i) + '\r\n' for i in range(3)).encode('utf8'))
+            f.write(b'PING :tmi.twitch.tv')
+
+        runner = replay.Replay(bot, chunk_size=16, batch_size=2)
+        report = runner.replay(str(path))
+        assert report['lines'] == 4
+        assert report['sent'] == 3
+        assert report['virtual_seconds'] >= 60
+        assert received == ['0', '1', '2']
+        assert [line for _, _, line in runner.sent] == ['PRIVMSG #chan :re {}'.format(i) for i in range(3)]
+        times = [when for when, _, _ in runner.sent]
+        assert times[1] - times[0] >= 30
+
+    def test_archive_timestamps(self, tmpdir, bot, loop):
+        received = []
+
+        async def record(message):
+            received.append((loop.time(), message.text))
+
+        bot.add_irc_event(event.command('PRIVMSG', record))
+        writer = archive.ArchiveWriter(str(tmpdir))
+        writer.feed((privmsg('one') + '\r\n').encode('utf8'), 1000)
+        writer.feed((privmsg('two') + '\r\n').encode('utf8'), 1010)
+        writer.close()
+
+        report = replay.Replay(bot).replay(str(tmpdir))
+        assert received == [(1000, 'one'), (1010, 'two')]
+        assert report['virtual_seconds'] == 10
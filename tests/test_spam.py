@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import base
+from pytwitcher import event
+from pytwitcher import parser
+from pytwitcher import spam
+
+
+@pytest.fixture
+def loop(virtual_loop):
+    return virtual_loop
+
+
+def privmsg(text, channel='#chan', nick='a'):
+    return parser.parse(':{n}!{n}@{n}.tmi.twitch.tv PRIVMSG {} :{}'.format(channel, text, n=nick))
+
+
+def test_normalize():
+    assert spam.normalize('  BUY followers!!! at spam.com  ') == 'buy followers at spam com'
+    assert spam.normalize('LULLLLLLL') == spam.normalize('LULLL') == 'lull'
+
+
+def test_simhash():
+    a = spam.simhash(spam.normalize('free subs at example dot com go now'))
+    b = spam.simhash(spam.normalize('free subs at example dot com go now 1'))
+    c = spam.simhash(spam.normalize('what a play that was, gg'))
+    assert bin(a ^ b).count('1') < spam.BANDS
+    assert bin(a ^ c).count('1') > 16
+
+
+class TestRollingWindow:
+    def test_expire_and_size(self):
+        window = spam.RollingWindow(3)
+        assert window.add(0, 'a') == 1
+        assert window.add(1, 'a') == 2
+        assert window.add(2, 'b') == 1
+        # Full, the oldest goes
+        assert window.add(3, 'a') == 2
+        window.expire(2.5)
+        assert window.counts == {'a': 1}
+        window.expire(10)
+        assert window.counts == {} and window.length == 0
+
+    def test_bands(self):
+        window = spam.RollingWindow(2, bands=True)
+        window.add(0, 0b1111)
+        assert window.similar(0b1110, 1) == 0b1111
+        assert window.similar(0b1000, 1) is None
+        window.add(1, 1 << 40)
+        window.add(2, 1 << 41)
+        assert window.similar(0b1111, 0) is None
+        # 0b1111 went with its bands, the keys only differ in the band of bits 40-47
+        band = 40 // spam.BAND_BITS
+        expected = {(number, 0): {1 << 40, 1 << 41} for number in range(spam.BANDS) if number != band}
+        expected[band, 1 << 40 - band * spam.BAND_BITS] = {1 << 40}
+        expected[band, 1 << 41 - band * spam.BAND_BITS] = {1 << 41}
+        assert window.bands == expected
+
+
+class TestSpamFilter:
+    def test_drop(self, loop):
+        spam_filter = spam.SpamFilter(loop, mode=spam.DROP, window=10, threshold=2)
+        allowed = [spam_filter.allow(privmsg(text)) for text in ('spam', 'SPAM!', 'hello', 'spam')]
+        assert allowed == [True, True, True, False]
+        assert spam_filter.allow(privmsg('spam', channel='#other'))
+        loop.advance(11)
+        assert spam_filter.allow(privmsg('spam'))
+        assert spam_filter.suppressed == 1
+
+    def test_collapse(self, loop):
+        collapsed = []
+        spam_filter = spam.SpamFilter(
+            loop, window=5, threshold=1, on_collapse=lambda message, count: collapsed.append((message.text, count)),
+        )
+        for text in ('raid', 'raid', 'RAID', 'other', 'raid!'):
+            spam_filter.allow(privmsg(text))
+        assert collapsed == []
+        loop.run_until_complete(asyncio.sleep(5))
+        assert collapsed == [('raid', 3)]
+        assert spam_filter.collapsed == {}
+
+    @pytest.mark.parametrize('similarity', [None, 'simhash'])
+    def test_no_word_characters(self, loop, similarity):
+        spam_filter = spam.SpamFilter(loop, mode=spam.DROP, threshold=2, similarity=similarity)
+        for text in ('❤️', '😂', '🔥', '👍', '!!!', '???'):
+            assert spam_filter.allow(privmsg(text))
+        assert spam_filter.allow(privmsg('🔥'))
+        assert not spam_filter.allow(privmsg('🔥 '))
+
+    def test_simhash(self, loop):
+        spam_filter = spam.SpamFilter(loop, mode=spam.DROP, threshold=1, similarity='simhash')
+        assert spam_filter.allow(privmsg('join my discord server for free subs and followers now'))
+        assert not spam_filter.allow(privmsg('join my discord server for free subs and followers now 123'))
+        assert spam_filter.allow(privmsg('nice play'))
+
+    def test_bot(self, loop):
+        bot = base.IrcObject(loop=loop, spam_filter=spam.COLLAPSE, spam_threshold=1, spam_window=1)
+        received = []
+        reports = []
+
+        async def record(message):
+            received.append(message.text)
+
+        def handle_spam(message, count):
+            reports.append((message.text, count))
+
+        bot.add_irc_event(event.command('PRIVMSG', record))
+        bot.add_listener(handle_spam)
+        for i in range(5):
+            bot.process_data(':u{0}!u{0}@u{0}.tmi.twitch.tv PRIVMSG #chan :follow me'.format(i))
+        bot.process_data(':tmi.twitch.tv ROOMSTATE #chan')
+        loop.run_until_complete(asyncio.sleep(2))
+        assert received == ['follow me']
+        assert reports == [('follow me', 4)]
+        bot._cleanup()
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import outbound
+from pytwitcher import parser
+from pytwitcher import state
+from pytwitcher import utils
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(clock):
+    return state.StateCache(clock)
+
+
+class TestStateCache:
+    def test_merge_roomstate(self, cache):
+        cache.update_room('#chan', utils.Tags('emote-only=0;followers-only=-1;r9k=0;room-id=1;slow=0;subs-only=0'))
+        cache.update_room('#chan', utils.Tags('room-id=1;slow=30'))
+        room = cache.get('#chan')
+        assert (room.room_id, room.slow, room.subs_only, room.followers_only) == ('1', 30, 0, -1)
+        cache.update_room('#chan', utils.Tags('followers-only=10'))
+        assert (room.slow, room.followers_only) == (30, 10)
+
+    def test_userstate(self, cache):
+        assert cache.get('#chan') is None
+        assert not cache.is_moderator('#chan')
+        cache.update_user('#chan', utils.Tags('badges=moderator/1;mod=1'))
+        assert cache.is_moderator('#chan')
+        cache.update_user('#chan', utils.Tags('badges=subscriber/0;mod=0'))
+        assert not cache.is_moderator('#chan')
+        assert cache.get('#chan').is_subscriber
+
+    def test_global(self, cache):
+        cache.update_global(utils.Tags(r'display-name=Bot;user-id=42'))
+        assert cache.global_state['user-id'] == '42'
+
+
+class TestRejects:
+    def test_unknown_channel(self, cache):
+        assert cache.rejects(parser.parse('PRIVMSG #chan :hi')) is None
+
+    def test_subs_only(self, cache):
+        cache.update_room('#chan', utils.Tags('subs-only=1'))
+        assert cache.rejects(parser.parse('PRIVMSG #chan :hi')) == 'msg_subsonly'
+        assert cache.rejects(parser.parse('PRIVMSG #chan :.w someone hi')) is None
+        cache.update_user('#chan', utils.Tags('badges=subscriber/3'))
+        assert cache.rejects(parser.parse('PRIVMSG #chan :hi')) is None
+
+    def test_slow(self, cache, clock):
+        cache.update_room('#chan', utils.Tags('slow=30'))
+        assert cache.rejects(parser.parse('PRIVMSG #chan :hi')) is None
+        cache.sent(parser.parse('PRIVMSG #chan :hi'))
+        clock.now = 10
+        assert cache.rejects(parser.parse('PRIVMSG #chan :again')) == 'msg_slowmode'
+        clock.now = 30
+        assert cache.rejects(parser.parse('PRIVMSG #chan :again')) is None
+
+    def test_r9k(self, cache):
+        cache.update_room('#chan', utils.Tags('r9k=1'))
+        cache.sent(parser.parse('PRIVMSG #chan :hi'))
+        assert cache.rejects(parser.parse('PRIVMSG #chan :hi')) == 'msg_r9k'
+        assert cache.rejects(parser.parse('PRIVMSG #chan :hello')) is None
+
+    def test_moderator_exempt(self, cache):
+        cache.update_room('#chan', utils.Tags('subs-only=1;slow=30'))
+        cache.update_user('#chan', utils.Tags('badges=broadcaster/1'))
+        cache.sent(parser.parse('PRIVMSG #chan :hi'))
+        assert cache.rejects(parser.parse('PRIVMSG #chan :hi')) is None
+
+
+class Limiter:
+    def split(self, line, message):
+        return [line]
+
+    def get_buckets(self, message):
+        return (), 1
+
+    def delay(self, buckets, cost):
+        return 0
+
+    def consume(self, buckets, cost):
+        self.consumed = getattr(self, 'consumed', 0) + cost
+
+
+def test_queue_skips_rejected(cache):
+    loop = asyncio.new_event_loop()
+    try:
+        limiter = Limiter()
+        queue = outbound.OutboundQueue(loop, limiter, state=cache)
+        cache.update_room('#chan', utils.Tags('slow=30'))
+        lines = []
+        queue.resume(lines.append)
+        first = queue.put('PRIVMSG #chan :one')
+        second = queue.put('PRIVMSG #chan :two')
+        queue.send_ready()
+        assert lines == ['PRIVMSG #chan :one']
+        assert first.result()
+        with pytest.raises(state.MessageRejected):
+            second.result()
+        assert limiter.consumed == 1
+        assert queue.size == 0
+    finally:
+        loop.close()
+
+
+def test_queue_parses_once(cache, monkeypatch):
+    loop = asyncio.new_event_loop()
+    try:
+        queue = outbound.OutboundQueue(loop, Limiter(), state=cache)
+        cache.update_room('#chan', utils.Tags('r9k=1'))
+        parsed = []
+        parse = parser.parse
+        monkeypatch.setattr(parser, 'parse', lambda line: parsed.append(line) or parse(line))
+        lines = []
+        queue.resume(lines.append)
+        queue.put('PRIVMSG #chan :hi')
+        queue.send_ready()
+        assert lines == parsed == ['PRIVMSG #chan :hi']
+        assert cache.get('#chan').last_text == 'hi'
+    finally:
+        loop.close()
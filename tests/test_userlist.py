@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from pytwitcher import parser
+from pytwitcher.plugins import userlist
+
+
+class FakeConnection:
+    connected = True
+
+
+class FakeBot:
+    def __init__(self):
+        self.config = {'nick': 'Bot'}
+        self.connections = [FakeConnection()]
+        self.channels = {}
+
+
+@pytest.fixture
+def plugin():
+    return userlist.UserList(FakeBot())
+
+
+def feed(plugin, *lines):
+    handlers = {
+        '353': plugin.names,
+        '366': plugin.end_of_names,
+        'JOIN': plugin.join,
+        'PART': plugin.part,
+        'PRIVMSG': plugin.privmsg,
+    }
+    loop = asyncio.new_event_loop()
+    try:
+        for line in lines:
+            message = parser.parse(line)
+            loop.run_until_complete(handlers[message.command].callback(message))
+    finally:
+        loop.close()
+
+
+def join(plugin, channel):
+    feed(plugin, ':bot!bot@bot.tmi.twitch.tv JOIN {}'.format(channel))
+
+
+class TestUserList:
+    def test_names(self, plugin):
+        join(plugin, '#chan')
+        feed(
+            plugin,
+            ':bot.tmi.twitch.tv 353 bot = #chan :a b',
+            ':bot.tmi.twitch.tv 353 bot = #chan :c',
+            ':bot.tmi.twitch.tv 366 bot #chan :End of /NAMES list',
+        )
+        assert plugin.get_users('#chan') == {'bot', 'a', 'b', 'c'}
+        assert plugin.count('#Chan') == 4
+        assert not plugin.receiving_names
+
+    def test_join_part(self, plugin):
+        join(plugin, '#chan')
+        feed(plugin, ':a!a@a.tmi.twitch.tv JOIN #chan', ':b!b@b.tmi.twitch.tv JOIN #chan')
+        assert plugin.is_in('a', '#chan')
+        feed(plugin, ':a!a@a.tmi.twitch.tv PART #chan')
+        assert not plugin.is_in('a', '#chan')
+        assert plugin.get_channels('a') == frozenset()
+        assert plugin.count('#chan') == 2
+
+    def test_not_joined(self, plugin):
+        feed(plugin, ':a!a@a.tmi.twitch.tv JOIN #chan')
+        assert plugin.count('#chan') == 0
+        assert 'a' not in plugin.user_channels
+
+    def test_privmsg_presence(self, plugin):
+        join(plugin, '#chan')
+        feed(plugin, '@badges= :a!a@a.tmi.twitch.tv PRIVMSG #chan :hi')
+        assert plugin.is_in('a', '#chan')
+        assert plugin.get_channels('a') == {'#chan'}
+
+    def test_reverse_index(self, plugin):
+        join(plugin, '#one')
+        join(plugin, '#two')
+        feed(plugin, ':a!a@a.tmi.twitch.tv JOIN #one')
+        assert plugin.user_channels['a'] == '#one'
+        feed(plugin, ':a!a@a.tmi.twitch.tv JOIN #two')
+        assert plugin.get_channels('a') == {'#one', '#two'}
+        feed(plugin, ':a!a@a.tmi.twitch.tv PART #one')
+        assert plugin.user_channels['a'] == '#two'
+
+    def test_own_part(self, plugin):
+        join(plugin, '#one')
+        join(plugin, '#two')
+        feed(plugin, ':a!a@a.tmi.twitch.tv JOIN #one', ':a!a@a.tmi.twitch.tv JOIN #two',
+             ':b!b@b.tmi.twitch.tv JOIN #one')
+        feed(plugin, ':bot!bot@bot.tmi.twitch.tv PART #one')
+        assert plugin.count('#one') == 0
+        assert plugin.get_channels('a') == {'#two'}
+        assert plugin.get_channels('b') == frozenset()
+
+    def test_connection_lost(self, plugin):
+        first, second = FakeConnection(), FakeConnection()
+        plugin.bot.connections = [first, second]
+        plugin.bot.channels = {'#one': first, '#two': second}
+        join(plugin, '#one')
+        join(plugin, '#two')
+        feed(plugin, ':a!a@a.tmi.twitch.tv JOIN #one', ':a!a@a.tmi.twitch.tv JOIN #two')
+
+        second.connected = False
+        plugin.handle_connection_lost()
+        assert plugin.count('#two') == 0
+        assert plugin.get_channels('a') == {'#one'}
+
+        first.connected = False
+        plugin.handle_connection_lost()
+        assert not plugin.channels
+        assert not plugin.user_channels
@@ -0,0 +1,65 @@
+import pytest
+
+from pytwitcher import utils
+
+
+@pytest.mark.parametrize('line, command', [
+    ('PING :tmi.twitch.tv', 'PING'),
+    ('RECONNECT', 'RECONNECT'),
+    (':tmi.twitch.tv 376 nick :>', '376'),
+    (':nick!nick@nick.tmi.twitch.tv JOIN #channel', 'JOIN'),
+    ('@badges=;color= :nick!nick@nick.tmi.twitch.tv PRIVMSG #channel :hello', 'PRIVMSG'),
+    ('@badges=;color= :tmi.twitch.tv GLOBALUSERSTATE', 'GLOBALUSERSTATE'),
+    ('@badges=', ''),
+])
+def test_get_command(line, command):
+    assert utils.get_command(line) == command
+
+
+def test_decode():
+    assert utils.decode('') == {}
+    assert utils.decode(r'a=1;b=;c=x\sy\:z') == {'a': '1', 'b': '', 'c': 'x y;z'}
+    assert utils.decode(utils.Tags(r'a=1;b=;c=x\sy\:z')) == {'a': '1', 'b': '', 'c': 'x y;z'}
+
+
+class TestTags:
+    RAW = r'badges=subscriber/6,premium/1;color=#FF0000;display-name=Nick\sName;emotes=;flag'
+
+    def test_getitem(self):
+        tags = utils.Tags(self.RAW)
+        assert tags['badges'] == 'subscriber/6,premium/1'
+        assert tags['color'] == '#FF0000'
+        assert tags['display-name'] == 'Nick Name'
+        assert tags['emotes'] == ''
+        assert tags['flag'] == ''
+        assert 'msg-id' not in tags
+        with pytest.raises(KeyError):
+            tags['mod']
+        assert tags.get('mod') is None
+
+    def test_prefix_key(self):
+        # `color` must not match `user-color`
+        tags = utils.Tags('user-color=1;color=2')
+        assert tags['color'] == '2'
+
+    def test_matches_decode(self):
+        tags = utils.Tags(self.RAW)
+        assert dict(tags) == utils.decode(self.RAW)
+        assert len(tags) == 5
+        assert tags == utils.decode(self.RAW)
+
+    def test_empty(self):
+        tags = utils.Tags('')
+        assert not tags
+        assert len(tags) == 0
+        assert 'a' not in tags
+
+    def test_memoized(self):
+        first = utils.Tags('color=#' + 'FF0000')['color']
+        second = utils.Tags('color=#' + 'FF0000')['color']
+        assert first is second
+
+    def test_badges(self):
+        tags = utils.Tags(self.RAW)
+        assert tags.badges == {'subscriber': '6', 'premium': '1'}
+        assert utils.Tags('').badges == {}
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from pytwitcher import base
+from pytwitcher import event
+from pytwitcher import parser
+from pytwitcher import spam
+from pytwitcher import workers
+
+
+class Echo:
+    def __init__(self, bot):
+        self.bot = bot
+
+    @event.command('PRIVMSG')
+    async def privmsg(self, message):
+        await self.bot.send_line('PRIVMSG {} :{} {}'.format(message.channel, os.getpid(), message.text))
+
+
+class FakeProtocol:
+    def __init__(self):
+        self.lines = []
+        self.closed = False
+        self.reads = 0
+
+    def write(self, data):
+        self.lines.append(data)
+
+
+def test_get_worker(loop):
+    bot = base.IrcObject(loop=loop)
+    pool = workers.WorkerPool(bot, 4, [])
+    first = parser.parse(':a!a@a PRIVMSG #chan :hi')
+    second = parser.parse(':b!b@b PRIVMSG #chan :hi')
+    assert pool.get_worker(first) == pool.get_worker(second)
+    assert pool.get_worker(parser.parse('PING :tmi.twitch.tv')) == 0
+    bot._cleanup()
+
+
+def test_worker_config(loop, tmpdir):
+    config = dict(base.IrcObject.DEFAULTS, archive_dir=str(tmpdir), spam_filter=spam.DROP, password='oauth:x', x=1)
+    config = workers.worker_config(config)
+    assert 'archive_dir' not in config and 'password' not in config
+    assert config['x'] == 1
+    worker = workers.WorkerBot(0, loop=loop, **config)
+    assert worker.connections == []
+    assert worker.archive is None and worker.spam_filter is None
+    worker._cleanup()
+    assert not tmpdir.listdir()
+
+
+def test_backpressure(loop):
+    bot = base.IrcObject(loop=loop)
+    calls = []
+    bot.connections[0].pause_reading = lambda: calls.append('pause')
+    bot.connections[0].resume_reading = lambda: calls.append('resume')
+    pool = workers.WorkerPool(bot, 2, [])
+    bot.workers = pool
+    pool.pipe_full(0)
+    pool.pipe_full(1)
+    pool.pipe_drained(0)
+    assert calls == ['pause']
+    # Still paused by the dispatcher
+    bot.dispatcher.paused = True
+    pool.pipe_drained(1)
+    assert calls == ['pause']
+    bot.dispatcher.paused = False
+    bot.resume_reading()
+    assert calls == ['pause', 'resume']
+    bot._cleanup()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs fork')
+def test_pool(loop):
+    bot = base.IrcObject(loop=loop)
+    conn = bot.connections[0]
+    conn.protocol = FakeProtocol()
+    conn.process_data(':tmi.twitch.tv 376 justinfan :>')
+
+    pool = workers.WorkerPool(bot, 2, [__name__ + '.Echo'], context='fork')
+    loop.run_until_complete(pool.start())
+    try:
+        for channel in ('#a', '#b', '#c', '#d'):
+            for i in range(3):
+                bot.process_data('@color= :nick!nick@nick PRIVMSG {} :{}'.format(channel, i))
+
+        async def wait():
+            while len(conn.protocol.lines) < 12:
+                await asyncio.sleep(0.01)
+        loop.run_until_complete(asyncio.wait_for(wait(), 10))
+    finally:
+        pool.close()
+        bot._cleanup()
+
+    lines = [line.split(' ', 3) for line in conn.protocol.lines]
+    by_channel = {}
+    for _, channel, pid, text in lines:
+        by_channel.setdefault(channel, []).append((pid, text))
+    for replies in by_channel.values():
+        # One worker per channel, in order
+        assert len({pid for pid, _ in replies}) == 1
+        assert [text for _, text in replies] == ['0', '1', '2']
+    assert str(os.getpid()) not in {pid for _, _, pid, _ in lines}